@@ -1,3 +1,187 @@
+"""
+Admin preparado para tabelas grandes (milhões de transações e contas):
+
+- ``EstimatedCountPaginator``: no PostgreSQL usa a estimativa do planner
+  (``EXPLAIN``) em vez de ``COUNT(*)`` quando passa de ``EXACT_COUNT_THRESHOLD``;
+- ``show_full_result_count = False``: sem a segunda contagem da tabela inteira;
+- ``list_select_related`` cobrindo o que ``__str__``/``list_display`` acessam;
+- chaves estrangeiras por ``raw_id_fields`` ou autocomplete (nunca um
+  ``<select>`` com todas as linhas), e nenhum ``list_filter`` por chave
+  estrangeira (listaria todas as linhas da tabela relacionada na barra
+  lateral): nesses casos a busca cobre o nome relacionado;
+- ``date_hierarchy`` cujos níveis são descobertos com consultas ``EXISTS`` por
+  período (busca no índice de data) em vez de ``SELECT DISTINCT`` na tabela.
+"""
+import json
+from datetime import datetime, timedelta
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .models import BalanceAuditLog, DeletionJob, LoyaltyAccount, LoyaltyProgram, PointsTransaction, UserShard, UserWallet
+
+EXACT_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator com contagem estimada pelo planner para resultados grandes (só PostgreSQL)."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate > EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class DateProbeQuerySet:
+    """
+    Envolve o queryset do changelist para o ``date_hierarchy``: ``dates()`` e
+    ``datetimes()`` testam cada ano/mês/dia do intervalo com ``exists()``, o
+    que vira uma busca no índice de data em vez de um ``DISTINCT`` sobre todas
+    as linhas. O resto é repassado ao queryset original.
+    """
+
+    def __init__(self, queryset):
+        self._queryset = queryset
+
+    def __getattr__(self, name):
+        return getattr(self._queryset, name)
+
+    def __iter__(self):
+        return iter(self._queryset)
+
+    def __len__(self):
+        return len(self._queryset)
+
+    def _periods(self, field_name, kind):
+        bounds = self._queryset.order_by(field_name).values_list(field_name, flat=True)
+        first, last = bounds.first(), bounds.reverse().first()
+        if first is None or last is None:
+            return
+        if timezone.is_aware(first):
+            first, last = timezone.localtime(first), timezone.localtime(last)
+        start = datetime(first.year, first.month if kind != 'year' else 1, first.day if kind == 'day' else 1)
+        while start.date() <= last.date():
+            if kind == 'year':
+                end = start.replace(year=start.year + 1)
+            elif kind == 'month':
+                end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+            else:
+                end = start + timedelta(days=1)
+            yield start, end
+            start = end
+
+    def _probe(self, field_name, kind, aware):
+        for start, end in self._periods(field_name, kind):
+            lower, upper = (timezone.make_aware(start), timezone.make_aware(end)) if aware else (start.date(), end.date())
+            if self._queryset.filter(**{f'{field_name}__gte': lower, f'{field_name}__lt': upper}).exists():
+                yield lower
+
+    def datetimes(self, field_name, kind, *args, **kwargs):
+        return list(self._probe(field_name, kind, aware=True))
+
+    def dates(self, field_name, kind, *args, **kwargs):
+        return list(self._probe(field_name, kind, aware=False))
+
+
+class LargeTableChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        if self.date_hierarchy:
+            self.queryset = DateProbeQuerySet(self.queryset)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
+
+
+@admin.register(LoyaltyProgram)
+class LoyaltyProgramAdmin(admin.ModelAdmin):
+    list_display = ['name', 'currency_type', 'custom_rate', 'validity_months', 'is_active', 'is_user_created']
+    list_filter = ['currency_type', 'is_active', 'is_user_created']
+    list_select_related = ['created_by']
+    search_fields = ['name']
+    raw_id_fields = ['created_by']
+
+
+@admin.register(UserWallet)
+class UserWalletAdmin(LargeTableAdmin):
+    list_display = ['wallet_name', 'user', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['wallet_name']
+    raw_id_fields = ['user']
+    readonly_fields = ['change_seq']
+
+
+@admin.register(LoyaltyAccount)
+class LoyaltyAccountAdmin(LargeTableAdmin):
+    list_display = ['name', 'program', 'wallet', 'current_balance', 'average_cost', 'is_active', 'last_updated']
+    list_select_related = ['program', 'wallet__user']
+    list_filter = ['is_active']
+    search_fields = ['name', 'account_number', 'program__name']
+    autocomplete_fields = ['program', 'wallet']
+    readonly_fields = ['change_seq', 'opening_average_cost']
+
+
+@admin.register(PointsTransaction)
+class PointsTransactionAdmin(LargeTableAdmin):
+    list_display = ['id', 'transaction_date', 'transaction_type', 'amount', 'cost', 'origin_account', 'destination_account']
+    list_display_links = ['id', 'transaction_date']
+    # LoyaltyAccount.__str__ usa o programa; sem ele seriam duas consultas por linha.
+    list_select_related = ['origin_account__program', 'destination_account__program']
+    list_filter = ['transaction_type']
+    date_hierarchy = 'transaction_date'
+    raw_id_fields = ['origin_account', 'destination_account']
+    readonly_fields = [
+        'change_seq', 'created_at', 'origin_balance_after', 'origin_average_cost_after',
+        'destination_balance_after', 'destination_average_cost_after',
+    ]
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'target_type', 'target_id', 'user', 'status', 'processed', 'total', 'created_at']
+    list_filter = ['status', 'target_type']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+
+
+@admin.register(BalanceAuditLog)
+class BalanceAuditLogAdmin(LargeTableAdmin):
+    list_display = ['id', 'created_at', 'account_id', 'operation', 'balance_before', 'balance_after', 'transaction_id', 'request_id']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+
+    # Só inserção: nada é editado nem removido pelo admin.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
-# Register your models here.
+@admin.register(UserShard)
+class UserShardAdmin(admin.ModelAdmin):
+    list_display = ['user', 'alias', 'is_moving', 'updated_at']
+    list_filter = ['alias', 'is_moving']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    # Mudar de shard exige mover os dados: use `manage.py move_user_shard`.
+    readonly_fields = ['alias', 'is_moving']
@@ -0,0 +1,99 @@
+"""
+Alocação de uma venda entre as contas do usuário.
+
+O comprador paga por faixas (``price_tiers``: preço por milheiro e, opcionalmente,
+quanto aceita nesse preço). Como o lucro de cada milha vendida é o preço da
+faixa menos o custo médio da conta de onde ela sai, e os limites por programa só
+restringem quanto sai de cada grupo de contas, o guloso é ótimo: as faixas mais
+caras são preenchidas com as milhas de menor custo médio, até o alvo, o fim das
+faixas ou o ponto em que a próxima milha daria prejuízo. Depois da ordenação é
+uma passagem só sobre faixas e contas (dois ponteiros).
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+THOUSAND = Decimal('1000.0')
+
+
+def _money(value):
+    return value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def allocate_sale(accounts, target_amount, price_tiers, program_limits=None, allow_loss=False):
+    """
+    ``accounts`` com ``program`` carregado; ``price_tiers`` é uma lista de
+    ``{'sale_price_per_1000_miles', 'max_amount' (opcional)}``;
+    ``program_limits`` é ``{program_id: quantidade máxima}``.
+    """
+    program_limits = dict(program_limits or {})
+    tiers = sorted(price_tiers, key=lambda tier: tier['sale_price_per_1000_miles'], reverse=True)
+    candidates = sorted(
+        (account for account in accounts if account.current_balance > 0),
+        key=lambda account: (account.average_cost or Decimal('0.00'), account.pk),
+    )
+
+    allocations = {}
+    tier_fills = [Decimal('0.00')] * len(tiers)
+    remaining_target = target_amount
+    tier_index, tier_left = 0, None
+    for account in candidates:
+        cost = account.average_cost or Decimal('0.00')
+        available = min(account.current_balance, program_limits.get(account.program_id, account.current_balance))
+        while available > 0 and remaining_target > 0 and tier_index < len(tiers):
+            tier = tiers[tier_index]
+            price = tier['sale_price_per_1000_miles']
+            if price <= cost and not allow_loss:
+                # As próximas contas custam ainda mais e as próximas faixas pagam ainda menos.
+                remaining_target = Decimal('0.00')
+                break
+            if tier_left is None:
+                tier_left = tier.get('max_amount') or remaining_target
+            amount = min(available, tier_left, remaining_target)
+
+            item = allocations.setdefault(account.pk, {
+                "loyalty_account_id": account.pk,
+                "loyalty_account_name": account.name,
+                "program_id": account.program_id,
+                "program_name": account.program.name,
+                "average_cost_per_thousand": _money(cost),
+                "amount": Decimal('0.00'),
+                "revenue": Decimal('0.00'),
+                "cost": Decimal('0.00'),
+            })
+            item["amount"] += amount
+            item["revenue"] += amount / THOUSAND * price
+            item["cost"] += amount / THOUSAND * cost
+            tier_fills[tier_index] += amount
+
+            available -= amount
+            remaining_target -= amount
+            tier_left -= amount
+            if account.program_id in program_limits:
+                program_limits[account.program_id] -= amount
+            if tier_left <= 0:
+                tier_index, tier_left = tier_index + 1, None
+
+    results = list(allocations.values())
+    for item in results:
+        item["profit"] = _money(item["revenue"] - item["cost"])
+        item["revenue"], item["cost"] = _money(item["revenue"]), _money(item["cost"])
+
+    total_amount = sum((item["amount"] for item in results), Decimal('0.00'))
+    total_revenue = sum((item["revenue"] for item in results), Decimal('0.00'))
+    total_cost = sum((item["cost"] for item in results), Decimal('0.00'))
+    return {
+        "target_amount": target_amount,
+        "allocated_amount": total_amount,
+        "unallocated_amount": target_amount - total_amount,
+        "total_estimated_sale_value": total_revenue,
+        "total_estimated_cost_value": total_cost,
+        "estimated_profit": total_revenue - total_cost,
+        "allocations": results,
+        "tiers": [
+            {
+                "sale_price_per_1000_miles": tier['sale_price_per_1000_miles'],
+                "max_amount": tier.get('max_amount'),
+                "allocated_amount": filled,
+            }
+            for tier, filled in zip(tiers, tier_fills)
+        ],
+    }
@@ -4,3 +4,27 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import sharding, signals  # noqa: F401
+        from .events import broker
+        from .memo import simulation_cache
+
+        broker.add_listener(simulation_cache.on_event)
+
+        post_migrate.connect(_ensure_search_indexes, sender=self)
+        if sharding.is_enabled():
+            sharding.connect_signals()
+            post_migrate.connect(sharding.prepare_shard, sender=self)
+
+
+def _ensure_search_indexes(using, **kwargs):
+    # Migrations que reconstroem tabelas no SQLite descartam os triggers da busca FTS5.
+    from django.db import connections
+    from .search import ensure_search_indexes
+
+    # No PostgreSQL os índices (e as extensões) ficam só nas migrations.
+    connection = connections[using]
+    if connection.vendor == 'sqlite' and 'api_pointstransaction' in connection.introspection.table_names():
+        ensure_search_indexes(connection)
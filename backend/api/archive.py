@@ -0,0 +1,359 @@
+"""
+Arquivo frio de transações antigas.
+
+``manage.py archive_transactions`` move as transações anteriores ao corte
+(sempre o início de um mês, em UTC) da tabela quente para arquivos Arrow IPC
+comprimidos em ``ARCHIVE_ROOT/user=<id>/month=<AAAA-MM>/``. Cada execução grava
+um arquivo novo por mês afetado e o manifesto (``ArchivedMonth``) só passa a
+apontar para ele quando a transação do banco é confirmada, então uma falha no
+meio do caminho nunca deixa linhas duplicadas ou perdidas.
+
+Por conta, ``ArchiveCheckpoint`` guarda o saldo de abertura no corte e os
+totais arquivados que o resumo soma aos da tabela quente. A listagem de
+transações lê o arquivo (memory-mapped) quando o período pedido alcança meses
+arquivados.
+
+Requer ``pyarrow`` (dependência opcional).
+"""
+import heapq
+import itertools
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q, Sum
+
+from .ledger import BALANCE_FIELDS, account_delta, is_credit_to
+from .models import ArchiveCheckpoint, ArchivedMonth, LoyaltyAccount, PointsTransaction
+from .partitioning import month_start
+from .sharding import atomic, on_commit
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pragma: no cover - dependência opcional
+    pa = pc = None
+
+ARCHIVE_FIELDS = [
+    'id', 'transaction_type', 'amount', 'cost', 'origin_account_id', 'destination_account_id',
+    'bonus_percentage', 'description', 'transaction_date', 'created_at', 'change_seq',
+    *BALANCE_FIELDS,
+]
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImproperlyConfigured("O arquivo frio de transações requer o pacote 'pyarrow'.")
+
+
+def archive_schema():
+    require_pyarrow()
+    timestamp = pa.timestamp('us', tz='UTC')
+    return pa.schema([
+        ('id', pa.int64()),
+        ('transaction_type', pa.int8()),
+        ('amount', pa.decimal128(12, 2)),
+        ('cost', pa.decimal128(12, 2)),
+        ('origin_account_id', pa.int64()),
+        ('destination_account_id', pa.int64()),
+        ('bonus_percentage', pa.decimal128(5, 2)),
+        ('description', pa.string()),
+        ('transaction_date', timestamp),
+        ('created_at', timestamp),
+        ('change_seq', pa.int64()),
+        *[(field, pa.decimal128(12, 2)) for field in BALANCE_FIELDS],
+    ])
+
+
+def archive_root():
+    return Path(settings.ARCHIVE_ROOT)
+
+
+def read_archive_file(relative_path, expression=None):
+    """Lê um arquivo do manifesto via memory map, aplicando o filtro ``expression``."""
+    require_pyarrow()
+    with pa.memory_map(str(archive_root() / relative_path)) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.filter(expression) if expression is not None else table
+
+
+def _write_archive_file(user_id, month, table):
+    relative_path = Path(f"user={user_id}") / f"month={month:%Y-%m}" / f"part-{uuid.uuid4().hex[:12]}.arrow"
+    path = archive_root() / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    options = pa.ipc.IpcWriteOptions(compression=settings.ARCHIVE_COMPRESSION or None)
+    with pa.OSFile(str(path), 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return str(relative_path)
+
+
+def _remove_archive_file(relative_path):
+    (archive_root() / relative_path).unlink(missing_ok=True)
+
+
+def archive_user_transactions(user, cutoff):
+    """
+    Arquiva as transações do usuário anteriores a ``cutoff``. Retorna o número
+    de transações movidas.
+    """
+    require_pyarrow()
+    cutoff = month_start(cutoff)
+    accounts = {account.pk: account for account in LoyaltyAccount.objects.filter(wallet__user=user)}
+    if not accounts:
+        return 0
+
+    user_filter = Q(origin_account_id__in=accounts) | Q(destination_account_id__in=accounts)
+    rows = list(
+        PointsTransaction.objects.filter(user_filter, transaction_date__lt=cutoff)
+        .order_by('transaction_date', 'id').values(*ARCHIVE_FIELDS)
+    )
+    if not rows:
+        return 0
+
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[month_start(row['transaction_date']).date()].append(row)
+
+    schema = archive_schema()
+    replaced_files = []
+    written_files = []
+    try:
+        with atomic():
+            for month, month_rows in sorted(by_month.items()):
+                table = pa.Table.from_pylist(month_rows, schema=schema)
+                manifest = ArchivedMonth.objects.select_for_update().filter(user=user, month=month).first()
+                if manifest is not None:
+                    # Mês já arquivado (ex: transação retroativa): regrava o mês inteiro num arquivo novo.
+                    previous = read_archive_file(manifest.path)
+                    previous = previous.filter(pc.invert(pc.is_in(previous['id'], value_set=table['id'])))
+                    # Arquivos antigos podem não ter as colunas de saldo corrente (preenchidas com nulo).
+                    table = pa.concat_tables([previous, table], promote_options='default').sort_by([('transaction_date', 'ascending'), ('id', 'ascending')])
+                    replaced_files.append(manifest.path)
+                else:
+                    manifest = ArchivedMonth(user=user, month=month)
+                manifest.path = _write_archive_file(user.pk, month, table)
+                written_files.append(manifest.path)
+                manifest.row_count = table.num_rows
+                manifest.save()
+
+            _update_checkpoints(accounts, rows, cutoff, user_filter)
+
+            ids = [row['id'] for row in rows]
+            for start in range(0, len(ids), 1000):
+                # Delete direto (sem sinais): as linhas continuam existindo no arquivo, então não geram tombstones de sync.
+                chunk = PointsTransaction.objects.filter(pk__in=ids[start:start + 1000])
+                chunk._raw_delete(chunk.db)
+
+            on_commit(lambda: [_remove_archive_file(path) for path in replaced_files])
+    except Exception:
+        for path in written_files:
+            _remove_archive_file(path)
+        raise
+    return len(rows)
+
+
+def _update_checkpoints(accounts, archived_rows, cutoff, user_filter):
+    archived = [PointsTransaction(**row) for row in archived_rows]
+    touched = {pk for tx in archived for pk in (tx.origin_account_id, tx.destination_account_id) if pk in accounts}
+
+    # Saldo no corte = saldo atual menos o efeito de tudo que continua na tabela quente a partir do corte.
+    later = [
+        PointsTransaction(**row) for row in PointsTransaction.objects.filter(
+            user_filter, transaction_date__gte=cutoff
+        ).values('transaction_type', 'amount', 'bonus_percentage', 'origin_account_id', 'destination_account_id')
+    ]
+
+    for account_id in touched:
+        account = accounts[account_id]
+        checkpoint = ArchiveCheckpoint.objects.filter(account=account).first() or ArchiveCheckpoint(account=account)
+        checkpoint.cutoff = cutoff
+        checkpoint.opening_balance = account.current_balance - sum(
+            (account_delta(tx, account_id) for tx in later), Decimal('0.00')
+        )
+        # Custo médio no corte: o gravado na última transação arquivada ou, sem créditos
+        # posteriores ao corte, o custo médio atual.
+        last_archived = [tx for tx in archived if account_id in (tx.origin_account_id, tx.destination_account_id)][-1]
+        side = 'origin' if last_archived.origin_account_id == account_id else 'destination'
+        stored_avg = getattr(last_archived, f'{side}_average_cost_after')
+        credited_later = any(is_credit_to(tx, account_id) for tx in later)
+        if stored_avg is not None:
+            checkpoint.opening_average_cost = stored_avg
+        else:
+            checkpoint.opening_average_cost = None if credited_later else account.average_cost
+
+        for tx in archived:
+            if account_id not in (tx.origin_account_id, tx.destination_account_id):
+                continue
+            checkpoint.archived_count += 1
+            if tx.destination_account_id == account_id and tx.transaction_type in (1, 2) and tx.cost and tx.cost > 0:
+                checkpoint.acquisition_cost += tx.cost
+            if tx.origin_account_id == account_id and tx.transaction_type == 4 and tx.cost is not None:
+                checkpoint.points_sold += tx.amount
+                checkpoint.sales_revenue += tx.cost
+        checkpoint.save()
+
+
+def archive_transactions(cutoff, users=None):
+    """Arquiva todos os usuários (ou só ``users``) com transações anteriores ao corte."""
+    from django.contrib.auth import get_user_model
+
+    cutoff = month_start(cutoff)
+    old = PointsTransaction.objects.filter(transaction_date__lt=cutoff)
+    user_ids = set(old.values_list('origin_account__wallet__user_id', flat=True).distinct())
+    user_ids |= set(old.values_list('destination_account__wallet__user_id', flat=True).distinct())
+    user_ids.discard(None)
+
+    queryset = get_user_model().objects.filter(pk__in=user_ids).order_by('pk')
+    if users is not None:
+        queryset = queryset.filter(pk__in=[getattr(user, 'pk', user) for user in users])
+    return {user.pk: archive_user_transactions(user, cutoff) for user in queryset}
+
+
+def _months_for_period(user, filters):
+    months = ArchivedMonth.objects.filter(user=user)
+    if filters.get('date_after'):
+        months = months.filter(month__gte=month_start(filters['date_after']).date())
+    if filters.get('date_before'):
+        months = months.filter(month__lte=month_start(filters['date_before']).date())
+    return list(months.order_by('month'))
+
+
+def _filter_expression(filters, program_account_ids=None):
+    timestamp = pa.timestamp('us', tz='UTC')
+    money = pa.decimal128(12, 2)
+    origin, destination = pc.field('origin_account_id'), pc.field('destination_account_id')
+
+    expression = pc.scalar(True)
+    if filters.get('date_after'):
+        expression &= pc.field('transaction_date') >= pa.scalar(filters['date_after'], type=timestamp)
+    if filters.get('date_before'):
+        expression &= pc.field('transaction_date') <= pa.scalar(filters['date_before'], type=timestamp)
+    if filters.get('transaction_type'):
+        expression &= pc.field('transaction_type').isin(filters['transaction_type'])
+    for key, column, op in (
+        ('amount_min', 'amount', 'greater_equal'), ('amount_max', 'amount', 'less_equal'),
+        ('cost_min', 'cost', 'greater_equal'), ('cost_max', 'cost', 'less_equal'),
+    ):
+        if filters.get(key) is not None:
+            expression &= getattr(pc, op)(pc.field(column), pa.scalar(filters[key], type=money))
+    if filters.get('origin_account'):
+        expression &= origin == filters['origin_account']
+    if filters.get('destination_account'):
+        expression &= destination == filters['destination_account']
+    if filters.get('account'):
+        expression &= (origin == filters['account']) | (destination == filters['account'])
+    if program_account_ids is not None:
+        expression &= origin.isin(program_account_ids) | destination.isin(program_account_ids)
+    return expression
+
+
+def archived_transactions(user, filters):
+    """
+    Transações arquivadas do usuário que atendem aos filtros da listagem
+    (``TransactionFilterSerializer``), como instâncias não salvas de
+    ``PointsTransaction`` com as contas já carregadas.
+    """
+    months = _months_for_period(user, filters)
+    if not months:
+        return []
+    require_pyarrow()
+
+    accounts = {
+        account.pk: account
+        for account in LoyaltyAccount.objects.filter(wallet__user=user).select_related('program', 'wallet')
+    }
+    program_account_ids = None
+    if filters.get('program'):
+        program_account_ids = [pk for pk, account in accounts.items() if account.program_id == filters['program']]
+    expression = _filter_expression(filters, program_account_ids)
+
+    transactions = []
+    for month in months:
+        for row in read_archive_file(month.path, expression).to_pylist():
+            tx = PointsTransaction(**row)
+            tx._state.adding = False
+            for side in ('origin_account', 'destination_account'):
+                account = accounts.get(row[f'{side}_id'])
+                if account is None:
+                    setattr(tx, f'{side}_id', None)  # conta removida depois do arquivamento (SET_NULL)
+                else:
+                    setattr(tx, side, account)
+            transactions.append(tx)
+    return transactions
+
+
+def archived_totals(user, period=None):
+    """
+    Totais de aquisição e vendas arquivados, no formato de
+    ``summary.transaction_totals``. Sem período, vêm dos checkpoints; com
+    período, são calculados a partir dos meses arquivados do intervalo.
+    """
+    if not period:
+        return ArchiveCheckpoint.objects.filter(account__wallet__user=user).aggregate(
+            total_cost_sum=Sum('acquisition_cost'),
+            total_points_sold=Sum('points_sold'),
+            total_revenue_from_sales=Sum('sales_revenue'),
+        )
+
+    totals = {'total_cost_sum': None, 'total_points_sold': None, 'total_revenue_from_sales': None}
+    months = _months_for_period(user, period)
+    if not months:
+        return totals
+    require_pyarrow()
+
+    account_ids = list(LoyaltyAccount.objects.filter(wallet__user=user).values_list('pk', flat=True))
+    base = _filter_expression(period)
+    acquisition = base & pc.field('destination_account_id').isin(account_ids) & \
+        pc.field('transaction_type').isin([1, 2]) & (pc.field('cost') > pa.scalar(Decimal('0'), type=pa.decimal128(12, 2)))
+    sales = base & pc.field('origin_account_id').isin(account_ids) & \
+        (pc.field('transaction_type') == 4) & pc.field('cost').is_valid()
+
+    def add(key, value):
+        if value is not None:
+            totals[key] = (totals[key] or Decimal('0.00')) + value
+
+    for month in months:
+        table = read_archive_file(month.path)
+        add('total_cost_sum', pc.sum(table.filter(acquisition)['cost']).as_py())
+        sold = table.filter(sales)
+        add('total_points_sold', pc.sum(sold['amount']).as_py())
+        add('total_revenue_from_sales', pc.sum(sold['cost']).as_py())
+    return totals
+
+
+def _listing_key(tx):
+    return tx.transaction_date, tx.created_at
+
+
+class MergedTransactions:
+    """
+    Listagem da tabela quente (já ordenada por data e criação, decrescentes)
+    intercalada com as transações arquivadas. Paginadores fatiam a sequência:
+    cada fatia busca no banco só as linhas quentes até o fim da página, e das
+    arquivadas entram só as que caem nela.
+    """
+
+    def __init__(self, queryset, archived):
+        # Linhas ainda na tabela quente (arquivamento em curso) não aparecem duas vezes.
+        in_hot = set(queryset.filter(pk__in=[tx.pk for tx in archived]).values_list('pk', flat=True))
+        self.queryset = queryset
+        self.archived = sorted((tx for tx in archived if tx.pk not in in_hot), key=_listing_key, reverse=True)
+
+    def count(self):
+        return self.queryset.count() + len(self.archived)
+
+    __len__ = count
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        hot = self.queryset[:stop] if stop is not None else self.queryset
+        merged = heapq.merge(hot, self.archived, key=_listing_key, reverse=True)
+        return list(itertools.islice(merged, start, stop))
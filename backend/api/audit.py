@@ -0,0 +1,222 @@
+"""
+Trilha de auditoria das mudanças de saldo das contas (``BalanceAuditLog``).
+
+Todo ``LoyaltyAccount.save()`` que muda ``current_balance`` ou
+``average_cost`` gera um registro com os valores antes/depois, a operação (o
+``_apply_*``/``_reverse_*`` mais interno em execução, marcado com
+``@audited``), a transação e o id da requisição (``X-Request-ID``, gerado pelo
+``RequestIdMiddleware`` quando o cliente não envia). Sem operação marcada, vale
+``account_create``/``account_update``.
+
+Os registros não são gravados na hora: ficam num lote por transação do banco
+(por savepoint, para que um rollback parcial descarte só o que foi desfeito) e
+o lote inteiro vai num único ``bulk_create`` depois do commit. Fora de uma
+transação o registro é gravado imediatamente.
+
+Com ``AUDIT_ASYNC`` os lotes são entregues a uma thread do worker, que junta o
+que chegou enquanto gravava o lote anterior; a resposta não espera o INSERT,
+mas registros ainda na fila se perdem se o processo morrer.
+"""
+import contextlib
+import functools
+import logging
+import queue
+import re
+import threading
+import uuid
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_valid_request_id = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+_request_id = ContextVar('easymiles_request_id', default='')
+# (operação, id da transação) em execução.
+_operation = ContextVar('easymiles_audit_operation', default=(None, None))
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+class RequestIdMiddleware:
+    """Usa o ``X-Request-ID`` do cliente (ou gera um) e o devolve na resposta."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not _valid_request_id.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = _request_id.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response.setdefault(REQUEST_ID_HEADER, request_id)
+        return response
+
+
+@contextlib.contextmanager
+def operation(name, transaction=None):
+    """Atribui a ``name`` (e à ``transaction``, ou à da operação externa) as mudanças de saldo do bloco."""
+    transaction_id = transaction.pk if transaction is not None else _operation.get()[1]
+    token = _operation.set((name, transaction_id))
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def audited(method):
+    """Decorator de métodos ``(self, transaction, ...)``: a operação leva o nome do método."""
+    name = method.__name__.lstrip('_')
+
+    @functools.wraps(method)
+    def inner(self, transaction, *args, **kwargs):
+        with operation(name, transaction):
+            return method(self, transaction, *args, **kwargs)
+    return inner
+
+
+def balance_state(account):
+    """``(saldo, custo médio)`` carregados na instância (``None`` se o saldo foi adiado com ``only()``)."""
+    values = account.__dict__
+    if 'current_balance' not in values:
+        return None
+    return values['current_balance'], values.get('average_cost')
+
+
+def record(account, before, after, adding=False):
+    """Registra a mudança de ``before`` para ``after`` (ver ``balance_state``) na operação atual."""
+    from .models import BalanceAuditLog, LoyaltyAccount
+
+    name, transaction_id = _operation.get()
+    entry = BalanceAuditLog(
+        user_id=account.wallet.user_id if LoyaltyAccount.wallet.is_cached(account) else None,
+        account_id=account.pk,
+        transaction_id=transaction_id,
+        operation=name or ('account_create' if adding else 'account_update'),
+        balance_before=before[0] if before else None,
+        balance_after=after[0],
+        average_cost_before=before[1] if before else None,
+        average_cost_after=after[1],
+        request_id=current_request_id(),
+        created_at=timezone.now(),
+    )
+    entry.wallet_id = account.wallet_id
+    enqueue(account._state.db, [entry])
+
+
+class _Batch:
+    """Registros pendentes de uma transação; chamado pelo ``on_commit``."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.entries = []
+
+    def __call__(self):
+        flush(self.alias, self.entries)
+
+
+def _pending_batch(connection):
+    savepoints = set(connection.savepoint_ids)
+    for sids, callback, _robust in reversed(connection.run_on_commit):
+        if isinstance(callback, _Batch) and sids == savepoints:
+            return callback
+    batch = _Batch(connection.alias)
+    transaction.on_commit(batch, using=connection.alias, robust=True)
+    return batch
+
+
+def enqueue(alias, entries):
+    """Acrescenta ``entries`` ao lote da transação em curso em ``alias`` (ou grava já, fora de transação)."""
+    connection = connections[alias]
+    if not connection.in_atomic_block:
+        flush(alias, entries)
+        return
+    _pending_batch(connection).entries.extend(entries)
+
+
+def _resolve_users(alias, entries):
+    """Preenche o usuário pelos ids de carteira (uma query por lote) e descarta órfãos."""
+    from .models import UserWallet
+
+    wallet_ids = {entry.wallet_id for entry in entries if entry.user_id is None}
+    if not wallet_ids:
+        return entries
+    owners = dict(UserWallet.objects.using(alias).filter(pk__in=wallet_ids).values_list('pk', 'user_id'))
+    resolved = []
+    for entry in entries:
+        if entry.user_id is None:
+            entry.user_id = owners.get(entry.wallet_id)
+            if entry.user_id is None:
+                logger.warning("Auditoria descartada: carteira %s da conta %s não existe mais", entry.wallet_id, entry.account_id)
+                continue
+        resolved.append(entry)
+    return resolved
+
+
+def write(alias, entries):
+    from .models import BalanceAuditLog
+
+    BalanceAuditLog.objects.using(alias).bulk_create(entries, batch_size=settings.AUDIT_BATCH_SIZE)
+
+
+def flush(alias, entries):
+    entries = _resolve_users(alias, entries)
+    if not entries:
+        return
+    if getattr(settings, 'AUDIT_ASYNC', False):
+        writer.submit(alias, entries)
+    else:
+        write(alias, entries)
+
+
+class AuditWriter:
+    """Thread única por worker que grava os lotes entregues por ``flush``."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, alias, entries):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+        self._queue.put((alias, entries))
+
+    def drain(self):
+        """Espera a fila esvaziar."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    items.append(self._queue.get_nowait())
+            pending = {}
+            for alias, entries in items:
+                pending.setdefault(alias, []).extend(entries)
+            try:
+                close_old_connections()
+                for alias, entries in pending.items():
+                    write(alias, entries)
+            except Exception:
+                logger.exception("Falha ao gravar %d registros de auditoria", sum(map(len, pending.values())))
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+
+writer = AuditWriter()
@@ -0,0 +1,193 @@
+"""
+Exclusão em lotes de carteiras e contas com históricos grandes.
+
+O ``delete()`` do Django carrega todas as transações ligadas às contas para
+fazer o ``SET_NULL`` de ``origin_account``/``destination_account``, numa única
+transação do banco. Aqui cada lote de ``DELETION_CHUNK_SIZE`` transações é
+desligado com ``UPDATE`` por ids em sua própria transação (locks curtos e
+memória constante), com o mesmo efeito no sync incremental que os sinais de
+``api.signals``: nova ``change_seq`` nas transações e tombstone para as que
+ficaram sem nenhuma conta. Quando não resta nenhuma transação ligada, as
+contas e a carteira são removidas pelo caminho normal (já sem nada a coletar).
+
+O ``DeletionJob`` registra o progresso e é executado numa thread do próprio
+worker (``DELETION_JOBS_ASYNC``); jobs interrompidos podem ser retomados com
+``manage.py run_deletion_jobs``. Cada execução reserva o job (``owner``) e
+renova o ``heartbeat_at`` a cada lote; um job em execução só é retomado por
+outro executor depois de ``DELETION_JOB_STALE_SECONDS`` sem heartbeat, e o
+executor antigo, ao perder a reserva, para no próximo lote.
+"""
+import contextvars
+import logging
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .events import broker
+from .models import ArchiveCheckpoint, DeletionJob, LoyaltyAccount, PointsTransaction, SyncCounter, UserWallet
+from .sharding import atomic, on_commit
+from .signals import record_tombstones
+
+logger = logging.getLogger(__name__)
+
+
+def target_account_ids(job):
+    if job.target_type == DeletionJob.TARGET_WALLET:
+        return list(LoyaltyAccount.objects.filter(wallet_id=job.target_id).values_list('pk', flat=True))
+    return list(LoyaltyAccount.objects.filter(pk=job.target_id).values_list('pk', flat=True))
+
+
+def linked_transactions(account_ids):
+    return PointsTransaction.objects.filter(
+        Q(origin_account_id__in=account_ids) | Q(destination_account_id__in=account_ids)
+    )
+
+
+def schedule_deletion(user, target_type, target_id):
+    """
+    Cria (ou devolve, se já existir um ativo) o job de exclusão e esconde o
+    alvo da API imediatamente. Um job que falhou volta a ficar pendente. A
+    execução começa após o commit.
+    """
+    with atomic():
+        job = DeletionJob.objects.select_for_update().filter(
+            user=user, target_type=target_type, target_id=target_id, status__in=DeletionJob.HIDDEN_STATUSES
+        ).first()
+        if job is not None and job.status == DeletionJob.STATUS_FAILED:
+            job.status = DeletionJob.STATUS_PENDING
+            job.save(update_fields=['status'])
+            on_commit(lambda: start_deletion_job(job.pk))
+            return job, False
+        if job is not None:
+            return job, False
+        job = DeletionJob.objects.create(user=user, target_type=target_type, target_id=target_id)
+        accounts = (
+            LoyaltyAccount.objects.filter(wallet_id=target_id) if target_type == DeletionJob.TARGET_WALLET
+            else LoyaltyAccount.objects.filter(pk=target_id)
+        )
+        accounts.update(is_active=False, change_seq=SyncCounter.next_value(user.pk))
+        on_commit(lambda: start_deletion_job(job.pk))
+    return job, True
+
+
+def start_deletion_job(job_id):
+    if not getattr(settings, 'DELETION_JOBS_ASYNC', True):
+        run_deletion_job(job_id)
+        return
+    # A thread herda o contexto da requisição, e com ele o shard do usuário.
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run, args=(_run_in_thread, job_id), name=f'deletion-job-{job_id}', daemon=True
+    ).start()
+
+
+def _run_in_thread(job_id):
+    try:
+        run_deletion_job(job_id)
+    finally:
+        connections.close_all()
+
+
+class JobLost(Exception):
+    """O job foi retomado por outro executor (este ficou sem heartbeat)."""
+
+
+def claim_deletion_job(job_id, owner, retry_failed=False):
+    """
+    Reserva o job para ``owner`` se ele estiver pendente, em execução sem
+    heartbeat recente ou (com ``retry_failed``) falho. Retorna o job reservado
+    ou ``None``.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.DELETION_JOB_STALE_SECONDS)
+    claimable = Q(status=DeletionJob.STATUS_PENDING) | Q(
+        Q(heartbeat_at__isnull=True) | Q(heartbeat_at__lt=stale), status=DeletionJob.STATUS_RUNNING
+    )
+    if retry_failed:
+        claimable |= Q(status=DeletionJob.STATUS_FAILED)
+    with atomic():
+        job = DeletionJob.objects.select_for_update(skip_locked=True).filter(claimable, pk=job_id).first()
+        if job is None:
+            return None
+        job.status = DeletionJob.STATUS_RUNNING
+        job.owner = owner
+        job.heartbeat_at = now
+        job.started_at = job.started_at or now
+        job.error = ''
+        job.save(update_fields=['status', 'owner', 'heartbeat_at', 'started_at', 'error'])
+    return job
+
+
+def _hold(job, owner):
+    """Trava a linha do job na transação atual e confirma que a reserva ainda é de ``owner``."""
+    held = DeletionJob.objects.select_for_update().filter(
+        pk=job.pk, owner=owner, status=DeletionJob.STATUS_RUNNING
+    ).values_list('pk', flat=True)
+    if not list(held):
+        raise JobLost(job.pk)
+
+
+def _detach_chunk(job, owner, account_ids, chunk_size):
+    """Desliga um lote de transações das contas. Retorna quantas foram processadas."""
+    with atomic():
+        _hold(job, owner)
+        ids = list(linked_transactions(account_ids).order_by().values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return 0
+        user_id = job.user_id
+        seq = SyncCounter.next_value(user_id)
+        PointsTransaction.objects.filter(pk__in=ids, origin_account_id__in=account_ids).update(
+            origin_account=None, change_seq=seq
+        )
+        PointsTransaction.objects.filter(pk__in=ids, destination_account_id__in=account_ids).update(
+            destination_account=None, change_seq=seq
+        )
+        orphaned = PointsTransaction.objects.filter(
+            pk__in=ids, origin_account__isnull=True, destination_account__isnull=True
+        ).values_list('pk', flat=True)
+        record_tombstones(user_id, 'transaction', list(orphaned))
+        # Progresso e heartbeat na mesma transação do lote.
+        DeletionJob.objects.filter(pk=job.pk).update(processed=F('processed') + len(ids), heartbeat_at=timezone.now())
+        return len(ids)
+
+
+def run_deletion_job(job_id, retry_failed=False):
+    """Reserva e executa o job. Retorna o job ao final, ou ``None`` se outro executor o tem."""
+    owner = uuid.uuid4().hex
+    job = claim_deletion_job(job_id, owner, retry_failed=retry_failed)
+    if job is None:
+        return None
+    account_ids = target_account_ids(job)
+    job.total = job.processed + linked_transactions(account_ids).count()
+    job.save(update_fields=['total'])
+
+    try:
+        chunk_size = settings.DELETION_CHUNK_SIZE
+        while _detach_chunk(job, owner, account_ids, chunk_size):
+            pass
+
+        with atomic():
+            _hold(job, owner)
+            ArchiveCheckpoint.objects.filter(account_id__in=account_ids).delete()
+            # Sem transações ligadas, o collector não tem mais nada a carregar; os sinais geram os tombstones.
+            for account in LoyaltyAccount.objects.filter(pk__in=account_ids).select_related('wallet'):
+                account_id = account.pk
+                account.delete()
+                broker.publish_on_commit(job.user_id, 'account.deleted', {'id': account_id})
+            if job.target_type == DeletionJob.TARGET_WALLET:
+                UserWallet.objects.filter(pk=job.target_id).delete()
+            DeletionJob.objects.filter(pk=job.pk).update(
+                status=DeletionJob.STATUS_DONE, finished_at=timezone.now(), heartbeat_at=timezone.now()
+            )
+    except JobLost:
+        logger.warning("Job de exclusão %s retomado por outro executor; esta execução parou.", job.pk)
+    except Exception as exc:
+        logger.exception("Falha no job de exclusão %s.", job.pk)
+        DeletionJob.objects.filter(pk=job.pk, owner=owner).update(status=DeletionJob.STATUS_FAILED, error=str(exc))
+    job.refresh_from_db()
+    return job
@@ -0,0 +1,233 @@
+"""
+Pub/sub em processo para eventos por usuário (saldo de conta, transações e
+delta do resumo), consumido pelo stream SSE em ``/api/events/stream/``.
+
+Os eventos são publicados pelos caminhos de escrita das viewsets somente após
+o commit da transação do banco. Com ``EVENTS_PG_NOTIFY`` ativo (padrão; só
+PostgreSQL), a publicação passa por ``pg_notify`` e cada worker escuta o canal numa thread
+própria, entregando o evento aos seus assinantes locais.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .sharding import on_commit
+
+logger = logging.getLogger(__name__)
+
+PG_CHANNEL = 'easymiles_events'
+
+
+class Subscription:
+    """Fila de eventos de um cliente SSE, ligada ao event loop que a criou."""
+
+    def __init__(self, user_id, loop, maxsize):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Cliente lento: descarta o evento em vez de bloquear quem publica.
+            logger.warning("Fila SSE cheia para o usuário %s; evento descartado.", self.user_id)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class EventBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._listeners = []
+        self._ids = itertools.count(1)
+        self._pg_listener = None
+
+    def subscribe(self, user_id, maxsize=100):
+        """Cria uma assinatura para o usuário. Deve ser chamado dentro de um event loop."""
+        self._ensure_pg_listener()
+        subscription = Subscription(user_id, asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.user_id)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    del self._subscriptions[subscription.user_id]
+
+    def add_listener(self, callback):
+        """Registra um callback síncrono ``callback(user_id, event)`` para consumidores em processo."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def publish(self, user_id, event_type, data):
+        event = {'type': event_type, 'data': data}
+        if _pg_notify_enabled():
+            payload = json.dumps({'user_id': user_id, 'event': event}, cls=DjangoJSONEncoder)
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [PG_CHANNEL, payload])
+            return
+        self.dispatch(user_id, json.loads(json.dumps(event, cls=DjangoJSONEncoder)))
+
+    def publish_on_commit(self, user_id, event_type, data):
+        on_commit(lambda: self.publish(user_id, event_type, data))
+
+    def dispatch(self, user_id, event):
+        """Entrega local de um evento já serializável em JSON."""
+        event = dict(event, id=next(self._ids))
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+            listeners = list(self._listeners)
+        for subscription in subscriptions:
+            subscription.loop.call_soon_threadsafe(subscription.push, event)
+        for callback in listeners:
+            try:
+                callback(user_id, event)
+            except Exception:
+                logger.exception("Falha em listener de eventos.")
+
+    def _ensure_pg_listener(self):
+        if not _pg_notify_enabled() or self._pg_listener is not None:
+            return
+        with self._lock:
+            if self._pg_listener is None:
+                self._pg_listener = PostgresNotifyListener(self)
+                self._pg_listener.start()
+
+
+class PostgresNotifyListener(threading.Thread):
+    """Thread que faz ``LISTEN`` no canal de eventos e repassa ao broker local."""
+
+    def __init__(self, broker):
+        super().__init__(name='easymiles-events-listener', daemon=True)
+        self.broker = broker
+
+    def run(self):
+        import psycopg2
+
+        db = settings.DATABASES['default']
+        while True:
+            try:
+                conn = psycopg2.connect(
+                    dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+                    host=db['HOST'], port=db['PORT'],
+                )
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {PG_CHANNEL}")
+                self._listen(conn)
+            except Exception:
+                logger.exception("Listener de eventos PostgreSQL caiu; reconectando.")
+                threading.Event().wait(5)
+
+    def _listen(self, conn):
+        while True:
+            if select.select([conn], [], [], 60) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                notify = conn.notifies.pop(0)
+                message = json.loads(notify.payload)
+                self.broker.dispatch(message['user_id'], message['event'])
+
+
+def _pg_notify_enabled():
+    return getattr(settings, 'EVENTS_PG_NOTIFY', False) and connection.vendor == 'postgresql'
+
+
+broker = EventBroker()
+
+
+def snapshot_accounts(account_ids):
+    """Lê saldo, custo médio e dados do programa das contas informadas numa única consulta."""
+    from .models import LoyaltyAccount
+
+    ids = {pk for pk in account_ids if pk is not None}
+    if not ids:
+        return {}
+    rows = LoyaltyAccount.objects.filter(pk__in=ids).values(
+        'id', 'current_balance', 'average_cost', 'last_updated',
+        'program_id', 'program__currency_type', 'program__custom_rate',
+    )
+    return {row['id']: row for row in rows}
+
+
+class BalanceTracker:
+    """
+    Captura o estado das contas antes de uma escrita e, ao final, publica
+    ``account.balance`` para as contas alteradas e um ``summary.delta`` com a
+    variação de saldo e de patrimônio estimado.
+    """
+
+    def __init__(self, user_id, account_ids):
+        self.user_id = user_id
+        self.account_ids = {pk for pk in account_ids if pk is not None}
+        self.before = snapshot_accounts(self.account_ids)
+
+    def track(self, account_id):
+        """Inclui uma conta criada depois da captura inicial (sem estado anterior)."""
+        self.account_ids.add(account_id)
+
+    def publish_on_commit(self, event_type, data):
+        after = snapshot_accounts(self.account_ids)
+        broker.publish_on_commit(self.user_id, event_type, data)
+
+        changed_accounts = []
+        delta_programs = defaultdict(lambda: {'balance_delta': Decimal('0.00'), 'value_delta': Decimal('0.00')})
+        total_value_delta = Decimal('0.00')
+        for account_id in sorted(self.account_ids):
+            old, new = self.before.get(account_id), after.get(account_id)
+            old_balance = old['current_balance'] if old else Decimal('0.00')
+            new_balance = new['current_balance'] if new else Decimal('0.00')
+            if new is not None:
+                changed_accounts.append({
+                    'id': account_id,
+                    'current_balance': new['current_balance'],
+                    'average_cost': new['average_cost'],
+                    'last_updated': new['last_updated'],
+                })
+            balance_delta = new_balance - old_balance
+            if not balance_delta:
+                continue
+            state = new or old
+            rate = state['program__custom_rate'] or Decimal('0.00')
+            value_delta = (balance_delta / Decimal('1000.0')) * rate if rate > 0 else Decimal('0.00')
+            program_delta = delta_programs[state['program_id']]
+            program_delta['balance_delta'] += balance_delta
+            program_delta['value_delta'] += value_delta
+            total_value_delta += value_delta
+
+        for account in changed_accounts:
+            broker.publish_on_commit(self.user_id, 'account.balance', account)
+        if delta_programs:
+            broker.publish_on_commit(self.user_id, 'summary.delta', {
+                'overall_estimated_value_delta': total_value_delta.quantize(Decimal('0.01')),
+                'programs': [
+                    {
+                        'program_id': program_id,
+                        'balance_delta': values['balance_delta'],
+                        'value_delta': values['value_delta'].quantize(Decimal('0.01')),
+                    }
+                    for program_id, values in sorted(delta_programs.items())
+                ],
+            })
@@ -0,0 +1,287 @@
+"""
+Expiração de pontos por validade (``LoyaltyProgram.validity_months``).
+
+Os débitos consomem os lotes mais antigos primeiro (FIFO), então o saldo atual
+de uma conta é formado pelos créditos mais recentes: percorrendo os créditos do
+mais novo para o mais antigo até cobrir o saldo, obtêm-se os lotes ainda vivos
+e a data de aquisição de cada um. Disso saem:
+
+- o vencido: o saldo que excede os créditos recebidos dentro da validade
+  (``saldo - créditos desde agora - validade``), calculável com um único
+  agregado por lote de contas;
+- a previsão: os lotes vivos agrupados pelo mês em que vencem.
+
+Expirações já lançadas (tipo 5) são débitos e entram no saldo, então rodar o
+processamento de novo não expira o mesmo ponto duas vezes. O saldo não coberto
+por créditos (o saldo informado na criação da conta) é datado em ``created_at``.
+"""
+import calendar
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import BigIntegerField, Case, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from . import audit
+from .events import broker
+from .ledger import credited_amount, rederive_balances
+from .metrics import TRANSACTIONS_APPLIED
+from .models import ArchiveCheckpoint, BalanceAuditLog, LoyaltyAccount, LoyaltyProgram, PointsTransaction, SyncCounter
+from .sharding import atomic
+
+EXPIRATION_TYPE = 5
+CREDIT_FILTER = Q(transaction_type__in=(1, 2)) | Q(transaction_type=6, destination_account__isnull=False)
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def shift_months(value, months):
+    """Soma meses a uma data, limitando o dia ao último dia do mês de destino."""
+    month_index = value.year * 12 + value.month - 1 + months
+    year, month = month_index // 12, month_index % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+
+def credited_amount_expression():
+    """Versão em SQL de ``ledger.credited_amount`` (transferências recebem o bônus)."""
+    with_bonus = ExpressionWrapper(
+        F('amount') * (Value(Decimal('1.00')) + Coalesce('bonus_percentage', Value(Decimal('0.00'))) / Value(Decimal('100.00'))),
+        output_field=AMOUNT_FIELD,
+    )
+    return Case(
+        When(transaction_type=2, then=Round(with_bonus, 2)),
+        default=F('amount'),
+        output_field=AMOUNT_FIELD,
+    )
+
+
+def _archived_credits(account_ids, since):
+    """
+    Créditos de ``since`` em diante que já foram para o arquivo frio (só
+    acontece quando a validade é maior que a idade de arquivamento).
+    Retorna ``{conta: [(data, quantidade), ...]}``.
+    """
+    from .archive import archived_transactions
+
+    checkpoints = ArchiveCheckpoint.objects.filter(
+        account_id__in=account_ids, cutoff__gt=since
+    ).select_related('account__wallet__user')
+    credits = defaultdict(list)
+    for checkpoint in checkpoints:
+        account = checkpoint.account
+        rows = archived_transactions(account.wallet.user, {'account': account.pk, 'date_after': since})
+        for tx in rows:
+            if tx.destination_account_id == account.pk and tx.transaction_type in (1, 2, 6):
+                credits[account.pk].append((tx.transaction_date, credited_amount(tx)))
+    return credits
+
+
+def credits_since(account_ids, since):
+    """Total creditado em cada conta a partir de ``since``: ``{conta: quantidade}``."""
+    totals = defaultdict(lambda: Decimal('0.00'))
+    rows = (
+        PointsTransaction.objects
+        .filter(CREDIT_FILTER, destination_account_id__in=account_ids, transaction_date__gt=since)
+        .values('destination_account_id')
+        .annotate(total=Sum(credited_amount_expression()))
+    )
+    for row in rows:
+        totals[row['destination_account_id']] += row['total'] or Decimal('0.00')
+    for account_id, credits in _archived_credits(account_ids, since).items():
+        totals[account_id] += sum((amount for _, amount in credits), Decimal('0.00'))
+    return totals
+
+
+def live_lots(account, credits, window_start):
+    """
+    Lotes que formam o saldo atual (``[(data de aquisição, quantidade)]``, do
+    mais novo para o mais antigo) e o que já venceu. ``credits`` são os
+    créditos posteriores a ``window_start``, em ordem decrescente de data.
+    """
+    remaining = account.current_balance
+    lots = []
+    for acquired_at, amount in credits:
+        if remaining <= 0:
+            break
+        lot = min(amount, remaining)
+        lots.append((acquired_at, lot))
+        remaining -= lot
+    if remaining > 0 and account.created_at > window_start:
+        lots.append((account.created_at, remaining))
+        remaining = Decimal('0.00')
+    return lots, max(remaining, Decimal('0.00'))
+
+
+def forecast_expirations(accounts, months=12, now=None):
+    """
+    Pontos a expirar por mês, por conta, até ``months`` meses à frente.
+    ``accounts`` devem ter ``program`` carregado; contas de programas sem
+    validade são ignoradas.
+    """
+    now = now or timezone.now()
+    accounts = [account for account in accounts if account.program.validity_months]
+    if not accounts:
+        return {"months": months, "accounts": [], "totals": []}
+
+    oldest = min(shift_months(now, -account.program.validity_months) for account in accounts)
+    account_ids = [account.pk for account in accounts]
+    credits = defaultdict(list)
+    rows = (
+        PointsTransaction.objects
+        .filter(CREDIT_FILTER, destination_account_id__in=account_ids, transaction_date__gt=oldest)
+        .annotate(credited=credited_amount_expression())
+        .values_list('destination_account_id', 'transaction_date', 'credited')
+    )
+    for account_id, acquired_at, amount in rows:
+        credits[account_id].append((acquired_at, amount))
+    for account_id, archived in _archived_credits(account_ids, oldest).items():
+        credits[account_id].extend(archived)
+
+    horizon = shift_months(now, months)
+    totals = defaultdict(lambda: Decimal('0.00'))
+    results = []
+    for account in accounts:
+        validity = account.program.validity_months
+        window_start = shift_months(now, -validity)
+        account_credits = sorted(
+            ((date, amount) for date, amount in credits[account.pk] if date > window_start),
+            key=lambda item: item[0], reverse=True,
+        )
+        lots, overdue = live_lots(account, account_credits, window_start)
+        expiring = defaultdict(lambda: Decimal('0.00'))
+        for acquired_at, amount in lots:
+            expires_at = shift_months(acquired_at, validity)
+            if expires_at <= horizon:
+                expiring[f"{expires_at:%Y-%m}"] += amount
+        for month, amount in expiring.items():
+            totals[month] += amount
+        results.append({
+            "loyalty_account_id": account.pk,
+            "loyalty_account_name": account.name,
+            "program_name": account.program.name,
+            "validity_months": validity,
+            "current_balance": account.current_balance,
+            "overdue_amount": overdue,
+            "expiring": [{"month": month, "amount": expiring[month]} for month in sorted(expiring)],
+        })
+    return {
+        "months": months,
+        "accounts": results,
+        "totals": [{"month": month, "amount": totals[month]} for month in sorted(totals)],
+    }
+
+
+def _expire_chunk(program, account_ids, cutoff, now):
+    """Lança as expirações de um lote de contas do mesmo programa. Retorna quantas foram criadas."""
+    with atomic():
+        accounts = list(
+            LoyaltyAccount.objects.select_for_update(of=('self',))
+            .filter(pk__in=account_ids, current_balance__gt=0)
+            .select_related('wallet')
+            .only('id', 'current_balance', 'average_cost', 'wallet', 'wallet__user')
+        )
+        credited = credits_since([account.pk for account in accounts], cutoff)
+        due = {
+            account: account.current_balance - credited[account.pk]
+            for account in accounts
+            if account.current_balance > credited[account.pk]
+        }
+        if not due:
+            return 0
+
+        # Um contador por dono, em ordem de usuário para que lotes concorrentes não se travem.
+        change_seqs = {
+            user_id: SyncCounter.next_value(user_id)
+            for user_id in sorted({account.wallet.user_id for account in due})
+        }
+        description = f"Expiração automática (validade de {program.validity_months} meses)"
+        expirations = PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                transaction_type=EXPIRATION_TYPE,
+                amount=amount,
+                origin_account_id=account.pk,
+                description=description,
+                transaction_date=now,
+                change_seq=change_seqs[account.wallet.user_id],
+                # A expiração é a transação mais recente da conta: o saldo após ela é o novo saldo.
+                origin_balance_after=account.current_balance - amount,
+                origin_average_cost_after=account.average_cost,
+            )
+            for account, amount in due.items()
+        ], batch_size=1000)
+        LoyaltyAccount.objects.filter(pk__in=[account.pk for account in due]).update(
+            current_balance=F('current_balance') - Case(
+                *(When(pk=account.pk, then=Value(amount)) for account, amount in due.items()),
+                output_field=AMOUNT_FIELD,
+            ),
+            last_updated=now,
+            change_seq=Case(
+                *(When(pk=account.pk, then=Value(change_seqs[account.wallet.user_id])) for account in due),
+                output_field=BigIntegerField(),
+            ),
+        )
+        # O UPDATE em massa não passa pelo save(): a auditoria é registrada aqui.
+        audit.enqueue(accounts[0]._state.db, [
+            BalanceAuditLog(
+                user_id=account.wallet.user_id,
+                account_id=account.pk,
+                transaction_id=expiration.pk,
+                operation='expiration',
+                balance_before=account.current_balance,
+                balance_after=account.current_balance - amount,
+                average_cost_before=account.average_cost,
+                average_cost_after=account.average_cost,
+                request_id=audit.current_request_id(),
+                created_at=now,
+            )
+            for (account, amount), expiration in zip(due.items(), expirations)
+        ])
+
+        # Transações com data futura (raras) precisam ter o saldo gravado refeito.
+        due_ids = {account.pk for account in due}
+        later = PointsTransaction.objects.filter(
+            Q(origin_account_id__in=due_ids) | Q(destination_account_id__in=due_ids), transaction_date__gt=now
+        ).values_list('origin_account_id', 'destination_account_id').distinct()
+        later_ids = {pk for pair in later for pk in pair} & due_ids
+        if later_ids:
+            rederive_balances(later_ids, since=now)
+
+        for account, amount in due.items():
+            broker.publish_on_commit(account.wallet.user_id, 'account.balance', {
+                'id': account.pk,
+                'current_balance': account.current_balance - amount,
+                'average_cost': account.average_cost,
+                'last_updated': now,
+            })
+        TRANSACTIONS_APPLIED.labels(transaction_type=str(EXPIRATION_TYPE)).inc(len(due))
+        return len(due)
+
+
+def process_expirations(now=None, chunk_size=1000, programs=None):
+    """
+    Lança, em lotes de ``chunk_size`` contas, as expirações vencidas de todos os
+    usuários. Contas criadas há menos que a validade não têm nada vencido e nem
+    são lidas. Retorna ``{programa: quantidade de expirações criadas}``.
+    """
+    now = now or timezone.now()
+    queryset = LoyaltyProgram.objects.filter(validity_months__isnull=False, validity_months__gt=0)
+    if programs:
+        queryset = queryset.filter(pk__in=programs)
+
+    created = {}
+    for program in queryset.order_by('pk'):
+        cutoff = shift_months(now, -program.validity_months)
+        created[program.name] = 0
+        last_pk = 0
+        while True:
+            ids = list(
+                LoyaltyAccount.objects.filter(
+                    program=program, current_balance__gt=0, created_at__lte=cutoff, pk__gt=last_pk
+                )
+                .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            created[program.name] += _expire_chunk(program, ids, cutoff, now)
+            last_pk = ids[-1]
+    return created
@@ -0,0 +1,110 @@
+"""
+Sparse fieldsets: ``?fields=id,current_balance`` mantém só os campos pedidos e
+``?omit=wallet_name`` remove campos da resposta.
+
+O ``select_related``/``only()`` da queryset é derivado dos campos que sobraram
+no serializer, então requisições enxutas também evitam os joins e as colunas
+que não seriam usadas.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _parse_field_list(value):
+    if not value:
+        return set()
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class SparseFieldsetSerializerMixin:
+    """Remove do serializer os campos excluídos por ``?fields=``/``?omit=`` em leituras."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        params = getattr(request, 'query_params', request.GET)
+        requested = _parse_field_list(params.get('fields'))
+        omitted = _parse_field_list(params.get('omit'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+        for name in omitted:
+            self.fields.pop(name, None)
+
+
+def _resolve_source(model, parts):
+    """
+    Converte o ``source`` de um campo do serializer (ex: ``program.name``) no
+    caminho ORM equivalente. Retorna ``(caminho_only, relações_select_related)``
+    ou ``None`` quando o atributo não é uma coluna (property, método etc.).
+    """
+    path, relations = [], []
+    for index, attr in enumerate(parts):
+        is_last = index == len(parts) - 1
+        if attr.startswith('get_') and attr.endswith('_display') and is_last:
+            attr = attr[len('get_'):-len('_display')]
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.many_to_many or field.one_to_many:
+            return None
+        path.append(field.name)
+        if field.is_relation and not is_last:
+            relations.append('__'.join(path))
+            model = field.related_model
+        elif not is_last:
+            return None
+    return '__'.join(path), relations
+
+
+def optimize_queryset_for_fields(queryset, serializer):
+    """
+    Restringe joins e colunas da queryset aos campos do serializer. Se algum
+    campo não puder ser mapeado para colunas, a queryset é devolvida intacta.
+    """
+    only_fields, relations = set(), set()
+    for field in serializer.fields.values():
+        if field.source == '*':
+            return queryset
+        resolved = _resolve_source(queryset.model, field.source.split('.'))
+        if resolved is None:
+            return queryset
+        path, field_relations = resolved
+        only_fields.add(path)
+        relations.update(field_relations)
+
+    # Relações percorridas pelo select_related não podem ficar adiadas, nem as
+    # colunas de ordenação, lidas de novo ao intercalar com o arquivo frio.
+    only_fields.update(relations)
+    for name in queryset.query.order_by or queryset.model._meta.ordering:
+        if isinstance(name, str):
+            resolved = _resolve_source(queryset.model, [name.lstrip('-')])
+            if resolved is not None:
+                only_fields.add(resolved[0])
+    queryset = queryset.select_related(None)
+    if relations:
+        queryset = queryset.select_related(*sorted(relations))
+    return queryset.only(*sorted(only_fields))
+
+
+class SparseFieldsetMixin:
+    """
+    Aplica a otimização de queryset em ``list``/``retrieve`` com ``?fields=`` ou
+    ``?omit=``. Ações customizadas também passam por ``get_object()``, mas usam
+    a instância para mais do que o serializer padrão (extrato, saldo em data).
+    """
+    sparse_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        params = self.request.query_params
+        if (
+            self.request.method in SAFE_METHODS
+            and getattr(self, 'action', None) in self.sparse_actions
+            and (params.get('fields') or params.get('omit'))
+        ):
+            queryset = optimize_queryset_for_fields(queryset, self.get_serializer())
+        return queryset
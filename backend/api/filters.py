@@ -0,0 +1,113 @@
+from django.db.models import Q
+from rest_framework import serializers
+from rest_framework.filters import BaseFilterBackend
+
+from .models import PointsTransaction
+
+
+class TransactionTypeListField(serializers.Field):
+    """Aceita ``transaction_type=2`` ou ``transaction_type=2,4``."""
+
+    def to_internal_value(self, data):
+        valid_types = dict(PointsTransaction.TRANSACTION_TYPE_CHOICES)
+        try:
+            types = [int(value) for value in str(data).split(',') if value.strip()]
+        except ValueError:
+            raise serializers.ValidationError("Informe tipos de transação numéricos separados por vírgula.")
+        invalid = [value for value in types if value not in valid_types]
+        if invalid:
+            raise serializers.ValidationError(f"Tipos de transação inválidos: {invalid}.")
+        return types
+
+
+class PeriodFilterSerializer(serializers.Serializer):
+    """
+    Período em ``transaction_date``. Limites constantes permitem ao PostgreSQL
+    descartar as partições mensais fora do intervalo (ver ``api.partitioning``).
+    """
+    date_after = serializers.DateTimeField(required=False)
+    date_before = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if data.get('date_after') and data.get('date_before') and data['date_after'] > data['date_before']:
+            raise serializers.ValidationError("'date_after' deve ser anterior a 'date_before'.")
+        return data
+
+
+def period_q(filters):
+    period = Q()
+    if filters.get('date_after'):
+        period &= Q(transaction_date__gte=filters['date_after'])
+    if filters.get('date_before'):
+        period &= Q(transaction_date__lte=filters['date_before'])
+    return period
+
+
+class TransactionFilterSerializer(PeriodFilterSerializer):
+    transaction_type = TransactionTypeListField(required=False)
+    account = serializers.IntegerField(required=False)
+    origin_account = serializers.IntegerField(required=False)
+    destination_account = serializers.IntegerField(required=False)
+    program = serializers.IntegerField(required=False)
+    amount_min = serializers.DecimalField(max_digits=12, decimal_places=2, required=False)
+    amount_max = serializers.DecimalField(max_digits=12, decimal_places=2, required=False)
+    cost_min = serializers.DecimalField(max_digits=12, decimal_places=2, required=False)
+    cost_max = serializers.DecimalField(max_digits=12, decimal_places=2, required=False)
+
+
+def transaction_filter_q(filters):
+    """
+    Monta o filtro de transações. Filtros por conta/programa viram um OR entre
+    origem e destino, e os demais filtros são repetidos em cada ramo para que
+    cada lado use o índice composto (conta, tipo, data).
+    """
+    common = period_q(filters)
+    if 'transaction_type' in filters:
+        types = filters['transaction_type']
+        common &= Q(transaction_type=types[0]) if len(types) == 1 else Q(transaction_type__in=types)
+    if 'amount_min' in filters:
+        common &= Q(amount__gte=filters['amount_min'])
+    if 'amount_max' in filters:
+        common &= Q(amount__lte=filters['amount_max'])
+    if 'cost_min' in filters:
+        common &= Q(cost__gte=filters['cost_min'])
+    if 'cost_max' in filters:
+        common &= Q(cost__lte=filters['cost_max'])
+
+    if 'origin_account' in filters:
+        common &= Q(origin_account_id=filters['origin_account'])
+    if 'destination_account' in filters:
+        common &= Q(destination_account_id=filters['destination_account'])
+
+    if 'account' in filters:
+        account_id = filters['account']
+        if 'program' in filters:
+            # Conta e programa juntos: a conta num dos lados e o programa em qualquer um deles.
+            program_id = filters['program']
+            common &= Q(origin_account__program_id=program_id) | Q(destination_account__program_id=program_id)
+        return (Q(origin_account_id=account_id) & common) | (Q(destination_account_id=account_id) & common)
+    if 'program' in filters:
+        program_id = filters['program']
+        return (Q(origin_account__program_id=program_id) & common) | (Q(destination_account__program_id=program_id) & common)
+    return common
+
+
+def transaction_filters(request):
+    """Filtros validados da query string (dict vazio quando nenhum foi informado)."""
+    params = {key: value for key, value in request.query_params.items()
+              if key in TransactionFilterSerializer._declared_fields}
+    if not params:
+        return {}
+    serializer = TransactionFilterSerializer(data=params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
+
+
+class TransactionFilterBackend(BaseFilterBackend):
+    """Filtros server-side da listagem de transações (ver ``TransactionFilterSerializer``)."""
+
+    def filter_queryset(self, request, queryset, view):
+        filters = transaction_filters(request)
+        if not filters:
+            return queryset
+        return queryset.filter(transaction_filter_q(filters))
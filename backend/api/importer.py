@@ -0,0 +1,316 @@
+"""
+Importação de extratos CSV exportados pelos programas de fidelidade
+(``POST /api/accounts/{id}/import/``).
+
+- Leitura em streaming: o arquivo enviado é decodificado e lido linha a linha
+  por geradores, em lotes de ``STATEMENT_IMPORT_BATCH_SIZE``; só o lote atual
+  fica em memória.
+- Mapeamentos de colunas: ``ColumnMapping`` diz quais colunas (pelo cabeçalho,
+  sem diferenciar acentos e maiúsculas) têm a data, o movimento, a descrição e
+  o custo, e os separadores/formatos. Novos formatos entram com
+  ``register_mapping`` (ou uma subclasse que sobrescreve ``parse``); o
+  mapeamento padrão de cada programa vem de ``PROGRAM_MAPPINGS`` e
+  ``STATEMENT_IMPORT_MAPPINGS`` (nome normalizado do programa -> mapeamento).
+- Deduplicação: cada linha recebe um hash de (conta, data, movimento,
+  descrição, ocorrência no arquivo) gravado em ``import_hash``, com índice
+  único. Reimportar extratos que se sobrepõem pula as linhas já existentes;
+  linhas idênticas dentro do mesmo extrato (duas compras iguais no mesmo dia)
+  continuam distintas pela ocorrência.
+- Saldo: créditos viram Inclusão Manual e débitos viram Resgate, aplicados na
+  ordem do arquivo com as mesmas regras de ``PointsTransactionViewSet``, mas
+  com uma única gravação da conta por lote. No fim, o saldo gravado nas
+  transações é refeito a partir da data mais antiga importada.
+
+Tudo roda numa transação, com a conta travada: duas importações da mesma
+conta não se intercalam.
+"""
+import csv
+import functools
+import hashlib
+import io
+import itertools
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from . import audit
+from .ledger import rederive_balances, weighted_average_cost
+from .models import LoyaltyAccount, PointsTransaction, SyncCounter, normalize_search_text
+from .sharding import atomic
+
+CREDIT_TYPE = 1  # Inclusão Manual
+DEBIT_TYPE = 3   # Resgate
+MAX_REPORTED_ERRORS = 50
+INSERT_BATCH_SIZE = 500
+
+
+class StatementImportError(ValueError):
+    """Arquivo que não pode ser importado (codificação, cabeçalho, mapeamento)."""
+
+
+class RowError(ValueError):
+    """Linha inválida: é pulada e reportada, sem interromper a importação."""
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_datetime(value, date_formats):
+    """Data da linha, no fuso do ``TIME_ZONE`` se vier sem; em cache porque extratos têm muitas linhas por dia."""
+    for date_format in date_formats:
+        try:
+            parsed = datetime.strptime(value, date_format)
+            break
+        except ValueError:
+            continue
+    else:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise RowError(f"Data inválida: {value!r}") from None
+    return timezone.make_aware(parsed, timezone.get_default_timezone()) if timezone.is_naive(parsed) else parsed
+
+
+class ColumnMapping:
+    """Como ler o CSV de um programa: colunas pelo nome do cabeçalho, separadores e formatos."""
+
+    def __init__(self, date, amount, description=None, cost=None, delimiter=',', decimal_separator='.',
+                 thousands_separator='', date_formats=(), encoding='utf-8-sig'):
+        self.columns = {'date': date, 'amount': amount, 'description': description, 'cost': cost}
+        self.delimiter = delimiter
+        self.decimal_separator = decimal_separator
+        self.thousands_separator = thousands_separator
+        self.date_formats = date_formats
+        self.encoding = encoding
+
+    def resolve(self, header):
+        """Posição de cada coluna no cabeçalho; ``StatementImportError`` se faltar data ou movimento."""
+        positions = {normalize_search_text(name).strip(): index for index, name in enumerate(header)}
+        indexes = {}
+        for key, name in self.columns.items():
+            if name is None:
+                continue
+            index = positions.get(normalize_search_text(name))
+            if index is None and key in ('date', 'amount'):
+                raise StatementImportError(f"Coluna obrigatória ausente no cabeçalho: {name}")
+            indexes[key] = index
+        return indexes
+
+    def parse_decimal(self, value):
+        value = value.strip().replace(' ', '')
+        if self.thousands_separator:
+            value = value.replace(self.thousands_separator, '')
+        if self.decimal_separator != '.':
+            value = value.replace(self.decimal_separator, '.')
+        try:
+            return Decimal(value).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f"Valor inválido: {value!r}") from None
+
+    def parse_date(self, value):
+        return parse_datetime(value.strip(), self.date_formats)
+
+    def parse(self, row, indexes):
+        """
+        ``(data, movimento com sinal, descrição, custo)`` da linha, ou ``None``
+        para linhas sem movimento (saldo inicial/final, subtotais).
+        """
+        def value(key):
+            index = indexes.get(key)
+            return row[index] if index is not None and index < len(row) else ''
+
+        amount = value('amount')
+        if not amount.strip():
+            return None
+        cost = value('cost')
+        return (
+            self.parse_date(value('date')),
+            self.parse_decimal(amount),
+            value('description').strip()[:255],
+            self.parse_decimal(cost) if cost.strip() else None,
+        )
+
+
+MAPPINGS = {}
+# Nome normalizado do programa (``LoyaltyProgram.search_name``) -> mapeamento padrão.
+PROGRAM_MAPPINGS = {}
+DEFAULT_MAPPING = 'generic'
+
+
+def register_mapping(name, mapping, programs=()):
+    MAPPINGS[name] = mapping
+    for program in programs:
+        PROGRAM_MAPPINGS[normalize_search_text(program)] = name
+
+
+def mapping_for(program, name=None):
+    """Mapeamento pedido (``name``) ou o padrão do programa."""
+    if name is None:
+        programs = {**PROGRAM_MAPPINGS, **getattr(settings, 'STATEMENT_IMPORT_MAPPINGS', {})}
+        name = programs.get(program.search_name, DEFAULT_MAPPING)
+    try:
+        return MAPPINGS[name]
+    except KeyError:
+        raise StatementImportError(f"Mapeamento desconhecido: {name}") from None
+
+
+# Planilha brasileira: "data;descricao;pontos" com 31/01/2025 e 1.234,56.
+register_mapping('generic', ColumnMapping(
+    date='data', amount='pontos', description='descricao', cost='custo', delimiter=';',
+    decimal_separator=',', thousands_separator='.', date_formats=('%d/%m/%Y %H:%M', '%d/%m/%Y'),
+))
+# O extrato CSV do próprio EasyMiles (api.statements): permite levar o histórico para outra conta.
+register_mapping('easymiles', ColumnMapping(date='data', amount='movimento', description='descricao'))
+
+
+def read_rows(stream, mapping):
+    """Gera ``(número da linha, campos, posições das colunas)`` do arquivo binário ``stream``, sem carregá-lo inteiro."""
+    text = io.TextIOWrapper(stream, encoding=mapping.encoding, newline='')
+    try:
+        reader = csv.reader(text, delimiter=mapping.delimiter)
+        header = next(reader, None)
+        if header is None:
+            raise StatementImportError("Arquivo vazio.")
+        indexes = mapping.resolve(header)
+        for row in reader:
+            if row:
+                yield reader.line_num, row, indexes
+    except UnicodeDecodeError:
+        raise StatementImportError(f"O arquivo não está em {mapping.encoding}.") from None
+    except csv.Error as exc:
+        raise StatementImportError(f"CSV inválido: {exc}") from None
+    finally:
+        # O arquivo enviado é do Django: não deixa o wrapper fechá-lo.
+        text.detach()
+
+
+def import_hash(account_id, date, amount, description, occurrence):
+    key = f'{account_id}|{date.isoformat()}|{amount}|{description}|{occurrence}'
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def parse_rows(account, stream, mapping, result):
+    """
+    Gera ``(data, movimento com sinal, descrição, custo, hash)`` das linhas do
+    arquivo; linhas inválidas vão para ``result``.
+    """
+    occurrences = Counter()
+    for line, row, indexes in read_rows(stream, mapping):
+        try:
+            parsed = mapping.parse(row, indexes)
+        except RowError as exc:
+            result['invalid'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'line': line, 'error': str(exc)})
+            continue
+        if parsed is None or not parsed[1]:
+            continue
+        date, amount, description, cost = parsed
+        key = (date, amount, description)
+        occurrences[key] += 1
+        yield date, amount, description, cost, import_hash(account.pk, date, amount, description, occurrences[key])
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def _transaction_values(account_id, row):
+    """Créditos viram Inclusão Manual no destino; débitos, Resgate na origem."""
+    date, amount, description, cost, row_hash = row
+    credit = amount > 0
+    return {
+        'transaction_type': CREDIT_TYPE if credit else DEBIT_TYPE,
+        'amount': abs(amount),
+        'cost': cost if credit else None,
+        'origin_account_id': None if credit else account_id,
+        'destination_account_id': account_id if credit else None,
+        'description': description,
+        'transaction_date': date,
+        'import_hash': row_hash,
+    }
+
+
+def insert_transactions(account_id, rows, change_seq):
+    """
+    Grava as linhas como transações. No PostgreSQL e no SQLite é um INSERT de
+    várias linhas por comando só com as colunas preenchidas: o ``bulk_create``
+    instancia o modelo e prepara todos os campos de cada linha, o que domina o
+    tempo de arquivos grandes.
+    """
+    connection = connections[router.db_for_write(PointsTransaction)]
+    now = timezone.now()
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(**_transaction_values(account_id, row), created_at=now, change_seq=change_seq)
+            for row in rows
+        ], batch_size=INSERT_BATCH_SIZE)
+        return
+
+    ops = connection.ops
+    names = [*_transaction_values(account_id, rows[0]), 'created_at', 'change_seq']
+    columns = ', '.join(ops.quote_name(PointsTransaction._meta.get_field(name).column) for name in names)
+    row_placeholder = f"({', '.join(['%s'] * len(names))})"
+    created_at = ops.adapt_datetimefield_value(now)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            chunk = rows[start:start + INSERT_BATCH_SIZE]
+            params = []
+            for row in chunk:
+                values = _transaction_values(account_id, row)
+                values['transaction_date'] = ops.adapt_datetimefield_value(values['transaction_date'])
+                params += [*values.values(), created_at, change_seq]
+            cursor.execute(
+                f"INSERT INTO {ops.quote_name(PointsTransaction._meta.db_table)} ({columns}) "
+                f"VALUES {', '.join([row_placeholder] * len(chunk))}",
+                params,
+            )
+
+
+def import_statement(account, stream, mapping, batch_size=None):
+    """
+    Importa o CSV ``stream`` na conta. Retorna as contagens (criadas, já
+    existentes, inválidas) e os primeiros erros por linha.
+    """
+    batch_size = batch_size or settings.STATEMENT_IMPORT_BATCH_SIZE
+    result = {'created': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    with atomic(), audit.operation('import_statement'):
+        account = LoyaltyAccount.objects.select_for_update(of=('self',)).select_related('wallet').get(pk=account.pk)
+        change_seq = SyncCounter.next_value(account.wallet.user_id)
+        since = None
+        for batch in _batches(parse_rows(account, stream, mapping, result), batch_size):
+            # Em ordem cronológica, como se cada linha tivesse sido lançada no dia.
+            batch.sort(key=lambda row: row[0])
+            # O intervalo de datas limita a busca às partições do lote.
+            existing = set(
+                PointsTransaction.objects.filter(
+                    import_hash__in=[row[4] for row in batch],
+                    transaction_date__range=(batch[0][0], batch[-1][0]),
+                ).order_by().values_list('import_hash', flat=True)
+            )
+            new = [row for row in batch if row[4] not in existing]
+            result['skipped'] += len(batch) - len(new)
+            if not new:
+                continue
+            insert_transactions(account.pk, new, change_seq)
+            result['created'] += len(new)
+
+            balance = account.current_balance
+            average_cost = account.average_cost if account.average_cost is not None else Decimal('0.00')
+            for date, amount, description, cost, row_hash in new:
+                if amount > 0:
+                    average_cost = weighted_average_cost(balance, average_cost, amount, cost or Decimal('0.00'))
+                balance += amount
+            account.current_balance = balance
+            account.average_cost = average_cost
+            account.last_updated = timezone.now()
+            account.save(update_fields=['current_balance', 'average_cost', 'last_updated'])
+            since = new[0][0] if since is None else min(since, new[0][0])
+
+        if since is not None:
+            rederive_balances([account.pk], since)
+    return result
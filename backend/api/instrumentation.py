@@ -0,0 +1,154 @@
+"""
+Amostragem de queries lentas (opt-in com ``QUERY_SAMPLER_ENABLED=True``).
+
+Cada query executada durante uma requisição é cronometrada via
+``connection.execute_wrapper`` e marcada com a view que a disparou (ex:
+``PointsTransactionViewSet.list``). Ao fim da requisição, os tempos agregados
+por fingerprint vão para um log JSON rotativo; queries acima de
+``QUERY_SAMPLER_THRESHOLD_MS`` também registram o ``EXPLAIN`` (ou
+``EXPLAIN ANALYZE`` com ``QUERY_SAMPLER_EXPLAIN_ANALYZE``). O relatório sai
+de ``manage.py query_report``.
+"""
+import contextlib
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections, transaction
+
+_local = threading.local()
+_loggers = {}
+_loggers_lock = threading.Lock()
+
+_in_list_re = re.compile(r"\bIN\s*\((?:\s*%s\s*,?)+\)", re.IGNORECASE)
+_string_re = re.compile(r"'(?:[^']|'')*'")
+_number_re = re.compile(r"\b\d+(?:\.\d+)?\b")
+_space_re = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """Normaliza o SQL (listas IN, literais, espaços) e devolve ``(hash, sql_normalizado)``."""
+    normalized = _in_list_re.sub("IN (...)", sql)
+    normalized = _string_re.sub("?", normalized)
+    normalized = _number_re.sub("?", normalized)
+    normalized = _space_re.sub(" ", normalized).strip()
+    return hashlib.md5(normalized.encode()).hexdigest()[:16], normalized
+
+
+def get_sampler_logger(path=None):
+    path = Path(path or settings.QUERY_SAMPLER_LOG_FILE)
+    with _loggers_lock:
+        logger = _loggers.get(path)
+        if logger is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            logger = logging.getLogger(f'api.query_sampler.{len(_loggers)}')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(
+                path,
+                maxBytes=getattr(settings, 'QUERY_SAMPLER_MAX_BYTES', 10 * 1024 * 1024),
+                backupCount=getattr(settings, 'QUERY_SAMPLER_BACKUP_COUNT', 5),
+                encoding='utf-8',
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _loggers[path] = logger
+    return logger
+
+
+def view_tag(view_func, method):
+    """``Classe.ação`` para views DRF (viewsets e APIViews) ou o nome da função."""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return getattr(view_func, '__name__', 'unknown')
+    actions = getattr(view_func, 'actions', None)
+    action = actions.get(method.lower()) if actions else method.lower()
+    return f"{cls.__name__}.{action}"
+
+
+class QueryRecorder:
+    def __init__(self, request_tag, threshold_ms, analyze):
+        self.request_tag = request_tag
+        self.threshold_ms = threshold_ms
+        self.analyze = analyze
+        self.timings = {}
+        self.samples = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_local, 'explaining', False):
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            digest, normalized = fingerprint(sql)
+            timing = self.timings.setdefault(digest, {'sql': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            timing['count'] += 1
+            timing['total_ms'] += elapsed_ms
+            timing['max_ms'] = max(timing['max_ms'], elapsed_ms)
+            if elapsed_ms >= self.threshold_ms:
+                self.samples.append({
+                    'fingerprint': digest,
+                    'sql': sql,
+                    'duration_ms': round(elapsed_ms, 3),
+                    'explain': self._explain(context['connection'], sql, params, many),
+                })
+
+    def _explain(self, connection, sql, params, many):
+        if many or not sql.lstrip().upper().startswith('SELECT'):
+            return None
+        options = {'analyze': True} if self.analyze and connection.vendor == 'postgresql' else {}
+        prefix = connection.ops.explain_query_prefix(**options)
+
+        _local.explaining = True
+        try:
+            # Savepoint: uma falha no EXPLAIN não pode abortar a transação da requisição.
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(f"{prefix} {sql}", params)
+                return '\n'.join(' '.join(str(col) for col in row) for row in cursor.fetchall())
+        except Exception as exc:
+            return f"EXPLAIN falhou: {exc}"
+        finally:
+            _local.explaining = False
+
+    def flush(self, logger, view, status_code):
+        timestamp = time.time()
+        for digest, timing in self.timings.items():
+            logger.info(json.dumps({
+                'kind': 'timing', 'ts': timestamp, 'view': view, 'status': status_code,
+                'fingerprint': digest, 'sql': timing['sql'], 'count': timing['count'],
+                'total_ms': round(timing['total_ms'], 3), 'max_ms': round(timing['max_ms'], 3),
+            }))
+        for sample in self.samples:
+            logger.info(json.dumps({'kind': 'sample', 'ts': timestamp, 'view': view, **sample}))
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_SAMPLER_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.threshold_ms = getattr(settings, 'QUERY_SAMPLER_THRESHOLD_MS', 100)
+        self.analyze = getattr(settings, 'QUERY_SAMPLER_EXPLAIN_ANALYZE', False)
+
+    def __call__(self, request):
+        recorder = QueryRecorder(request.path, self.threshold_ms, self.analyze)
+        request._query_recorder = recorder
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        recorder.flush(get_sampler_logger(), recorder.request_tag, response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_recorder.request_tag = view_tag(view_func, request.method)
@@ -0,0 +1,313 @@
+"""
+Efeito de cada transação no saldo das contas, com as mesmas regras de
+``PointsTransactionViewSet._apply_transaction_effects``/``_reverse_transaction_effects``:
+
+- Inclusão Manual (1): crédito em ``destination_account``.
+- Transferência (2): débito de ``amount`` na origem e crédito de
+  ``amount * (1 + bônus)`` no destino.
+- Resgate/Venda/Expiração (3, 4, 5): débito em ``origin_account``.
+- Ajuste (6): crédito no destino ou, sem destino, débito na origem.
+
+Também mantém o saldo corrente gravado em cada transação
+(``origin_balance_after``, ``destination_average_cost_after`` etc.): as
+transações de uma conta são ordenadas por ``(transaction_date, id)`` e, quando
+uma delas é incluída, editada ou removida, só as posteriores são recalculadas a
+partir da última anterior (a "âncora"). Sem âncora, o ponto de partida é o
+checkpoint do arquivo frio ou, na falta dele, o saldo atual menos o efeito de
+todas as transações.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import connections, router
+from django.db.models import Q
+
+CREDIT_TYPES = (1, 2, 6)
+DEBIT_ONLY_TYPES = (3, 4, 5)
+SIDES = ('origin', 'destination')
+BALANCE_FIELDS = [
+    'origin_balance_after', 'origin_average_cost_after',
+    'destination_balance_after', 'destination_average_cost_after',
+]
+ACCOUNT_FIELDS = ['id', 'current_balance', 'average_cost', 'opening_average_cost']
+LEDGER_FIELDS = [
+    'id', 'transaction_type', 'amount', 'cost', 'bonus_percentage',
+    'origin_account', 'destination_account', 'transaction_date', *BALANCE_FIELDS,
+]
+
+
+def credited_amount(transaction):
+    """Quantidade que entra no destino (com o bônus, no caso de transferências)."""
+    amount = abs(transaction.amount)
+    if transaction.transaction_type != 2:
+        return amount
+    bonus_perc = transaction.bonus_percentage if transaction.bonus_percentage is not None else Decimal('0.00')
+    credited = amount * (Decimal('1.00') + (bonus_perc / Decimal('100.00')))
+    return credited.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def account_delta(transaction, account_id):
+    """Variação de saldo que ``transaction`` provocou na conta ``account_id``."""
+    ttype = transaction.transaction_type
+    amount = abs(transaction.amount)
+    delta = Decimal('0.00')
+
+    if ttype == 1 and transaction.destination_account_id == account_id:
+        delta += amount
+    elif ttype == 2:
+        if transaction.origin_account_id == account_id:
+            delta -= amount
+        if transaction.destination_account_id == account_id:
+            delta += credited_amount(transaction)
+    elif ttype in DEBIT_ONLY_TYPES and transaction.origin_account_id == account_id:
+        delta -= amount
+    elif ttype == 6:
+        if transaction.destination_account_id is not None:
+            if transaction.destination_account_id == account_id:
+                delta += amount
+        elif transaction.origin_account_id == account_id:
+            delta -= amount
+    return delta
+
+
+def is_credit_to(transaction, account_id):
+    """Indica se a transação creditou a conta (e portanto pode ter alterado o custo médio)."""
+    return transaction.transaction_type in CREDIT_TYPES and transaction.destination_account_id == account_id
+
+
+def weighted_average_cost(current_balance, current_avg_cost, added_amount, added_cost):
+    """Custo médio ponderado (por milheiro) após a entrada de ``added_amount`` pontos."""
+    if added_amount <= 0:
+        return current_avg_cost
+
+    old_total_cost = (current_balance / Decimal('1000.0')) * current_avg_cost
+    new_total_cost = old_total_cost + added_cost
+    new_total_balance = current_balance + added_amount
+
+    if new_total_balance > 0:
+        new_avg = (new_total_cost / new_total_balance) * Decimal('1000.0')
+        return new_avg.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return Decimal('0.00')
+
+
+def credited_cost(transaction, origin_average_cost):
+    """Custo que entra no destino: o informado e, em transferências, o custo dos pontos na origem."""
+    cost = transaction.cost if transaction.cost is not None else Decimal('0.00')
+    if transaction.transaction_type == 2:
+        cost += (abs(transaction.amount) / Decimal('1000.0')) * (origin_average_cost or Decimal('0.00'))
+    return cost
+
+
+def derive(rows, states):
+    """
+    Aplica ``rows`` (em ordem cronológica) sobre ``states`` (``{conta: (saldo,
+    custo médio)}``), gravando nos objetos o saldo após cada transação das
+    contas presentes em ``states``. Retorna as linhas cujos valores mudaram.
+    """
+    changed = []
+    for tx in rows:
+        previous = [getattr(tx, field) for field in BALANCE_FIELDS]
+        origin_id = tx.origin_account_id
+        origin_avg = states[origin_id][1] if origin_id in states else tx.origin_average_cost_after
+
+        for account_id in (origin_id, tx.destination_account_id):
+            if account_id not in states:
+                continue
+            balance, avg = states[account_id]
+            if is_credit_to(tx, account_id):
+                avg = weighted_average_cost(balance, avg, credited_amount(tx), credited_cost(tx, origin_avg))
+            states[account_id] = (balance + account_delta(tx, account_id), avg)
+
+        for side in SIDES:
+            account_id = getattr(tx, f'{side}_account_id')
+            if account_id in states:
+                setattr(tx, f'{side}_balance_after', states[account_id][0])
+                setattr(tx, f'{side}_average_cost_after', states[account_id][1])
+        if [getattr(tx, field) for field in BALANCE_FIELDS] != previous:
+            changed.append(tx)
+    return changed
+
+
+def opening_state(account, total_delta, checkpoint=None):
+    """
+    Saldo e custo médio antes da primeira transação da conta na tabela
+    quente, sendo ``total_delta`` o efeito somado de todas elas. O custo médio
+    vem do checkpoint do arquivo ou do registrado na criação da conta; para
+    contas anteriores a esse registro, usa-se o atual (exato quando o saldo de
+    abertura é zero ou não houve créditos).
+    """
+    if checkpoint is not None and checkpoint.opening_average_cost is not None:
+        return checkpoint.opening_balance, checkpoint.opening_average_cost
+    balance = checkpoint.opening_balance if checkpoint is not None else account.current_balance - total_delta
+    if account.opening_average_cost is not None and checkpoint is None:
+        return balance, account.opening_average_cost
+    if balance == 0:
+        return balance, Decimal('0.00')
+    return balance, account.average_cost if account.average_cost is not None else Decimal('0.00')
+
+
+def _stored_state(tx, account_id):
+    side = 'origin' if tx.origin_account_id == account_id else 'destination'
+    return getattr(tx, f'{side}_balance_after'), getattr(tx, f'{side}_average_cost_after')
+
+
+def _last_before(account_id, since, inclusive=False):
+    """Última transação da conta antes de ``since``: uma busca por índice em cada lado."""
+    from .models import PointsTransaction
+
+    lookup = 'transaction_date__lte' if inclusive else 'transaction_date__lt'
+    candidates = [
+        PointsTransaction.objects.filter(**{f'{side}_account_id': account_id, lookup: since})
+        .order_by('-transaction_date', '-id').only(*LEDGER_FIELDS).first()
+        for side in SIDES
+    ]
+    candidates = [tx for tx in candidates if tx is not None]
+    return max(candidates, key=lambda tx: (tx.transaction_date, tx.id)) if candidates else None
+
+
+def rederive_balances(account_ids, since=None):
+    """
+    Recalcula o saldo gravado nas transações das contas a partir de ``since``
+    (inclusive; ``None`` recalcula tudo) e salva só as linhas alteradas, com
+    nova sequência de sync. Transferências propagam o recálculo ao destino,
+    porque o custo médio da origem entra no custo do destino. O estado final
+    de cada conta com transações volta para ``LoyaltyAccount``: uma inclusão
+    retroativa muda o custo médio calculado na ordem de chegada.
+    """
+    from .audit import operation
+    from .models import ArchiveCheckpoint, LoyaltyAccount, PointsTransaction, SyncCounter
+
+    account_ids = {pk for pk in account_ids if pk is not None}
+    if not account_ids:
+        return []
+
+    while True:
+        account_filter = Q(origin_account_id__in=account_ids) | Q(destination_account_id__in=account_ids)
+        queryset = PointsTransaction.objects.filter(account_filter)
+        if since is not None:
+            queryset = queryset.filter(transaction_date__gte=since)
+        rows = list(queryset.order_by('transaction_date', 'id').only(*LEDGER_FIELDS))
+        reached = {
+            tx.destination_account_id for tx in rows
+            if tx.transaction_type == 2 and tx.origin_account_id in account_ids
+            and tx.destination_account_id is not None and tx.destination_account_id not in account_ids
+        }
+        if not reached:
+            break
+        account_ids |= reached
+
+    accounts = (
+        LoyaltyAccount.objects.select_related('wallet').only(*ACCOUNT_FIELDS, 'wallet__user').in_bulk(account_ids)
+    )
+    checkpoints = {
+        checkpoint.account_id: checkpoint
+        for checkpoint in ArchiveCheckpoint.objects.filter(account_id__in=accounts)
+    }
+    states = {}
+    in_ledger = {account_id for tx in rows for account_id in (tx.origin_account_id, tx.destination_account_id)}
+    for account_id, account in accounts.items():
+        anchor = _last_before(account_id, since) if since is not None else None
+        if anchor is not None and _stored_state(anchor, account_id)[0] is not None:
+            states[account_id] = _stored_state(anchor, account_id)
+            in_ledger.add(account_id)
+        elif anchor is not None:
+            # Âncora sem saldo gravado (dados anteriores ao ledger): recalcula a conta inteira.
+            return rederive_balances(account_ids, since=None)
+        else:
+            total_delta = sum((account_delta(tx, account_id) for tx in rows), Decimal('0.00'))
+            states[account_id] = opening_state(account, total_delta, checkpoints.get(account_id))
+
+    changed = derive(rows, states)
+    if changed:
+        owners = dict(LoyaltyAccount.objects.filter(pk__in=accounts).values_list('pk', 'wallet__user_id'))
+        tx_owners = {
+            tx.pk: owners.get(tx.origin_account_id) or owners.get(tx.destination_account_id) for tx in changed
+        }
+        # Um contador por dono, em ordem de usuário para que recálculos concorrentes não se travem.
+        change_seqs = {
+            user_id: SyncCounter.next_value(user_id) for user_id in sorted(set(tx_owners.values()) - {None})
+        }
+        for tx in changed:
+            tx.change_seq = change_seqs.get(tx_owners[tx.pk], tx.change_seq)
+        save_balances(changed)
+
+    with operation('rederive_balances'):
+        for account_id in sorted(in_ledger & set(accounts)):
+            account = accounts[account_id]
+            balance, avg = states[account_id]
+            if avg is None:
+                avg = account.average_cost
+            if (account.current_balance, account.average_cost) != (balance, avg):
+                account.current_balance, account.average_cost = balance, avg
+                account.save(update_fields=['current_balance', 'average_cost'])
+    return changed
+
+
+def save_balances(rows, batch_size=1000):
+    """
+    Grava ``BALANCE_FIELDS`` e ``change_seq`` das linhas. No PostgreSQL e no
+    SQLite é um ``UPDATE ... FROM (VALUES ...)`` por lote: o ``bulk_update``
+    monta um ``CASE`` por campo e linha, caro demais para recálculos grandes
+    (importação de extratos).
+    """
+    from .models import PointsTransaction
+
+    connection = connections[router.db_for_write(PointsTransaction)]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        PointsTransaction.objects.bulk_update(rows, BALANCE_FIELDS + ['change_seq'], batch_size=500)
+        return
+
+    ops = connection.ops
+    table = ops.quote_name(PointsTransaction._meta.db_table)
+    assignments = ', '.join(f'{field} = CAST(v.{field} AS NUMERIC)' for field in BALANCE_FIELDS)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = []
+            for tx in batch:
+                # A data entra na junção para o PostgreSQL ler só as partições do lote.
+                params += [tx.pk, ops.adapt_datetimefield_value(tx.transaction_date)]
+                params += [getattr(tx, field) for field in BALANCE_FIELDS]
+                params.append(tx.change_seq)
+            placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(batch))
+            cursor.execute(
+                f"WITH v (id, transaction_date, {', '.join(BALANCE_FIELDS)}, change_seq) AS (VALUES {placeholders}) "
+                f"UPDATE {table} SET {assignments}, change_seq = v.change_seq FROM v "
+                f"WHERE {table}.id = v.id AND {table}.transaction_date = v.transaction_date",
+                params,
+            )
+
+
+def balance_at(account, at):
+    """
+    Saldo e custo médio da conta em ``at``, a partir do saldo gravado na
+    última transação até essa data. Retorna ``(saldo, custo médio, transação)``.
+    """
+    from .archive import archived_transactions
+    from .models import ArchiveCheckpoint, PointsTransaction
+
+    last = _last_before(account.pk, at, inclusive=True)
+    if last is not None and _stored_state(last, account.pk)[0] is not None:
+        return (*_stored_state(last, account.pk), last)
+
+    checkpoint = ArchiveCheckpoint.objects.filter(account=account).first()
+    if checkpoint is not None:
+        if at < checkpoint.cutoff:
+            archived = archived_transactions(account.wallet.user, {'account': account.pk, 'date_before': at})
+            archived.sort(key=lambda tx: (tx.transaction_date, tx.id))
+            if archived and _stored_state(archived[-1], account.pk)[0] is not None:
+                return (*_stored_state(archived[-1], account.pk), archived[-1])
+            return None, None, None
+        return checkpoint.opening_balance, checkpoint.opening_average_cost, None
+
+    # Antes da primeira transação: desfaz o efeito dela sobre o saldo gravado.
+    first = PointsTransaction.objects.filter(
+        Q(origin_account_id=account.pk) | Q(destination_account_id=account.pk)
+    ).order_by('transaction_date', 'id').only(*LEDGER_FIELDS).first()
+    if first is None or _stored_state(first, account.pk)[0] is None:
+        return account.current_balance, account.average_cost, None
+    balance, avg = _stored_state(first, account.pk)
+    opening_balance = balance - account_delta(first, account.pk)
+    if is_credit_to(first, account.pk):
+        # O primeiro crédito alterou o custo médio: o de abertura segue a mesma regra do recálculo.
+        avg = opening_state(account, account.current_balance - opening_balance)[1]
+    return opening_balance, avg, None
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from api.archive import archive_transactions, require_pyarrow
+from api.partitioning import drop_empty_partitions, month_start
+from api.sharding import shard_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Move as transações anteriores ao corte (início de mês, UTC) para o arquivo frio "
+        "em ARCHIVE_ROOT e registra o saldo de abertura de cada conta no corte."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', default=None, help="Data de corte AAAA-MM-DD (arredondada para o início do mês)")
+        parser.add_argument('--older-than-days', type=int, default=None, help="Padrão: ARCHIVE_AFTER_DAYS")
+        parser.add_argument('--user', type=int, action='append', dest='users', help="Restringe a um usuário (repetível)")
+
+    def handle(self, *args, **options):
+        try:
+            require_pyarrow()
+        except ImproperlyConfigured as exc:
+            raise CommandError(str(exc))
+
+        if options['before']:
+            try:
+                cutoff = datetime.strptime(options['before'], '%Y-%m-%d').replace(tzinfo=dt_timezone.utc)
+            except ValueError:
+                raise CommandError("Use o formato AAAA-MM-DD em --before.")
+        else:
+            days = options['older_than_days']
+            cutoff = timezone.now() - timedelta(days=days if days is not None else settings.ARCHIVE_AFTER_DAYS)
+        cutoff = month_start(cutoff)
+
+        archived = {}
+        for alias in shard_aliases():
+            with use_shard(alias):
+                archived.update(archive_transactions(cutoff, users=options['users']))
+
+            # Com a tabela particionada, meses esvaziados pelo arquivamento são removidos por inteiro.
+            for name in drop_empty_partitions(connections[alias], cutoff):
+                self.stdout.write(f"Partição removida ({alias}): {name}")
+        for user_id, count in archived.items():
+            if count:
+                self.stdout.write(f"Usuário {user_id}: {count} transação(ões) arquivada(s).")
+
+        total = sum(archived.values())
+        self.stdout.write(self.style.SUCCESS(f"{total} transação(ões) arquivada(s) antes de {cutoff:%Y-%m-%d}."))
@@ -0,0 +1,72 @@
+import gzip
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.middleware import brotli
+from api.models import LoyaltyAccount, PointsTransaction
+from api.renderers import ORJSONRenderer
+from api.serializers import PointsTransactionSerializer
+
+
+class Command(BaseCommand):
+    help = "Compara JSONRenderer x ORJSONRenderer e gzip x brotli numa lista de transações em memória."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        data = PointsTransactionSerializer(self._build_transactions(rows), many=True).data
+        self.stdout.write(f"{rows} transações, melhor de {repeat} execuções\n")
+
+        payloads = {}
+        for label, renderer in (('JSONRenderer', JSONRenderer()), ('ORJSONRenderer', ORJSONRenderer())):
+            elapsed, payloads[label] = self._best_of(repeat, lambda: renderer.render(data))
+            self.stdout.write(f"{label:<16} {elapsed * 1000:8.1f} ms  {len(payloads[label]):>10} bytes")
+
+        if payloads['JSONRenderer'] != payloads['ORJSONRenderer']:
+            self.stdout.write(self.style.WARNING("As saídas dos renderers diferem."))
+
+        body = payloads['ORJSONRenderer']
+        codecs = [('gzip', lambda: gzip.compress(body, compresslevel=6))]
+        if brotli is not None:
+            codecs.append(('brotli q5', lambda: brotli.compress(body, quality=5)))
+        for label, compress in codecs:
+            elapsed, compressed = self._best_of(repeat, compress)
+            self.stdout.write(f"{label:<16} {elapsed * 1000:8.1f} ms  {len(compressed):>10} bytes")
+
+    def _best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def _build_transactions(self, rows):
+        origin = LoyaltyAccount(pk=1, name="Conta Origem")
+        destination = LoyaltyAccount(pk=2, name="Conta Destino")
+        now = timezone.now()
+        transactions = []
+        for i in range(rows):
+            ttype = (i % 6) + 1
+            transactions.append(PointsTransaction(
+                pk=i + 1,
+                transaction_type=ttype,
+                amount=Decimal('1000.00') + i,
+                cost=Decimal('23.50') + (i % 100),
+                origin_account=origin if ttype != 1 else None,
+                destination_account=destination if ttype in (1, 2) else None,
+                bonus_percentage=Decimal('80.00') if ttype == 2 else None,
+                description=f"Transação de benchmark {i}",
+                transaction_date=now - timedelta(hours=i),
+                created_at=now,
+            ))
+        return transactions
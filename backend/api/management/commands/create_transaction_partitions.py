@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from api.partitioning import create_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = (
+        "Cria as partições mensais futuras de api_pointstransaction (PostgreSQL). "
+        "Idempotente: agende diariamente (cron) para manter sempre meses à frente prontos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=None, help="Padrão: TRANSACTION_PARTITIONS_AHEAD")
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not is_partitioned(connection):
+            self.stdout.write("Tabela de transações não é particionada neste banco; nada a fazer.")
+            return
+
+        months_ahead = options['months_ahead']
+        if months_ahead is None:
+            months_ahead = settings.TRANSACTION_PARTITIONS_AHEAD
+        with transaction.atomic(using=options['database']):
+            created = create_partitions(connection, months_ahead=months_ahead)
+
+        for name in created:
+            self.stdout.write(f"Criada: {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partição(ões) criada(s)."))
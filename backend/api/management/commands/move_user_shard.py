@@ -0,0 +1,38 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.sharding import is_enabled, move_user, shard_aliases, shard_for_user
+
+
+class Command(BaseCommand):
+    help = (
+        "Move carteiras, contas, transações e demais dados de um usuário para outro shard, "
+        "mantendo os ids. As requisições do usuário recebem 503 durante a cópia."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help="Id ou username do usuário")
+        parser.add_argument('shard', help="Alias do shard de destino (ver DB_SHARDS)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Linhas por lote (padrão: 2000)")
+
+    def handle(self, *args, **options):
+        if not is_enabled():
+            raise CommandError("Sharding desligado: defina DB_SHARDS.")
+        if options['shard'] not in shard_aliases():
+            raise CommandError(f"Shard desconhecido: {options['shard']} (disponíveis: {', '.join(shard_aliases())}).")
+
+        User = get_user_model()
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'username': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except User.DoesNotExist:
+            raise CommandError(f"Usuário não encontrado: {options['user']}")
+
+        source, _ = shard_for_user(user.pk)
+        copied = move_user(user, options['shard'], chunk_size=options['chunk_size'])
+        if not copied:
+            self.stdout.write(f"{user} já está em {options['shard']}.")
+            return
+        for model_name, count in copied.items():
+            self.stdout.write(f"{model_name}: {count} linha(s).")
+        self.stdout.write(self.style.SUCCESS(f"{user}: {source} -> {options['shard']}."))
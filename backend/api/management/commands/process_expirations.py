@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from collections import Counter
+
+from api.expiration import process_expirations
+from api.sharding import shard_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Lança as expirações (tipo 5) vencidas pela validade de cada programa, para todos "
+        "os usuários, em lotes de contas com inserções e atualizações de saldo em massa."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Contas por lote (padrão: 1000)")
+        parser.add_argument('--program', type=int, action='append', dest='programs', help="Restringe a um programa (repetível)")
+
+    def handle(self, *args, **options):
+        created = Counter()
+        for alias in shard_aliases():
+            with use_shard(alias):
+                created.update(process_expirations(chunk_size=options['chunk_size'], programs=options['programs']))
+        for program, count in created.items():
+            if count:
+                self.stdout.write(f"{program}: {count} expiração(ões) lançada(s).")
+        self.stdout.write(self.style.SUCCESS(f"{sum(created.values())} expiração(ões) lançada(s)."))
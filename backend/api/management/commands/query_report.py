@@ -0,0 +1,66 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Ranqueia os fingerprints de query do log de amostragem pelo tempo total."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log-file', default=None, help="Padrão: QUERY_SAMPLER_LOG_FILE")
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--view', default=None, help="Filtra por view (ex: SummaryAPIView.get)")
+        parser.add_argument('--explain', action='store_true', help="Mostra o EXPLAIN da amostra mais lenta")
+
+    def handle(self, *args, **options):
+        log_file = Path(options['log_file'] or settings.QUERY_SAMPLER_LOG_FILE)
+        stats = {}
+        for record in self._read_records(log_file):
+            if options['view'] and record.get('view') != options['view']:
+                continue
+            entry = stats.setdefault(record['fingerprint'], {
+                'sql': record.get('sql', ''), 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'views': set(), 'samples': 0, 'slowest_sample': None,
+            })
+            entry['views'].add(record.get('view'))
+            if record['kind'] == 'timing':
+                entry['count'] += record['count']
+                entry['total_ms'] += record['total_ms']
+                entry['max_ms'] = max(entry['max_ms'], record['max_ms'])
+            elif record['kind'] == 'sample':
+                entry['samples'] += 1
+                slowest = entry['slowest_sample']
+                if slowest is None or record['duration_ms'] > slowest['duration_ms']:
+                    entry['slowest_sample'] = record
+
+        if not stats:
+            self.stdout.write("Nenhum registro encontrado.")
+            return
+
+        ranked = sorted(stats.items(), key=lambda item: item[1]['total_ms'], reverse=True)[:options['limit']]
+        for position, (digest, entry) in enumerate(ranked, start=1):
+            avg_ms = entry['total_ms'] / entry['count'] if entry['count'] else 0.0
+            self.stdout.write(
+                f"{position:>3}. {digest}  total={entry['total_ms']:.1f}ms  chamadas={entry['count']}  "
+                f"média={avg_ms:.2f}ms  máx={entry['max_ms']:.1f}ms  amostras={entry['samples']}"
+            )
+            self.stdout.write(f"     views: {', '.join(sorted(v for v in entry['views'] if v))}")
+            self.stdout.write(f"     {entry['sql'][:300]}")
+            if options['explain'] and entry['slowest_sample'] and entry['slowest_sample'].get('explain'):
+                for line in entry['slowest_sample']['explain'].splitlines():
+                    self.stdout.write(f"       {line}")
+
+    def _read_records(self, log_file):
+        # Inclui os arquivos rotacionados (queries.log.1, queries.log.2, ...).
+        files = sorted(log_file.parent.glob(f"{log_file.name}.*"), reverse=True) + [log_file]
+        for path in files:
+            if not path.exists():
+                continue
+            with path.open(encoding='utf-8') as handle:
+                for line in handle:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
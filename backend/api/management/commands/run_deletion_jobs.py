@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.deletion import run_deletion_job
+from api.models import DeletionJob
+from api.sharding import shard_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = (
+        "Executa (ou retoma, após uma interrupção) os jobs de exclusão em lotes pendentes. "
+        "Jobs em execução só são retomados depois de DELETION_JOB_STALE_SECONDS sem heartbeat."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-failed', action='store_true', help="Também tenta de novo os jobs que falharam")
+
+    def handle(self, *args, **options):
+        statuses = list(DeletionJob.ACTIVE_STATUSES)
+        if options['include_failed']:
+            statuses.append(DeletionJob.STATUS_FAILED)
+        for alias in shard_aliases():
+            with use_shard(alias):
+                for job_id in DeletionJob.objects.filter(status__in=statuses).order_by('pk').values_list('pk', flat=True):
+                    job = run_deletion_job(job_id, retry_failed=options['include_failed'])
+                    if job is None:
+                        self.stdout.write(f"Job {job_id}: em execução por outro executor, ignorado.")
+                        continue
+                    self.stdout.write(f"{job}: {job.processed}/{job.total} transação(ões).")
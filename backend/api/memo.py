@@ -0,0 +1,133 @@
+"""
+Cache em memória (por worker) dos resultados de simulação.
+
+A chave é ``(usuário, simulação, entradas normalizadas)`` e cada entrada guarda
+a versão (``change_seq``) das contas envolvidas quando foi calculada. Na
+consulta basta uma leitura de ``pk``/``change_seq`` pela chave primária: se
+alguma conta mudou desde então (inclusive em outro worker), a entrada é
+descartada e o resultado recalculado. Os eventos do ``broker`` sobre as contas
+(``account.*``) removem as entradas na hora, sem esperar a próxima consulta.
+
+O tamanho é limitado (``SIMULATION_CACHE_SIZE`` entradas, despejo LRU) e cada
+entrada expira em ``SIMULATION_CACHE_TTL`` segundos, o que também limita por
+quanto tempo uma alteração no programa (nome, cotação) pode não aparecer.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+
+from .metrics import record_cache
+from .models import LoyaltyAccount
+
+CACHE_NAME = 'simulation'
+
+
+def normalize_inputs(data):
+    """Entradas validadas em forma canônica: ``Decimal('10.0')`` e ``Decimal('10.00')`` viram a mesma chave."""
+    def normalize(value):
+        if isinstance(value, Decimal):
+            return str(value.normalize())
+        if isinstance(value, dict):
+            return normalize_inputs(value)
+        if isinstance(value, (list, tuple)):
+            return tuple(normalize(item) for item in value)
+        return value
+    return tuple(sorted((name, normalize(value)) for name, value in data.items()))
+
+
+def account_versions(user, account_ids):
+    """``((pk, change_seq), ...)`` das contas do usuário, ou ``None`` se alguma não existir."""
+    account_ids = sorted(set(account_ids))
+    versions = tuple(
+        LoyaltyAccount.objects.filter(pk__in=account_ids, wallet__user=user)
+        .order_by('pk').values_list('pk', 'change_seq')
+    )
+    if len(versions) != len(account_ids):
+        return None
+    return versions
+
+
+class SimulationCache:
+    def __init__(self, max_entries=None, ttl=None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_account = defaultdict(set)
+
+    @property
+    def max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return getattr(settings, 'SIMULATION_CACHE_SIZE', 1024)
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'SIMULATION_CACHE_TTL', 300)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, versions):
+        """Resultado guardado para ``key`` se as contas ainda estão em ``versions``."""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_versions, result, expires_at = entry
+                if stored_versions == versions and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                else:
+                    self._discard(key)
+                    entry = None
+        record_cache(CACHE_NAME, entry is not None)
+        return result if entry is not None else None
+
+    def set(self, key, versions, result):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (versions, result, time.monotonic() + self.ttl)
+            for account_id, _ in versions:
+                self._by_account[account_id].add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_accounts(self, account_ids):
+        with self._lock:
+            for account_id in account_ids:
+                for key in list(self._by_account.get(account_id, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_account.clear()
+
+    def on_event(self, user_id, event):
+        """Listener do ``broker``: qualquer alteração de conta derruba as simulações que a usam."""
+        if event.get('type', '').startswith('account.'):
+            account_id = (event.get('data') or {}).get('id')
+            if account_id is not None:
+                self.invalidate_accounts([account_id])
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for account_id, _ in entry[0]:
+            keys = self._by_account.get(account_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_account[account_id]
+
+
+simulation_cache = SimulationCache()
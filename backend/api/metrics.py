@@ -0,0 +1,165 @@
+"""
+Métricas no formato Prometheus, expostas em ``/metrics``.
+
+- ``easymiles_http_request_duration_seconds`` e ``easymiles_http_requests_total``
+  por rota (nome da URL em ``api/urls.py``, ex: ``loyaltyaccount-list-detail``),
+  método e, no contador, status;
+- ``easymiles_db_queries_per_request`` e ``easymiles_db_time_per_request_seconds``
+  por rota;
+- contadores de negócio: transações aplicadas por tipo, simulações por tipo
+  (com a duração separada por acerto/falha do cache de simulações) e
+  acertos/falhas dos caches da aplicação.
+
+Com vários workers (gunicorn), defina ``PROMETHEUS_MULTIPROC_DIR`` com um
+diretório vazio antes de iniciá-los (o ``entrypoint.sh`` já faz isso): cada
+processo grava seus valores em arquivos mmap nesse diretório e ``/metrics``
+soma todos. Sem a variável, os valores ficam na memória do processo.
+
+O acesso exige ``Authorization: Bearer <METRICS_TOKEN>``; sem token
+configurado, ``/metrics`` só responde com ``DEBUG`` ligado (403 fora dele).
+
+Requer ``prometheus_client`` (dependência opcional; sem ele nada é registrado
+e ``/metrics`` responde 503).
+"""
+import contextlib
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+    )
+except ImportError:  # pragma: no cover - dependência opcional
+    Counter = Histogram = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, amount):
+        pass
+
+
+def _metric(kind, name, documentation, labelnames, **kwargs):
+    if kind is None:
+        return _NoopMetric()
+    return kind(name, documentation, labelnames, **kwargs)
+
+
+REQUEST_LATENCY = _metric(
+    Histogram, 'easymiles_http_request_duration_seconds', "Latência das requisições por rota",
+    ['route', 'method'], buckets=LATENCY_BUCKETS,
+)
+REQUESTS = _metric(
+    Counter, 'easymiles_http_requests_total', "Requisições por rota, método e status",
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = _metric(
+    Histogram, 'easymiles_db_queries_per_request', "Queries executadas por requisição",
+    ['route'], buckets=QUERY_COUNT_BUCKETS,
+)
+DB_TIME = _metric(
+    Histogram, 'easymiles_db_time_per_request_seconds', "Tempo total em queries por requisição",
+    ['route'], buckets=DB_TIME_BUCKETS,
+)
+TRANSACTIONS_APPLIED = _metric(
+    Counter, 'easymiles_transactions_applied_total', "Transações aplicadas aos saldos por tipo",
+    ['transaction_type'],
+)
+SIMULATIONS = _metric(
+    Counter, 'easymiles_simulations_total', "Simulações executadas por tipo",
+    ['kind'],
+)
+SIMULATION_LATENCY = _metric(
+    Histogram, 'easymiles_simulation_duration_seconds', "Tempo das simulações por tipo e resultado do cache",
+    ['kind', 'cache'], buckets=LATENCY_BUCKETS,
+)
+COALESCED_REQUESTS = _metric(
+    Counter, 'easymiles_coalesced_requests_total', "Leituras por endpoint: calculadas (leader) ou compartilhadas (shared)",
+    ['endpoint', 'result'],
+)
+CACHE_REQUESTS = _metric(
+    Counter, 'easymiles_cache_requests_total', "Consultas aos caches da aplicação",
+    ['cache', 'result'],
+)
+
+
+def record_cache(cache_name, hit):
+    CACHE_REQUESTS.labels(cache=cache_name, result='hit' if hit else 'miss').inc()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+class _QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    Mede latência e queries de cada requisição. Em respostas em streaming
+    (extratos, SSE) a latência vai até o início da resposta.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        route, method = route_name(request), request.method
+        REQUEST_LATENCY.labels(route=route, method=method).observe(elapsed)
+        REQUESTS.labels(route=route, method=method, status=str(response.status_code)).inc()
+        DB_QUERIES.labels(route=route).observe(timer.count)
+        DB_TIME.labels(route=route).observe(timer.seconds)
+        return response
+
+
+def metrics_view(request):
+    if Counter is None:
+        return HttpResponse("prometheus_client não instalado.", status=503, content_type='text/plain')
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token and not settings.DEBUG:
+        # Fora do DEBUG, sem token configurado o endpoint fica fechado.
+        return HttpResponse("Defina METRICS_TOKEN para expor /metrics.", status=403, content_type='text/plain')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
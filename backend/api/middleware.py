@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependência opcional
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compressão negociada por ``Accept-Encoding``: brotli quando o cliente aceita
+    e o pacote está instalado, senão gzip. Só comprime respostas acima de
+    ``API_COMPRESSION_MIN_LENGTH`` bytes; respostas em streaming (SSE, exportações)
+    passam direto para não serem bufferizadas.
+    """
+
+    def process_response(self, request, response):
+        if response.streaming:
+            return response
+        if len(response.content) < getattr(settings, 'API_COMPRESSION_MIN_LENGTH', 1024):
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+
+        ae = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is None or not re_accepts_brotli.search(ae):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(
+            response.content, quality=getattr(settings, 'API_BROTLI_QUALITY', 5)
+        )
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_sync_change_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['origin_account', 'transaction_date'], name='api_tx_origin_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['destination_account', 'transaction_date'], name='api_tx_dest_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['origin_account', 'transaction_type', 'transaction_date'], name='api_tx_origin_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['destination_account', 'transaction_type', 'transaction_date'], name='api_tx_dest_type_date_idx'),
+        ),
+    ]
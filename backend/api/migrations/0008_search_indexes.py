@@ -0,0 +1,44 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Índices trigram na coluna crua, como criados nesta migration. A 0023 os troca
+# pelos índices sobre api_unaccent(coluna) de api.search.
+RAW_TRIGRAM_INDEXES = [
+    ('api_tx_description_trgm', 'api_pointstransaction', 'description'),
+    ('api_account_name_trgm', 'api_loyaltyaccount', 'name'),
+    ('api_account_number_trgm', 'api_loyaltyaccount', 'account_number'),
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for index_name, table, column in RAW_TRIGRAM_INDEXES:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING gin ({column} gin_trgm_ops)"
+            )
+    elif connection.vendor == 'sqlite':
+        from api.search import ensure_search_indexes
+        ensure_search_indexes(connection)
+
+
+def drop_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for index_name, _, _ in RAW_TRIGRAM_INDEXES:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    elif connection.vendor == 'sqlite':
+        from api.search import drop_search_indexes
+        drop_search_indexes(connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_transaction_filter_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
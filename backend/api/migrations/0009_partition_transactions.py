@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def partition_transactions(apps, schema_editor):
+    from api.partitioning import partition_table
+    partition_table(schema_editor.connection, months_ahead=settings.TRANSACTION_PARTITIONS_AHEAD)
+
+
+def unpartition_transactions(apps, schema_editor):
+    from api.partitioning import unpartition_table
+    unpartition_table(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+    """Particiona ``api_pointstransaction`` por mês no PostgreSQL (no-op nos demais bancos)."""
+
+    dependencies = [
+        ('api', '0008_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_transactions, unpartition_transactions),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-19 13:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_partition_transactions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cutoff', models.DateTimeField()),
+                ('opening_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('opening_average_cost', models.DecimalField(blank=True, decimal_places=2, help_text='Custo médio no corte; nulo quando não pôde ser determinado com exatidão', max_digits=12, null=True)),
+                ('archived_count', models.PositiveIntegerField(default=0)),
+                ('acquisition_cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('points_sold', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('sales_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='archive_checkpoint', to='api.loyaltyaccount')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='Primeiro dia do mês arquivado')),
+                ('path', models.CharField(help_text='Caminho relativo a ARCHIVE_ROOT', max_length=500)),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_months', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['user', 'month'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'month'), name='api_archived_month_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2 on 2026-10-19 13:30
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def backfill_running_balances(apps, schema_editor):
+    from api.ledger import BALANCE_FIELDS, LEDGER_FIELDS, account_delta, derive, opening_state
+
+    PointsTransaction = apps.get_model('api', 'PointsTransaction')
+    LoyaltyAccount = apps.get_model('api', 'LoyaltyAccount')
+    ArchiveCheckpoint = apps.get_model('api', 'ArchiveCheckpoint')
+    transactions = PointsTransaction.objects.order_by('transaction_date', 'id').only(*LEDGER_FIELDS)
+
+    # 1ª passada: efeito total por conta, para o saldo de abertura.
+    deltas = defaultdict(Decimal)
+    for tx in transactions.iterator(chunk_size=2000):
+        for account_id in {tx.origin_account_id, tx.destination_account_id} - {None}:
+            deltas[account_id] += account_delta(tx, account_id)
+
+    checkpoints = {checkpoint.account_id: checkpoint for checkpoint in ArchiveCheckpoint.objects.all()}
+    states = {
+        account.pk: opening_state(account, deltas[account.pk], checkpoints.get(account.pk))
+        for account in LoyaltyAccount.objects.only('id', 'current_balance', 'average_cost')
+    }
+
+    # 2ª passada: saldo corrente em ordem cronológica, gravado em lotes.
+    batch = []
+    for tx in transactions.iterator(chunk_size=2000):
+        batch.append(tx)
+        if len(batch) == 1000:
+            PointsTransaction.objects.bulk_update(derive(batch, states), BALANCE_FIELDS)
+            batch = []
+    if batch:
+        PointsTransaction.objects.bulk_update(derive(batch, states), BALANCE_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_transaction_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loyaltyaccount',
+            name='opening_average_cost',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Custo médio na criação da conta, ponto de partida do saldo corrente das transações', max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='pointstransaction',
+            name='destination_average_cost_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='pointstransaction',
+            name='destination_balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='pointstransaction',
+            name='origin_average_cost_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='pointstransaction',
+            name='origin_balance_after',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True),
+        ),
+        migrations.RunPython(backfill_running_balances, migrations.RunPython.noop),
+    ]
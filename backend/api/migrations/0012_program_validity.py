@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_transaction_running_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loyaltyprogram',
+            name='validity_months',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Validade dos pontos em meses a partir da aquisição; vazio quando não expiram', null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2 on 2026-10-19 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_deletion_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['transaction_date', 'created_at'], name='api_tx_date_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['transaction_type', 'transaction_date'], name='api_tx_type_date_idx'),
+        ),
+    ]
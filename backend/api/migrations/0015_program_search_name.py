@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+def backfill_search_name(apps, schema_editor):
+    from api.models import normalize_search_text
+
+    LoyaltyProgram = apps.get_model('api', 'LoyaltyProgram')
+    programs = list(LoyaltyProgram.objects.only('pk', 'name'))
+    for program in programs:
+        program.search_name = normalize_search_text(program.name)
+    LoyaltyProgram.objects.bulk_update(programs, ['search_name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loyaltyprogram',
+            name='search_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(backfill_search_name, migrations.RunPython.noop),
+    ]
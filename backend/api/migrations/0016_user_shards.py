@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-19 14:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_program_search_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=50)),
+                ('is_moving', models.BooleanField(default=False, help_text='Dados sendo movidos entre shards (requisições recusadas)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='shard', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-19 14:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_user_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceAuditLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account_id', models.BigIntegerField()),
+                ('transaction_id', models.BigIntegerField(blank=True, null=True)),
+                ('operation', models.CharField(help_text='Método que alterou o saldo, ex: apply_transfer', max_length=50)),
+                ('balance_before', models.DecimalField(blank=True, decimal_places=2, help_text='Nulo na criação da conta', max_digits=12, null=True)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('average_cost_before', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('average_cost_after', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('request_id', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Momento da alteração (não da gravação)')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_audit_logs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account_id', 'created_at'], name='api_audit_account_time_idx')],
+            },
+        ),
+    ]
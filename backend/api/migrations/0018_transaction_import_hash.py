@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_balance_audit_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pointstransaction',
+            name='import_hash',
+            field=models.CharField(blank=True, editable=False, help_text='Hash do conteúdo da linha do extrato importado (ver api.importer); nulo fora de importações', max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='pointstransaction',
+            constraint=models.UniqueConstraint(fields=('import_hash', 'transaction_date'), name='api_tx_import_hash_unique'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-19 16:20
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+
+def pin_existing_users(apps, schema_editor):
+    # Usuários anteriores ao sharding têm todos os dados no default; sem o
+    # registro explícito, ligar DB_SHARDS os mandaria para shards vazios.
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        return
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserShard = apps.get_model('api', 'UserShard')
+    user_ids = User.objects.filter(shard__isnull=True).values_list('pk', flat=True)
+    UserShard.objects.bulk_create(
+        (UserShard(user_id=user_id, alias=DEFAULT_DB_ALIAS) for user_id in user_ids.iterator(chunk_size=2000)),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_transaction_import_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(pin_existing_users, migrations.RunPython.noop),
+    ]
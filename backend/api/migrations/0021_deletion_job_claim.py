@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_sync_counter_per_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deletionjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='deletionjob',
+            name='owner',
+            field=models.CharField(blank=True, editable=False, help_text='Execução que reservou o job', max_length=32),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 15:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_deletion_job_claim'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loyaltyaccount',
+            index=models.Index(fields=['wallet', 'change_seq'], name='api_account_wallet_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['origin_account', 'change_seq'], name='api_tx_origin_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['destination_account', 'change_seq'], name='api_tx_dest_seq_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userwallet',
+            index=models.Index(fields=['user', 'change_seq'], name='api_wallet_user_seq_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.contrib.postgres.operations import UnaccentExtension
+from django.db import migrations
+
+# Índices da 0008, na coluna crua.
+RAW_TRIGRAM_INDEXES = [
+    ('api_tx_description_trgm', 'api_pointstransaction', 'description'),
+    ('api_account_name_trgm', 'api_loyaltyaccount', 'name'),
+    ('api_account_number_trgm', 'api_loyaltyaccount', 'account_number'),
+]
+
+
+def create_unaccent_indexes(apps, schema_editor):
+    from api.search import CREATE_UNACCENT_FUNCTION, ensure_search_indexes
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_UNACCENT_FUNCTION)
+    ensure_search_indexes(schema_editor.connection)
+    for index_name, _, _ in RAW_TRIGRAM_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+
+def drop_unaccent_indexes(apps, schema_editor):
+    from api.search import POSTGRES_INDEXES, UNACCENT_FUNCTION
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for index_name, table, column in RAW_TRIGRAM_INDEXES:
+        schema_editor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} USING gin ({column} gin_trgm_ops)")
+    for index_name, _, _ in POSTGRES_INDEXES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    schema_editor.execute(f"DROP FUNCTION IF EXISTS {UNACCENT_FUNCTION}(text)")
+
+
+class Migration(migrations.Migration):
+    """Busca sem acentos no PostgreSQL: índices trigram sobre api_unaccent(coluna)."""
+
+    dependencies = [
+        ('api', '0022_sync_owner_indexes'),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.RunPython(create_unaccent_indexes, drop_unaccent_indexes),
+    ]
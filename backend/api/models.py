@@ -1,5 +1,117 @@
-from django.db import models
+import unicodedata
+
+from django.db import models, router, transaction
+from django.db.models import F
 from django.conf import settings
+from django.utils import timezone
+
+from . import audit
+
+
+def normalize_search_text(value):
+    """Minúsculas e sem acentos: "Smiles Ágil" -> "smiles agil"."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+class SyncCounter(models.Model):
+    """
+    Sequência de alterações por usuário usada pelo sync incremental (/api/sync/).
+    O UPDATE do contador segura o lock da linha do usuário até o commit da
+    transação que o incrementou, então as sequências de um usuário são
+    confirmadas em ordem crescente e o valor lido pelo sync nunca passa de uma
+    alteração ainda pendente. Escritas de usuários diferentes não disputam o
+    mesmo lock.
+
+    A linha sem usuário guarda o antigo contador global: é o piso dos contadores
+    criados depois, para que tokens emitidos antes continuem válidos.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='+'
+    )
+    value = models.BigIntegerField(default=0)
+
+    @staticmethod
+    def _owner_filter(user):
+        # Id do usuário ou queryset de um ``user_id``, resolvido no próprio UPDATE.
+        return {'user_id': user} if isinstance(user, int) else {'user_id__in': user}
+
+    @classmethod
+    def floor(cls, using=None):
+        return cls.objects.using(using).filter(user__isnull=True).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    def next_value(cls, user, using=None):
+        """Incrementa o contador de ``user`` e retorna o novo valor (``None`` se o dono não existe)."""
+        using = using or router.db_for_write(cls)
+        counter = cls.objects.using(using).filter(**cls._owner_filter(user))
+        with transaction.atomic(using=using):
+            if not counter.update(value=F('value') + 1):
+                user_id = user if isinstance(user, int) else user.using(using).first()
+                if user_id is None:
+                    return None
+                cls.objects.using(using).get_or_create(user_id=user_id, defaults={'value': cls.floor(using)})
+                counter.update(value=F('value') + 1)
+            return counter.values_list('value', flat=True).get()
+
+    @classmethod
+    def current_value(cls, user_id, using=None):
+        value = cls.objects.using(using).filter(user_id=user_id).values_list('value', flat=True).first()
+        return value if value is not None else cls.floor(using)
+
+
+class SyncTrackedModel(models.Model):
+    """Carimba ``change_seq`` com o próximo valor do ``SyncCounter`` do dono a cada save()."""
+    change_seq = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def sync_owner(self):
+        """Id do usuário dono, queryset que o resolve no banco ou ``None``."""
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        owner = self.sync_owner()
+        if owner is not None:
+            change_seq = SyncCounter.next_value(owner, using=kwargs.get('using') or self._state.db)
+            if change_seq is not None:
+                self.change_seq = change_seq
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'change_seq'}
+        super().save(*args, **kwargs)
+
+
+class SyncTombstone(models.Model):
+    """Registro de exclusão para que clientes em sync incremental removam o objeto."""
+    MODEL_CHOICES = [
+        ('wallet', 'Carteira'),
+        ('account', 'Conta de Fidelidade'),
+        ('transaction', 'Transação'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='sync_tombstones'
+    )
+    model_name = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='api_tombstone_user_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name} #{self.object_id} removido (seq {self.change_seq})"
+
 
 class LoyaltyProgram(models.Model):
     CURRENCY_TYPE_CHOICES = [
@@ -15,20 +127,34 @@ class LoyaltyProgram(models.Model):
         related_name='loyalty_programs_created'
     )
     name = models.CharField(max_length=100, unique=True)
+    # Nome normalizado para o autocomplete: o índice (varchar_pattern_ops no PostgreSQL)
+    # atende ``LIKE 'prefixo%'`` com uma busca por intervalo.
+    search_name = models.CharField(max_length=100, db_index=True, editable=False, default='')
     currency_type = models.IntegerField(choices=CURRENCY_TYPE_CHOICES)
     custom_rate = models.DecimalField(
         max_digits=10, decimal_places=2, default=0.00,
         help_text="Valor de mercado estimado por 1.000 milhas/pontos"
     ) 
+    validity_months = models.PositiveSmallIntegerField(
+        null=True, blank=True,
+        help_text="Validade dos pontos em meses a partir da aquisição; vazio quando não expiram"
+    )
     is_active = models.BooleanField(default=True)
     is_user_created = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
 
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search_text(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'search_name'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.name
 
-class UserWallet(models.Model):
+class UserWallet(SyncTrackedModel):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -39,12 +165,19 @@ class UserWallet(models.Model):
 
     class Meta:
         unique_together = ('user', 'wallet_name') 
+        indexes = [
+            # Sync incremental: change_seq é por usuário, então o dono vem primeiro.
+            models.Index(fields=['user', 'change_seq'], name='api_wallet_user_seq_idx'),
+        ]
+
+    def sync_owner(self):
+        return self.user_id
 
     def __str__(self):
         return f'{self.wallet_name} ({self.user.username})'
 
 
-class LoyaltyAccount(models.Model):
+class LoyaltyAccount(SyncTrackedModel):
     wallet = models.ForeignKey(
         UserWallet,
         on_delete=models.CASCADE,
@@ -62,6 +195,10 @@ class LoyaltyAccount(models.Model):
         max_digits=12, decimal_places=2, null=True, blank=True,
         help_text="Custo médio por milheiro"
     )
+    opening_average_cost = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True,
+        help_text="Custo médio na criação da conta, ponto de partida do saldo corrente das transações"
+    )
     
     last_updated = models.DateTimeField(
         help_text="Data da última atualização de saldo/informações desta conta no programa de fidelidade"
@@ -69,14 +206,43 @@ class LoyaltyAccount(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._audit_state = audit.balance_state(instance)
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._audit_state = audit.balance_state(self)
+
+    def sync_owner(self):
+        if LoyaltyAccount.wallet.is_cached(self):
+            return self.wallet.user_id
+        return UserWallet.objects.filter(pk=self.wallet_id).values_list('user_id', flat=True)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.opening_average_cost is None:
+            self.opening_average_cost = self.average_cost
+        adding = self._state.adding
+        before = getattr(self, '_audit_state', None)
+        super().save(*args, **kwargs)
+        after = audit.balance_state(self)
+        if after != before:
+            audit.record(self, before, after, adding=adding)
+        self._audit_state = after
+
     class Meta:
         unique_together = ('wallet', 'program', 'name')
+        indexes = [
+            models.Index(fields=['wallet', 'change_seq'], name='api_account_wallet_seq_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.program.name}) - Saldo: {self.current_balance}"
 
 
-class PointsTransaction(models.Model):
+class PointsTransaction(SyncTrackedModel):
     TRANSACTION_TYPE_CHOICES = [
         (1, 'Inclusão Manual'),      # Ex: Adicionar pontos de uma compra não rastreada. Afeta destination_account.
         (2, 'Transferência'),        # Transferência entre duas LoyaltyAccount. Afeta origin_account e destination_account.
@@ -125,6 +291,26 @@ class PointsTransaction(models.Model):
         help_text="Data e hora em que a transação efetivamente ocorreu no programa de fidelidade"
     ) 
     created_at = models.DateTimeField(auto_now_add=True, help_text="Data de registro da transação") 
+    import_hash = models.CharField(
+        max_length=64, null=True, blank=True, editable=False,
+        help_text="Hash do conteúdo da linha do extrato importado (ver api.importer); nulo fora de importações"
+    )
+
+    # Saldo corrente de cada conta logo após a transação, em ordem cronológica (mantido por api.ledger).
+    origin_balance_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    origin_average_cost_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    destination_balance_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    destination_average_cost_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+
+    def sync_owner(self):
+        for field in (PointsTransaction.origin_account, PointsTransaction.destination_account):
+            account = field.field.get_cached_value(self, None)
+            if account is not None and LoyaltyAccount.wallet.is_cached(account):
+                return account.wallet.user_id
+        account_ids = [pk for pk in (self.origin_account_id, self.destination_account_id) if pk is not None]
+        if not account_ids:
+            return None  # transação órfã: não aparece no sync de ninguém
+        return LoyaltyAccount.objects.filter(pk__in=account_ids).order_by('pk').values_list('wallet__user_id', flat=True)[:1]
 
     def __str__(self):
         origin_name = self.origin_account.name if self.origin_account else 'N/A'
@@ -161,4 +347,180 @@ class PointsTransaction(models.Model):
         return f"{self.get_transaction_type_display()} [{action} {target_name}]: {self.amount} em {date_str}"
 
     class Meta:
-        ordering = ['-transaction_date', '-created_at']
\ No newline at end of file
+        ordering = ['-transaction_date', '-created_at']
+        indexes = [
+            # Extrato por conta (ordenado por data) e filtros por tipo + período.
+            models.Index(fields=['origin_account', 'transaction_date'], name='api_tx_origin_date_idx'),
+            models.Index(fields=['destination_account', 'transaction_date'], name='api_tx_dest_date_idx'),
+            models.Index(fields=['origin_account', 'transaction_type', 'transaction_date'], name='api_tx_origin_type_date_idx'),
+            models.Index(fields=['destination_account', 'transaction_type', 'transaction_date'], name='api_tx_dest_type_date_idx'),
+            # Sync incremental por conta do usuário (um ramo por lado).
+            models.Index(fields=['origin_account', 'change_seq'], name='api_tx_origin_seq_idx'),
+            models.Index(fields=['destination_account', 'change_seq'], name='api_tx_dest_seq_idx'),
+            # Listagens sem filtro de conta (admin): ordenação por data e filtro por tipo.
+            models.Index(fields=['transaction_date', 'created_at'], name='api_tx_date_created_idx'),
+            models.Index(fields=['transaction_type', 'transaction_date'], name='api_tx_type_date_idx'),
+        ]
+        constraints = [
+            # Inclui a data porque o PostgreSQL exige a chave de partição em índices únicos.
+            models.UniqueConstraint(fields=['import_hash', 'transaction_date'], name='api_tx_import_hash_unique'),
+        ]
+
+class ArchivedMonth(models.Model):
+    """Manifesto do arquivo frio: um arquivo Arrow por usuário e mês (ver ``api.archive``)."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_months'
+    )
+    month = models.DateField(help_text="Primeiro dia do mês arquivado")
+    path = models.CharField(max_length=500, help_text="Caminho relativo a ARCHIVE_ROOT")
+    row_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['user', 'month']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='api_archived_month_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.month:%Y-%m} ({self.row_count} transações)"
+
+
+class ArchiveCheckpoint(models.Model):
+    """
+    Saldo de abertura da conta no corte do arquivo (tudo antes de ``cutoff``
+    está no arquivo frio) e os totais arquivados usados pelo resumo.
+    """
+    account = models.OneToOneField(
+        LoyaltyAccount,
+        on_delete=models.CASCADE,
+        related_name='archive_checkpoint'
+    )
+    cutoff = models.DateTimeField()
+    opening_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    opening_average_cost = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True,
+        help_text="Custo médio no corte; nulo quando não pôde ser determinado com exatidão"
+    )
+    archived_count = models.PositiveIntegerField(default=0)
+    acquisition_cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    points_sold = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    sales_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.account.name} @ {self.cutoff:%Y-%m-%d}: {self.opening_balance}"
+
+
+class DeletionJob(models.Model):
+    """Exclusão em lotes de uma carteira ou conta, executada em segundo plano (ver ``api.deletion``)."""
+    TARGET_WALLET = 'wallet'
+    TARGET_ACCOUNT = 'account'
+    TARGET_CHOICES = [
+        (TARGET_WALLET, 'Carteira'),
+        (TARGET_ACCOUNT, 'Conta de Fidelidade'),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_RUNNING, 'Em execução'),
+        (STATUS_DONE, 'Concluído'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+    # Um job que falhou já desligou parte do histórico: o alvo segue escondido até a nova tentativa.
+    HIDDEN_STATUSES = (STATUS_PENDING, STATUS_RUNNING, STATUS_FAILED)
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='deletion_jobs'
+    )
+    target_type = models.CharField(max_length=10, choices=TARGET_CHOICES)
+    target_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    total = models.PositiveIntegerField(default=0, help_text="Transações ligadas ao alvo no início da execução")
+    processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    owner = models.CharField(max_length=32, blank=True, editable=False, help_text="Execução que reservou o job")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['target_type', 'target_id', 'status'], name='api_deletion_target_idx'),
+        ]
+
+    @classmethod
+    def hidden_targets(cls, target_type):
+        """Ids (subquery) dos alvos com exclusão não concluída, que não aparecem mais na API."""
+        return cls.objects.filter(target_type=target_type, status__in=cls.HIDDEN_STATUSES).values('target_id')
+
+    @property
+    def progress(self):
+        if self.status == self.STATUS_DONE:
+            return 1.0
+        return round(self.processed / self.total, 4) if self.total else 0.0
+
+    def __str__(self):
+        return f"Exclusão de {self.get_target_type_display()} #{self.target_id} ({self.get_status_display()})"
+
+
+class BalanceAuditLog(models.Model):
+    """
+    Trilha de auditoria (só inserção) das mudanças de saldo e custo médio das
+    contas, gravada em lotes após o commit (ver ``api.audit``). Conta e
+    transação são guardadas por id, sem chave estrangeira: o registro
+    sobrevive à exclusão delas.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='balance_audit_logs'
+    )
+    account_id = models.BigIntegerField()
+    transaction_id = models.BigIntegerField(null=True, blank=True)
+    operation = models.CharField(max_length=50, help_text="Método que alterou o saldo, ex: apply_transfer")
+    balance_before = models.DecimalField(
+        max_digits=12, decimal_places=2, null=True, blank=True,
+        help_text="Nulo na criação da conta"
+    )
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2)
+    average_cost_before = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    average_cost_after = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    request_id = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, help_text="Momento da alteração (não da gravação)")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account_id', 'created_at'], name='api_audit_account_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conta #{self.account_id} {self.operation}: {self.balance_before} -> {self.balance_after}"
+
+
+class UserShard(models.Model):
+    """
+    Banco (alias em ``SHARD_ALIASES``) onde ficam carteiras, contas e transações
+    do usuário. Só é consultado no banco ``default``; ver ``api.sharding``.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='shard'
+    )
+    alias = models.CharField(max_length=50)
+    is_moving = models.BooleanField(default=False, help_text="Dados sendo movidos entre shards (requisições recusadas)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.alias}"
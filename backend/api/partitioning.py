@@ -0,0 +1,209 @@
+"""
+Particionamento por intervalo (``PARTITION BY RANGE (transaction_date)``) da
+tabela ``api_pointstransaction`` no PostgreSQL, com uma partição por mês (UTC)
+e uma partição ``default`` para datas fora das partições criadas.
+
+A chave primária da tabela particionada passa a ser ``(id, transaction_date)``
+— o PostgreSQL exige a chave de partição em índices únicos —, mas o ``id``
+continua vindo de uma única sequência, então o ORM segue tratando ``id`` como
+PK. Consultas com limites constantes em ``transaction_date`` (filtros
+``date_after``/``date_before``, extratos mensais) leem só as partições do
+período.
+
+Em outros bancos (SQLite nos testes e no desenvolvimento) tudo aqui é no-op e
+a tabela continua comum.
+"""
+import re
+from datetime import datetime, timezone
+
+TABLE = 'api_pointstransaction'
+LEGACY_TABLE = 'api_pointstransaction_unpartitioned'
+DEFAULT_PARTITION = f'{TABLE}_default'
+SEQUENCE = f'{TABLE}_id_seq'
+
+_partition_name_re = re.compile(rf'{TABLE}_y(?P<year>\d{{4}})m(?P<month>\d{{2}})')
+
+
+def supports_partitioning(conn):
+    return conn.vendor == 'postgresql'
+
+
+def is_partitioned(conn):
+    if not supports_partitioning(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)", [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def month_start(value):
+    value = value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=month_index // 12, month=month_index % 12 + 1)
+
+
+def partition_name(start):
+    return f'{TABLE}_y{start.year:04d}m{start.month:02d}'
+
+
+def month_range(start, end):
+    """Inícios de mês de ``start`` até ``end`` (inclusive)."""
+    current, last = month_start(start), month_start(end)
+    while current <= last:
+        yield current
+        current = add_months(current, 1)
+
+
+def list_partitions(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s ORDER BY c.relname", [TABLE]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def create_partitions(conn, months_ahead=3, now=None):
+    """
+    Cria (de forma idempotente) as partições mensais do mês atual até
+    ``months_ahead`` meses à frente. Linhas do período que já caíram na
+    partição ``default`` são movidas para a nova partição. Retorna os nomes
+    das partições criadas.
+    """
+    if not is_partitioned(conn):
+        return []
+    now = now or datetime.now(timezone.utc)
+    existing = set(list_partitions(conn))
+    created = []
+    with conn.cursor() as cursor:
+        for start in month_range(now, add_months(month_start(now), months_ahead)):
+            name = partition_name(start)
+            if name in existing:
+                continue
+            _create_month_partition(cursor, start)
+            created.append(name)
+    return created
+
+
+def drop_empty_partitions(conn, before):
+    """
+    Remove as partições mensais vazias que terminam até ``before`` (ex: após o
+    arquivamento), devolvendo o espaço de dados e índices imediatamente.
+    """
+    if not is_partitioned(conn):
+        return []
+    dropped = []
+    with conn.cursor() as cursor:
+        for name in list_partitions(conn):
+            match = _partition_name_re.fullmatch(name)
+            if not match:
+                continue
+            start = datetime(int(match['year']), int(match['month']), 1, tzinfo=timezone.utc)
+            if add_months(start, 1) > before:
+                continue
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {name})")
+            if not cursor.fetchone()[0]:
+                cursor.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+    return dropped
+
+
+def _bounds_clause(start):
+    return f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+
+
+def _create_month_partition(cursor, start):
+    """Deve rodar dentro de uma transação (a default fica bloqueada até o commit)."""
+    # O PostgreSQL recusa criar a partição se a default tiver linhas do período: move-as antes.
+    cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(f"CREATE TEMPORARY TABLE _moved_transactions (LIKE {TABLE})")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE transaction_date >= %s AND transaction_date < %s RETURNING *) "
+        f"INSERT INTO _moved_transactions SELECT * FROM moved",
+        [start, add_months(start, 1)],
+    )
+    cursor.execute(f"CREATE TABLE {partition_name(start)} PARTITION OF {TABLE} {_bounds_clause(start)}")
+    cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM _moved_transactions")
+    cursor.execute("DROP TABLE _moved_transactions")
+
+
+def partition_table(conn, months_ahead=3):
+    """Converte a tabela comum em particionada, copiando os dados (usado pela migration)."""
+    if not supports_partitioning(conn) or is_partitioned(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT min(transaction_date) FROM {TABLE}")
+        oldest = cursor.fetchone()[0]
+        _rebuild(cursor, partitioned=True)
+
+        now = datetime.now(timezone.utc)
+        cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+        for start in month_range(min(oldest or now, now), add_months(month_start(now), months_ahead)):
+            cursor.execute(f"CREATE TABLE {partition_name(start)} PARTITION OF {TABLE} {_bounds_clause(start)}")
+        _copy_and_drop_legacy(cursor)
+
+
+def unpartition_table(conn):
+    """Operação inversa de ``partition_table``."""
+    if not is_partitioned(conn):
+        return
+    with conn.cursor() as cursor:
+        _rebuild(cursor, partitioned=False)
+        _copy_and_drop_legacy(cursor)
+
+
+def _rebuild(cursor, partitioned):
+    """
+    Renomeia a tabela atual para ``LEGACY_TABLE`` e cria a nova estrutura com
+    as mesmas colunas, índices, FKs e checks (os nomes são preservados).
+    """
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}")
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+        [LEGACY_TABLE, f'{TABLE}_pkey'],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('f', 'c')", [LEGACY_TABLE]
+    )
+    constraints = cursor.fetchall()
+
+    for index_name, _ in indexes:
+        cursor.execute(f'DROP INDEX "{index_name}"')
+    for constraint_name, _ in constraints:
+        cursor.execute(f'ALTER TABLE {LEGACY_TABLE} DROP CONSTRAINT "{constraint_name}"')
+    cursor.execute(f"ALTER TABLE {LEGACY_TABLE} DROP CONSTRAINT {TABLE}_pkey")
+
+    # Sem INCLUDING IDENTITY: a sequência própria (OWNED BY) sobrevive à troca de tabelas em qualquer versão.
+    cursor.execute(f"ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+    cursor.execute(f"ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP DEFAULT")
+    cursor.execute(f"ALTER SEQUENCE IF EXISTS {SEQUENCE} OWNED BY NONE")
+    partition_clause = "PARTITION BY RANGE (transaction_date)" if partitioned else ""
+    cursor.execute(f"CREATE TABLE {TABLE} (LIKE {LEGACY_TABLE} INCLUDING DEFAULTS) {partition_clause}")
+    cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SEQUENCE} AS bigint")
+    cursor.execute(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id")
+    cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+
+    primary_key = "(id, transaction_date)" if partitioned else "(id)"
+    cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY {primary_key}")
+    legacy_target = re.compile(rf" ON (?:ONLY )?(?:\w+\.)?{LEGACY_TABLE} ")
+    for _, index_def in indexes:
+        cursor.execute(legacy_target.sub(f" ON {TABLE} ", index_def, count=1))
+    for constraint_name, constraint_def in constraints:
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT "{constraint_name}" {constraint_def}')
+
+
+def _copy_and_drop_legacy(cursor):
+    cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {LEGACY_TABLE}")
+    cursor.execute(f"DROP TABLE {LEGACY_TABLE}")
+    cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
@@ -0,0 +1,49 @@
+"""
+Renderer e parser JSON baseados em orjson.
+
+A saída é idêntica à do ``JSONRenderer`` do DRF: ``DecimalField`` já chega
+como string vinda dos serializers, e os tipos que o orjson não serializa
+nativamente (``Decimal`` cru, datetimes, lazy strings) passam pelo mesmo
+encoder do DRF. Ative com ``API_FAST_JSON=True``.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+
+def _require_orjson():
+    if orjson is None:
+        raise ImproperlyConfigured("API_FAST_JSON requer o pacote 'orjson' instalado.")
+
+
+class ORJSONRenderer(JSONRenderer):
+    encoder_class = JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        _require_orjson()
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.get_indent(accepted_media_type, renderer_context):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=self.encoder_class().default, option=options)
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        _require_orjson()
+        try:
+            return orjson.loads(stream.read())
+        except (orjson.JSONDecodeError, UnicodeDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
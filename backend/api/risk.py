@@ -0,0 +1,128 @@
+"""
+Simulação de Monte Carlo do risco de manter pontos/milhas.
+
+Para cada programa, o valor do milheiro (``custom_rate``) no horizonte segue
+um movimento browniano geométrico (volatilidade e tendência anuais) e sofre
+desvalorizações discretas: o número de desvalorizações é Poisson, cada uma
+cortando ``devaluation_size`` do valor. Cada conta pode ainda perder o saldo
+inteiro por expiração, com probabilidade derivada de ``expiration_rate``
+(fração anual). O preço é único por programa em cada caminho, então contas do
+mesmo programa se movem juntas.
+
+Como só o valor no horizonte importa, cada caminho é amostrado num passo só
+(exato para o movimento browniano), em lotes de ``RISK_SIMULATION_CHUNK_SIZE``
+caminhos para limitar a memória. Com a mesma ``seed`` e os mesmos parâmetros o
+resultado é idêntico.
+
+Requer ``numpy`` (dependência opcional).
+"""
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependência opcional
+    np = None
+
+PERCENTILES = (5, 25, 50, 75, 95)
+RISK_PARAMETERS = ('volatility', 'drift', 'devaluation_probability', 'devaluation_size', 'expiration_rate')
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured("A simulação de risco requer o pacote 'numpy'.")
+
+
+def _money(value):
+    return Decimal(str(round(float(value), 2))).quantize(Decimal('0.01'))
+
+
+def _risk_metrics(values, current_value, cost_basis, confidence):
+    """Valor esperado, VaR/CVaR (perda em relação ao valor atual) e faixas de percentil."""
+    tail = np.quantile(values, 1 - confidence)
+    worst = values[values <= tail]
+    return {
+        "current_value": _money(current_value),
+        "cost_basis": _money(cost_basis),
+        "expected_value": _money(values.mean()),
+        "value_at_risk": _money(max(current_value - tail, 0.0)),
+        "expected_shortfall": _money(max(current_value - worst.mean(), 0.0)) if worst.size else _money(0),
+        "probability_below_cost": round(float((values < cost_basis).mean()), 4) if cost_basis > 0 else None,
+        "percentiles": {
+            f"p{p}": _money(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+        },
+    }
+
+
+def simulate_risk(accounts, paths, horizon_months, confidence, params, overrides=None, seed=None):
+    """
+    ``accounts`` são as contas ativas do usuário com ``program`` carregado;
+    ``params`` tem os valores de ``RISK_PARAMETERS`` e ``overrides`` os
+    substitui por programa (``{program_id: {...}}``).
+    """
+    require_numpy()
+    overrides = overrides or {}
+    seed = secrets.randbits(63) if seed is None else seed
+    rng = np.random.default_rng(seed)
+    years = horizon_months / 12
+
+    programs = {}
+    for account in accounts:
+        program = programs.setdefault(account.program_id, {
+            "program": account.program, "balances": [], "costs": [], "accounts": 0,
+        })
+        program["balances"].append(float(account.current_balance))
+        program["costs"].append(float(account.average_cost or 0))
+        program["accounts"] += 1
+
+    order = sorted(programs)
+    rates = np.array([float(programs[pk]["program"].custom_rate or 0) for pk in order])
+    balances = [np.array(programs[pk]["balances"]) for pk in order]
+    program_params = [{**params, **overrides.get(pk, {})} for pk in order]
+    # Parâmetros por programa em vetores, para amostrar todos os programas de uma vez.
+    sigma = np.array([p['volatility'] for p in program_params])
+    mu = np.array([p['drift'] for p in program_params])
+    devaluation_rate = -np.log1p(-np.array([min(p['devaluation_probability'], 0.999999) for p in program_params]))
+    survival = np.log1p(-np.array([p['devaluation_size'] for p in program_params]))
+    lapse = 1 - (1 - np.array([p['expiration_rate'] for p in program_params])) ** years
+
+    values = np.empty((paths, len(order)))
+    chunk_size = settings.RISK_SIMULATION_CHUNK_SIZE
+    for start in range(0, paths, chunk_size):
+        n = min(chunk_size, paths - start)
+        shocks = rng.standard_normal((n, len(order)))
+        devaluations = rng.poisson(devaluation_rate * years, (n, len(order)))
+        log_price = (mu - sigma ** 2 / 2) * years + sigma * np.sqrt(years) * shocks + devaluations * survival
+        price = rates * np.exp(log_price)
+        for column, program_balances in enumerate(balances):
+            kept = rng.random((n, program_balances.size)) >= lapse[column]
+            values[start:start + n, column] = (kept @ program_balances) / 1000 * price[:, column]
+
+    current = [balances[i].sum() / 1000 * rates[i] for i in range(len(order))]
+    cost = [
+        sum(b * c for b, c in zip(programs[pk]["balances"], programs[pk]["costs"])) / 1000
+        for pk in order
+    ]
+    results = []
+    for column, pk in enumerate(order):
+        program = programs[pk]["program"]
+        results.append({
+            "program_id": pk,
+            "program_name": program.name,
+            "accounts": programs[pk]["accounts"],
+            "balance": _money(balances[column].sum()),
+            **_risk_metrics(values[:, column], current[column], cost[column], confidence),
+        })
+    results.sort(key=lambda item: item["current_value"], reverse=True)
+
+    return {
+        "seed": seed,
+        "paths": paths,
+        "horizon_months": horizon_months,
+        "confidence": confidence,
+        "portfolio": _risk_metrics(values.sum(axis=1), sum(current), sum(cost), confidence),
+        "programs": results,
+    }
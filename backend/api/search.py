@@ -0,0 +1,222 @@
+"""
+Busca textual em ``PointsTransaction.description`` e em
+``LoyaltyAccount.name``/``account_number``.
+
+- PostgreSQL: índices GIN ``pg_trgm`` sobre ``api_unaccent(coluna)``
+  (ILIKE '%termo%' indexado e sem acentos, ver ``UnaccentILikeContains``),
+  ranqueado por ``word_similarity``. As extensões ``pg_trgm`` e ``unaccent``
+  são criadas pelas migrations 0008 e 0023; se o usuário da aplicação não
+  tiver permissão, um superusuário deve rodar ``CREATE EXTENSION`` antes.
+- SQLite: tabelas FTS5 "sombra" (external content) mantidas por triggers,
+  com remoção de acentos ("cartao" encontra "cartão") e ranking bm25.
+"""
+from django.db import connection, connections, router
+from django.db.models import CharField, Func, Lookup, Q, Value
+
+from .models import LoyaltyAccount, PointsTransaction
+
+TRANSACTION_FTS = 'api_transaction_fts'
+ACCOUNT_FTS = 'api_account_fts'
+
+# ``unaccent()`` é STABLE (depende do dicionário): índices exigem um wrapper IMMUTABLE
+# com o dicionário fixo.
+UNACCENT_FUNCTION = 'api_unaccent'
+CREATE_UNACCENT_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION {UNACCENT_FUNCTION}(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+"""
+
+POSTGRES_INDEXES = [
+    ('api_tx_description_unaccent_trgm', 'api_pointstransaction', 'description'),
+    ('api_account_name_unaccent_trgm', 'api_loyaltyaccount', 'name'),
+    ('api_account_number_unaccent_trgm', 'api_loyaltyaccount', 'account_number'),
+]
+
+SQLITE_FTS_TABLES = [
+    # (tabela fts, tabela de conteúdo, colunas indexadas)
+    (TRANSACTION_FTS, 'api_pointstransaction', ['description']),
+    (ACCOUNT_FTS, 'api_loyaltyaccount', ['name', 'account_number']),
+]
+
+
+class SearchUnaccent(Func):
+    function = UNACCENT_FUNCTION
+    output_field = CharField()
+
+
+@CharField.register_lookup
+class UnaccentILikeContains(Lookup):
+    """
+    ``api_unaccent(col) ILIKE api_unaccent('%termo%')``: a mesma expressão dos
+    índices trigram. O ``icontains`` do Django compila para
+    ``UPPER(col::text) LIKE UPPER(...)``, que esses índices não atendem.
+    """
+    lookup_name = 'unaccent_ilike_contains'
+
+    def process_rhs(self, compiler, connection):
+        rhs, params = super().process_rhs(compiler, connection)
+        return rhs, [f'%{connection.ops.prep_for_like_query(param)}%' for param in params]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return (
+            f'{UNACCENT_FUNCTION}({lhs}) ILIKE {UNACCENT_FUNCTION}({rhs})',
+            (*lhs_params, *rhs_params),
+        )
+
+
+def _contains(connection, field):
+    lookup = 'unaccent_ilike_contains' if connection.vendor == 'postgresql' else 'icontains'
+    return f'{field}__{lookup}'
+
+
+def _similarity(term, field):
+    from django.contrib.postgres.search import TrigramWordSimilarity
+    return TrigramWordSimilarity(SearchUnaccent(Value(term)), SearchUnaccent(field))
+
+
+def ensure_search_indexes(conn=None):
+    """
+    Cria (de forma idempotente) os índices de busca do banco atual. No
+    PostgreSQL requer as extensões e a função ``api_unaccent`` (migration
+    0023). No SQLite, recria triggers que se perdem quando uma migration
+    reconstrói a tabela.
+    """
+    conn = conn or connection
+    if conn.vendor == 'postgresql':
+        with conn.cursor() as cursor:
+            for index_name, table, column in POSTGRES_INDEXES:
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} "
+                    f"USING gin ({UNACCENT_FUNCTION}({column}) gin_trgm_ops)"
+                )
+    elif conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            for fts_table, content_table, columns in SQLITE_FTS_TABLES:
+                _ensure_sqlite_fts(cursor, fts_table, content_table, columns)
+
+
+def drop_search_indexes(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'postgresql':
+            for index_name, _, _ in POSTGRES_INDEXES:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        elif conn.vendor == 'sqlite':
+            for fts_table, _, _ in SQLITE_FTS_TABLES:
+                for suffix in ('ai', 'ad', 'au'):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table}_{suffix}")
+                cursor.execute(f"DROP TABLE IF EXISTS {fts_table}")
+
+
+def _ensure_sqlite_fts(cursor, fts_table, content_table, columns):
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{c}' for c in columns)
+    old_cols = ', '.join(f'old.{c}' for c in columns)
+
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", [f'{fts_table}_%']
+    )
+    has_triggers = len(cursor.fetchall()) == 3
+
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5("
+        f"{cols}, content='{content_table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')"
+    )
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {content_table} BEGIN
+            INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {content_table} BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {cols} ON {content_table} BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+            INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new_cols});
+        END
+    """)
+    if not has_triggers:
+        # Tabela nova ou triggers perdidos: reconstrói o índice a partir do conteúdo atual.
+        cursor.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')")
+
+
+def _fts_query(term):
+    """Cada palavra vira um prefixo entre aspas (AND implícito), sem expor a sintaxe do FTS5."""
+    words = [word.replace('"', '""') for word in term.split()]
+    return ' '.join(f'"{word}"*' for word in words if word)
+
+
+def _user_account_ids(user):
+    return list(LoyaltyAccount.objects.filter(wallet__user=user).values_list('pk', flat=True))
+
+
+def _ordered_by_ids(queryset, ids):
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def search_transactions(user, term, offset, limit):
+    """Retorna até ``limit`` transações do usuário, da mais relevante para a menos relevante."""
+    account_ids = _user_account_ids(user)
+    if not account_ids:
+        return []
+    queryset = PointsTransaction.objects.select_related('origin_account', 'destination_account')
+    connection = connections[router.db_for_read(PointsTransaction)]  # shard do usuário
+
+    if connection.vendor == 'sqlite':
+        placeholders = ', '.join(['%s'] * len(account_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT t.id FROM {TRANSACTION_FTS} f
+                JOIN api_pointstransaction t ON t.id = f.rowid
+                WHERE {TRANSACTION_FTS} MATCH %s
+                  AND (t.origin_account_id IN ({placeholders}) OR t.destination_account_id IN ({placeholders}))
+                ORDER BY bm25({TRANSACTION_FTS}), t.transaction_date DESC
+                LIMIT %s OFFSET %s
+            """, [_fts_query(term), *account_ids, *account_ids, limit, offset])
+            ids = [row[0] for row in cursor.fetchall()]
+        return _ordered_by_ids(queryset, ids)
+
+    queryset = queryset.filter(
+        Q(origin_account_id__in=account_ids) | Q(destination_account_id__in=account_ids),
+        **{_contains(connection, 'description'): term},
+    )
+    if connection.vendor == 'postgresql':
+        queryset = queryset.annotate(rank=_similarity(term, 'description')).order_by('-rank', '-transaction_date')
+    return list(queryset[offset:offset + limit])
+
+
+def search_accounts(user, term, offset, limit):
+    """Busca contas do usuário por nome ou número da conta."""
+    queryset = LoyaltyAccount.objects.filter(wallet__user=user).select_related('program', 'wallet')
+    connection = connections[router.db_for_read(LoyaltyAccount)]  # shard do usuário
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT a.id FROM {ACCOUNT_FTS} f
+                JOIN api_loyaltyaccount a ON a.id = f.rowid
+                JOIN api_userwallet w ON w.id = a.wallet_id
+                WHERE {ACCOUNT_FTS} MATCH %s AND w.user_id = %s
+                ORDER BY bm25({ACCOUNT_FTS}), a.name
+                LIMIT %s OFFSET %s
+            """, [_fts_query(term), user.pk, limit, offset])
+            ids = [row[0] for row in cursor.fetchall()]
+        return _ordered_by_ids(queryset, ids)
+
+    queryset = queryset.filter(Q(**{_contains(connection, 'name'): term}) | Q(**{_contains(connection, 'account_number'): term}))
+    if connection.vendor == 'postgresql':
+        from django.db.models.functions import Greatest
+        queryset = queryset.annotate(
+            rank=Greatest(_similarity(term, 'name'), _similarity(term, 'account_number'))
+        ).order_by('-rank', 'name')
+    else:
+        queryset = queryset.order_by('name')
+    return list(queryset[offset:offset + limit])
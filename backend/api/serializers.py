@@ -1,6 +1,10 @@
+from decimal import Decimal
+
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import LoyaltyProgram, UserWallet, LoyaltyAccount, PointsTransaction
+from .models import LoyaltyProgram, UserWallet, LoyaltyAccount, PointsTransaction, DeletionJob, BalanceAuditLog
+from .fieldsets import SparseFieldsetSerializerMixin
 
 User = get_user_model()
 
@@ -34,12 +38,12 @@ class CurrentUserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'cpf']
 
-class LoyaltyProgramSerializer(serializers.ModelSerializer):
+class LoyaltyProgramSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     created_by_username = serializers.ReadOnlyField(source='created_by.username', allow_null=True)
     get_currency_type_display = serializers.CharField(read_only=True)
     class Meta:
         model = LoyaltyProgram
-        fields = ['id', 'name', 'currency_type', 'get_currency_type_display','is_active', 'is_user_created', 'created_by', 'created_by_username', 'created_at','custom_rate']
+        fields = ['id', 'name', 'currency_type', 'get_currency_type_display','is_active', 'is_user_created', 'created_by', 'created_by_username', 'created_at','custom_rate', 'validity_months']
         read_only_fields = ['created_by', 'created_at'] 
 
     def create(self, validated_data):
@@ -52,7 +56,7 @@ class LoyaltyProgramSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class UserWalletSerializer(serializers.ModelSerializer):
+class UserWalletSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     user_username = serializers.ReadOnlyField(source='user.username')
 
     class Meta:
@@ -61,7 +65,25 @@ class UserWalletSerializer(serializers.ModelSerializer):
         read_only_fields = ['user', 'created_at']
 
 
-class LoyaltyAccountSerializer(serializers.ModelSerializer):
+class DeletionJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = DeletionJob
+        fields = ['id', 'target_type', 'target_id', 'status', 'total', 'processed', 'progress', 'error',
+                  'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class BalanceAuditLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BalanceAuditLog
+        fields = ['id', 'account_id', 'transaction_id', 'operation', 'balance_before', 'balance_after',
+                  'average_cost_before', 'average_cost_after', 'request_id', 'created_at']
+        read_only_fields = fields
+
+
+class LoyaltyAccountSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     program_name = serializers.ReadOnlyField(source='program.name')
     wallet_name = serializers.ReadOnlyField(source='wallet.wallet_name')
     program_currency_type = serializers.ReadOnlyField(source='program.get_currency_type_display')
@@ -89,7 +111,7 @@ class LoyaltyAccountSerializer(serializers.ModelSerializer):
         return value
 
 
-class PointsTransactionSerializer(serializers.ModelSerializer):
+class PointsTransactionSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     transaction_type_display = serializers.ReadOnlyField(source='get_transaction_type_display')
     origin_account_name = serializers.CharField(source='origin_account.name', read_only=True, allow_null=True)
     destination_account_name = serializers.CharField(source='destination_account.name', read_only=True, allow_null=True)
@@ -107,9 +129,14 @@ class PointsTransactionSerializer(serializers.ModelSerializer):
             'id', 'transaction_type', 'transaction_type_display', 'amount', 'cost',
             'origin_account', 'origin_account_name',
             'destination_account', 'destination_account_name',
-            'bonus_percentage', 'description', 'transaction_date', 'created_at'
+            'bonus_percentage', 'description', 'transaction_date', 'created_at',
+            'origin_balance_after', 'origin_average_cost_after',
+            'destination_balance_after', 'destination_average_cost_after',
+        ]
+        read_only_fields = [
+            'created_at', 'origin_balance_after', 'origin_average_cost_after',
+            'destination_balance_after', 'destination_average_cost_after',
         ]
-        read_only_fields = ['created_at']
 
     def validate(self, data):
         ttype = data.get('transaction_type')
@@ -187,4 +214,78 @@ class SimulateTransferSerializer(serializers.Serializer):
 class SimulateSaleSerializer(serializers.Serializer):
     loyalty_account_id = serializers.IntegerField(required=True)
     amount_to_sell = serializers.DecimalField(max_digits=12, decimal_places=2)
-    sale_price_per_1000_miles = serializers.DecimalField(max_digits=10, decimal_places=2)
\ No newline at end of file
+    sale_price_per_1000_miles = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+class PriceTierSerializer(serializers.Serializer):
+    sale_price_per_1000_miles = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.00'))
+    max_amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'), required=False)
+
+class ProgramLimitSerializer(serializers.Serializer):
+    program_id = serializers.IntegerField()
+    max_amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.00'))
+
+class SimulateAllocationSerializer(serializers.Serializer):
+    target_amount = serializers.DecimalField(max_digits=12, decimal_places=2, min_value=Decimal('0.01'))
+    price_tiers = PriceTierSerializer(many=True, allow_empty=False)
+    program_limits = ProgramLimitSerializer(many=True, required=False)
+    program_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    allow_loss = serializers.BooleanField(default=False)
+
+class RiskParametersSerializer(serializers.Serializer):
+    volatility = serializers.FloatField(min_value=0, max_value=5, default=0.25)
+    drift = serializers.FloatField(min_value=-1, max_value=1, default=0.0)
+    devaluation_probability = serializers.FloatField(min_value=0, max_value=1, default=0.10)
+    devaluation_size = serializers.FloatField(min_value=0, max_value=0.99, default=0.20)
+    expiration_rate = serializers.FloatField(min_value=0, max_value=1, default=0.0)
+
+class RiskOverrideSerializer(serializers.Serializer):
+    """Parâmetros de um programa específico; os omitidos seguem os gerais."""
+    program_id = serializers.IntegerField()
+    volatility = serializers.FloatField(min_value=0, max_value=5, required=False)
+    drift = serializers.FloatField(min_value=-1, max_value=1, required=False)
+    devaluation_probability = serializers.FloatField(min_value=0, max_value=1, required=False)
+    devaluation_size = serializers.FloatField(min_value=0, max_value=0.99, required=False)
+    expiration_rate = serializers.FloatField(min_value=0, max_value=1, required=False)
+
+class SimulateRiskSerializer(RiskParametersSerializer):
+    paths = serializers.IntegerField(min_value=100, default=100_000)
+    horizon_months = serializers.IntegerField(min_value=1, max_value=120, default=12)
+    confidence = serializers.FloatField(min_value=0.5, max_value=0.999, default=0.95)
+    seed = serializers.IntegerField(min_value=0, max_value=2 ** 63 - 1, required=False)
+    overrides = RiskOverrideSerializer(many=True, required=False)
+
+    def validate_paths(self, value):
+        if value > settings.RISK_SIMULATION_MAX_PATHS:
+            raise serializers.ValidationError(f"Máximo de {settings.RISK_SIMULATION_MAX_PATHS} caminhos por simulação.")
+        return value
+
+class SearchQuerySerializer(serializers.Serializer):
+    SCOPE_CHOICES = ['all', 'transactions', 'accounts']
+
+    q = serializers.CharField(min_length=2, max_length=100)
+    scope = serializers.ChoiceField(choices=SCOPE_CHOICES, default='all')
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+class AutocompleteQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(min_length=1, max_length=100, trim_whitespace=False)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+class BalanceAtQuerySerializer(serializers.Serializer):
+    at = serializers.DateTimeField()
+
+class ExpirationForecastQuerySerializer(serializers.Serializer):
+    months = serializers.IntegerField(min_value=1, max_value=60, default=12)
+
+class AuditQuerySerializer(serializers.Serializer):
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+class StatementImportSerializer(serializers.Serializer):
+    file = serializers.FileField()
+    mapping = serializers.CharField(required=False, max_length=50)
+
+class StatementQuerySerializer(serializers.Serializer):
+    month = serializers.DateField(input_formats=['%Y-%m'])
+    output = serializers.ChoiceField(choices=['csv', 'pdf'], default='csv')
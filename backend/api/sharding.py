@@ -0,0 +1,374 @@
+"""
+Sharding por usuário entre vários bancos (``DB_SHARDS``).
+
+Usuários, sessões, admin e o ``UserShard`` ficam no ``default``. Tudo que é do
+usuário (carteiras, contas, transações, tombstones, checkpoints do arquivo,
+jobs de exclusão, auditoria de saldos e os ``SyncCounter`` do sync incremental)
+fica no shard dele, o ``UserShard.alias``. Usuários novos são distribuídos
+por ``SHARD_ALIASES[user_id % N]``; quem não tem registro (contas anteriores
+ao sharding, fixadas no ``default`` pela migration 0019) fica no ``default``,
+onde sempre estiveram os seus dados. O ``default`` também é um shard.
+
+- Roteamento: o ``ShardMiddleware`` guarda a requisição num ``ContextVar`` e o
+  ``ShardRouter`` resolve o shard a partir de ``request.user`` quando a primeira
+  query de um modelo particionado acontece (depois da autenticação do DRF). Fora
+  de requisições (comandos, threads) use ``use_shard(alias)``.
+- Transações: ``atomic()`` e ``on_commit()`` deste módulo abrem/agendam no
+  shard atual; ``transaction.atomic()`` sem ``using`` só cobriria o ``default``.
+- Programas: escritos sempre no ``default`` e replicados (mesmo id) para os
+  shards: o catálogo padrão para todos, os criados por usuário para o shard do
+  criador. Leituras acontecem no shard, junto com as contas.
+- Usuários: cada shard tem uma cópia da linha do usuário (chaves estrangeiras),
+  mantida pelos sinais abaixo.
+- Arquivo frio: os arquivos em ``ARCHIVE_ROOT`` são compartilhados; só os
+  manifestos (``ArchivedMonth``) e checkpoints ficam no shard.
+- Ids: cada shard numera as tabelas particionadas a partir de
+  ``índice * SHARD_ID_SPACE`` (ajustado no ``post_migrate``), então os ids são
+  únicos entre shards e mover um usuário (``manage.py move_user_shard``) não
+  muda nenhum id visto pelos clientes.
+
+Sem ``DB_SHARDS`` o router não é instalado e tudo continua no ``default``.
+"""
+import contextlib
+import copy
+import functools
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+SHARD_ID_SPACE = 10 ** 12
+# Modelos cujos dados pertencem a um único usuário.
+PARTITIONED_MODELS = {
+    'userwallet', 'loyaltyaccount', 'pointstransaction', 'synctombstone',
+    'archivecheckpoint', 'archivedmonth', 'deletionjob', 'synccounter', 'balanceauditlog',
+}
+# Tabelas com ids gerados no shard (ver ``offset_sequences``).
+SEQUENCED_TABLES = [
+    'api_userwallet', 'api_loyaltyaccount', 'api_pointstransaction', 'api_synctombstone',
+    'api_archivecheckpoint', 'api_archivedmonth', 'api_deletionjob', 'api_balanceauditlog',
+]
+
+_current = ContextVar('easymiles_shard', default=None)
+
+
+class ShardMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Seus dados estão sendo migrados. Tente novamente em instantes."
+    default_code = 'shard_moving'
+
+
+def shard_aliases():
+    return getattr(settings, 'SHARD_ALIASES', [DEFAULT_DB_ALIAS])
+
+
+def is_enabled():
+    return len(shard_aliases()) > 1
+
+
+def assign_shard(user_id):
+    """Shard de um usuário recém-cadastrado."""
+    aliases = shard_aliases()
+    return aliases[user_id % len(aliases)]
+
+
+def shard_for_user(user_id):
+    """Alias do shard do usuário (uma query por chave primária no ``default``)."""
+    from .models import UserShard
+
+    row = UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user_id=user_id).values_list('alias', 'is_moving').first()
+    if row is None:
+        # Sem registro: usuário de antes do sharding, com tudo no default.
+        return DEFAULT_DB_ALIAS, False
+    return row
+
+
+def _request_shard(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return DEFAULT_DB_ALIAS
+    cached = getattr(request, '_easymiles_shard', None)
+    if cached is None or cached[0] != user.pk:
+        alias, is_moving = shard_for_user(user.pk)
+        cached = request._easymiles_shard = (user.pk, alias, is_moving)
+    if cached[2]:
+        raise ShardMoving()
+    return cached[1]
+
+
+def current_shard():
+    value = _current.get()
+    if value is None:
+        return DEFAULT_DB_ALIAS
+    if isinstance(value, str):
+        return value
+    return _request_shard(value)
+
+
+@contextlib.contextmanager
+def use_shard(alias):
+    """Fixa o shard fora de requisições (comandos, threads)."""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+def atomic(func=None):
+    """``transaction.atomic`` no shard atual; como decorator, o shard é resolvido a cada chamada."""
+    if callable(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with transaction.atomic(using=current_shard()):
+                return func(*args, **kwargs)
+        return inner
+    return transaction.atomic(using=current_shard())
+
+
+def on_commit(callback):
+    transaction.on_commit(callback, using=current_shard())
+
+
+def is_partitioned(model):
+    return model._meta.app_label == 'api' and model._meta.model_name in PARTITIONED_MODELS
+
+
+class ShardRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'api' and model._meta.model_name == 'loyaltyprogram':
+            return current_shard()
+        if not is_partitioned(model):
+            return None
+        instance = hints.get('instance')
+        # Só objetos particionados dizem em que shard está o relacionado; um
+        # usuário ou programa vindo do ``default`` não.
+        if instance is not None and is_partitioned(type(instance)) and instance._state.db:
+            return instance._state.db
+        return current_shard()
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'api' and model._meta.model_name == 'loyaltyprogram':
+            return DEFAULT_DB_ALIAS
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Mesmo esquema em todos os shards (inclusive tabelas só usadas no
+        # default), para que exclusões em cascata das cópias de usuário funcionem.
+        return True
+
+
+class ShardMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Não é resetado no fim: respostas em streaming consultam o banco depois do middleware.
+        _current.set(request)
+        return self.get_response(request)
+
+
+def _save_copy(instance, alias):
+    clone = copy.copy(instance)
+    clone._state = copy.copy(instance._state)
+    clone.save(using=alias)
+
+
+def ensure_shadow_user(user, alias):
+    if alias != DEFAULT_DB_ALIAS:
+        _save_copy(user, alias)
+
+
+def replicate_program(program):
+    """Copia um programa do ``default`` para os shards que precisam dele."""
+    if program.is_user_created:
+        if program.created_by_id is None:
+            return
+        aliases = [shard_for_user(program.created_by_id)[0]]
+    else:
+        aliases = shard_aliases()
+    for alias in aliases:
+        if alias != DEFAULT_DB_ALIAS:
+            _save_copy(program, alias)
+
+
+def sync_catalog(alias):
+    """Traz para ``alias`` o catálogo padrão do ``default`` (shard novo ou recriado)."""
+    from .models import LoyaltyProgram
+
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    if LoyaltyProgram._meta.db_table not in connections[DEFAULT_DB_ALIAS].introspection.table_names():
+        return  # default ainda não migrado; o catálogo vem quando ele for
+    for program in LoyaltyProgram.objects.using(DEFAULT_DB_ALIAS).filter(is_user_created=False):
+        _save_copy(program, alias)
+
+
+def offset_sequences(alias):
+    """Faz o shard de índice ``i`` gerar ids a partir de ``i * SHARD_ID_SPACE``."""
+    index = shard_aliases().index(alias)
+    if not index:
+        return
+    start = index * SHARD_ID_SPACE
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for table in SEQUENCED_TABLES:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {table})))",
+                    [table, start],
+                )
+            elif connection.vendor == 'sqlite':
+                cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start])
+                elif row[0] < start:
+                    cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start, table])
+
+
+def prepare_shard(using, **kwargs):
+    """``post_migrate``: numeração dos ids e catálogo de programas do shard."""
+    if using not in shard_aliases():
+        return
+    offset_sequences(using)
+    sync_catalog(using)
+
+
+# Sinais (conectados em ``ApiConfig.ready`` quando há mais de um shard)
+
+def user_saved(sender, instance, created, using, **kwargs):
+    from .models import UserShard
+
+    if using != DEFAULT_DB_ALIAS:
+        return
+    if created:
+        alias = assign_shard(instance.pk)
+        UserShard.objects.using(DEFAULT_DB_ALIAS).create(user=instance, alias=alias)
+    else:
+        alias = shard_for_user(instance.pk)[0]
+    ensure_shadow_user(instance, alias)
+
+
+def program_saved(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        replicate_program(instance)
+
+
+def program_deleted(sender, instance, using, **kwargs):
+    from .models import LoyaltyProgram
+
+    if using != DEFAULT_DB_ALIAS:
+        return
+    for alias in shard_aliases():
+        if alias != DEFAULT_DB_ALIAS:
+            LoyaltyProgram.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    from .models import LoyaltyProgram
+
+    post_save.connect(user_saved, sender=get_user_model(), dispatch_uid='easymiles_shard_user')
+    post_save.connect(program_saved, sender=LoyaltyProgram, dispatch_uid='easymiles_shard_program')
+    post_delete.connect(program_deleted, sender=LoyaltyProgram, dispatch_uid='easymiles_shard_program_delete')
+
+
+# Rebalanceamento
+
+def _copy_rows(queryset, target, change_seq, chunk_size):
+    batch = []
+    copied = 0
+    for obj in queryset.order_by('pk').iterator(chunk_size=chunk_size):
+        if hasattr(obj, 'change_seq'):
+            obj.change_seq = change_seq
+        batch.append(obj)
+        if len(batch) >= chunk_size:
+            copied += len(queryset.model.objects.using(target).bulk_create(batch))
+            batch = []
+    if batch:
+        copied += len(queryset.model.objects.using(target).bulk_create(batch))
+    return copied
+
+
+def user_querysets(user_id, alias):
+    """Dados do usuário em ``alias``, na ordem de cópia (pais antes dos filhos)."""
+    from .models import (
+        ArchiveCheckpoint, ArchivedMonth, BalanceAuditLog, DeletionJob, LoyaltyAccount, LoyaltyProgram,
+        PointsTransaction, SyncTombstone, UserWallet,
+    )
+
+    return [
+        LoyaltyProgram.objects.using(alias).filter(is_user_created=True, created_by_id=user_id),
+        UserWallet.objects.using(alias).filter(user_id=user_id),
+        LoyaltyAccount.objects.using(alias).filter(wallet__user_id=user_id),
+        PointsTransaction.objects.using(alias).filter(
+            Q(origin_account__wallet__user_id=user_id) | Q(destination_account__wallet__user_id=user_id)
+        ).distinct(),
+        ArchiveCheckpoint.objects.using(alias).filter(account__wallet__user_id=user_id),
+        ArchivedMonth.objects.using(alias).filter(user_id=user_id),
+        SyncTombstone.objects.using(alias).filter(user_id=user_id),
+        DeletionJob.objects.using(alias).filter(user_id=user_id),
+        BalanceAuditLog.objects.using(alias).filter(user_id=user_id),
+    ]
+
+
+def move_user(user, target, chunk_size=2000):
+    """
+    Move os dados de ``user`` para o shard ``target`` mantendo os ids. Durante a
+    cópia as requisições do usuário recebem 503 (``UserShard.is_moving``).
+    Retorna ``{modelo: linhas copiadas}``.
+    """
+    from .models import SyncCounter, SyncTombstone, UserShard
+
+    if target not in shard_aliases():
+        raise ValueError(f"Shard desconhecido: {target}")
+    source, _ = shard_for_user(user.pk)
+    if source == target:
+        return {}
+
+    UserShard.objects.using(DEFAULT_DB_ALIAS).update_or_create(
+        user=user, defaults={'alias': source, 'is_moving': True}
+    )
+    try:
+        copied = {}
+        with transaction.atomic(using=target):
+            ensure_shadow_user(user, target)
+            # O sync incremental continua a partir do maior contador entre os dois shards.
+            floor = max(
+                SyncCounter.current_value(user.pk, using=source), SyncCounter.current_value(user.pk, using=target)
+            )
+            SyncCounter.objects.using(target).get_or_create(user_id=user.pk, defaults={'value': floor})
+            SyncCounter.objects.using(target).filter(user_id=user.pk, value__lt=floor).update(value=floor)
+            change_seq = SyncCounter.next_value(user.pk, using=target)
+            for queryset in user_querysets(user.pk, source):
+                if target == DEFAULT_DB_ALIAS and queryset.model._meta.model_name == 'loyaltyprogram':
+                    continue  # o default já tem todos os programas
+                copied[queryset.model._meta.model_name] = _copy_rows(queryset, target, change_seq, chunk_size)
+
+        UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user=user).update(alias=target)
+
+        with transaction.atomic(using=source):
+            for queryset in reversed(user_querysets(user.pk, source)):
+                if source == DEFAULT_DB_ALIAS and queryset.model._meta.model_name == 'loyaltyprogram':
+                    continue
+                while True:
+                    ids = list(queryset.order_by().values_list('pk', flat=True)[:chunk_size])
+                    if not ids:
+                        break
+                    queryset.model.objects.using(source).filter(pk__in=ids).delete()
+            # Tombstones criados pelos sinais durante a limpeza não interessam a ninguém.
+            SyncTombstone.objects.using(source).filter(user_id=user.pk).delete()
+            if source != DEFAULT_DB_ALIAS:
+                get_user_model().objects.using(source).filter(pk=user.pk).delete()
+    finally:
+        UserShard.objects.using(DEFAULT_DB_ALIAS).filter(user=user).update(is_moving=False)
+    return copied
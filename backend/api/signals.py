@@ -0,0 +1,79 @@
+"""
+Tombstones do sync incremental. As exclusões (inclusive em cascata a partir
+de uma carteira) são registradas em ``SyncTombstone`` com uma nova sequência
+do ``SyncCounter`` do dono.
+"""
+from django.db.models import Q
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import LoyaltyAccount, PointsTransaction, SyncCounter, SyncTombstone, UserWallet
+
+
+def record_tombstones(user_id, model_name, object_ids, using=None):
+    if user_id is None or not object_ids:
+        return
+    seq = SyncCounter.next_value(user_id, using=using)
+    SyncTombstone.objects.using(using).bulk_create([
+        SyncTombstone(user_id=user_id, model_name=model_name, object_id=object_id, change_seq=seq)
+        for object_id in object_ids
+    ])
+
+
+@receiver(pre_delete, sender=UserWallet)
+def capture_wallet_owner(sender, instance, using, **kwargs):
+    instance._sync_user_id = instance.user_id
+
+
+@receiver(pre_delete, sender=LoyaltyAccount)
+def capture_account_owner(sender, instance, using, **kwargs):
+    if LoyaltyAccount.wallet.is_cached(instance):
+        instance._sync_user_id = instance.wallet.user_id
+    else:
+        instance._sync_user_id = UserWallet.objects.using(using).filter(
+            pk=instance.wallet_id
+        ).values_list('user_id', flat=True).first()
+
+    # As transações perdem a referência (SET_NULL) e precisam aparecer como alteradas no próximo sync.
+    linked = PointsTransaction.objects.using(using).filter(
+        Q(origin_account_id=instance.pk) | Q(destination_account_id=instance.pk)
+    )
+    instance._sync_transaction_ids = list(linked.values_list('pk', flat=True))
+    if instance._sync_transaction_ids and instance._sync_user_id is not None:
+        linked.update(change_seq=SyncCounter.next_value(instance._sync_user_id, using=using))
+
+
+@receiver(pre_delete, sender=PointsTransaction)
+def capture_transaction_owner(sender, instance, using, **kwargs):
+    account_ids = [pk for pk in (instance.origin_account_id, instance.destination_account_id) if pk is not None]
+    instance._sync_user_id = LoyaltyAccount.objects.using(using).filter(
+        pk__in=account_ids
+    ).values_list('wallet__user_id', flat=True).first()
+
+
+@receiver(post_delete, sender=UserWallet)
+def tombstone_wallet(sender, instance, using, **kwargs):
+    record_tombstones(getattr(instance, '_sync_user_id', None), 'wallet', [instance.pk], using)
+
+
+@receiver(post_delete, sender=LoyaltyAccount)
+def tombstone_account(sender, instance, using, **kwargs):
+    user_id = getattr(instance, '_sync_user_id', None)
+    record_tombstones(user_id, 'account', [instance.pk], using)
+
+    # Transações que ficaram sem nenhuma conta deixam de ser visíveis para o usuário.
+    transaction_ids = getattr(instance, '_sync_transaction_ids', [])
+    if transaction_ids:
+        orphaned = set(PointsTransaction.objects.using(using).filter(
+            pk__in=transaction_ids, origin_account__isnull=True, destination_account__isnull=True
+        ).values_list('pk', flat=True))
+        # Numa cascata de carteira, a outra ponta de uma transferência pode já ter registrado o tombstone.
+        orphaned -= set(SyncTombstone.objects.using(using).filter(
+            user_id=user_id, model_name='transaction', object_id__in=orphaned
+        ).values_list('object_id', flat=True))
+        record_tombstones(user_id, 'transaction', sorted(orphaned), using)
+
+
+@receiver(post_delete, sender=PointsTransaction)
+def tombstone_transaction(sender, instance, using, **kwargs):
+    record_tombstones(getattr(instance, '_sync_user_id', None), 'transaction', [instance.pk], using)
@@ -0,0 +1,158 @@
+"""
+Coalescência (single-flight) de leituras caras por usuário, como o resumo e o
+dashboard: requisições idênticas simultâneas esperam um único cálculo em
+andamento e recebem o mesmo resultado, então a carga no banco fica limitada
+pelo número de usuários distintos, não pelo de requisições.
+
+- Dentro do worker, sempre: a primeira requisição calcula; as que chegam
+  enquanto ela roda esperam num ``threading.Event``. Requer workers que
+  atendam requisições em paralelo (os workers ASGI do ``entrypoint.sh`` rodam
+  as views síncronas em threads).
+- Entre workers, com ``SINGLEFLIGHT_BACKEND``:
+  ``'advisory'`` usa ``pg_try_advisory_lock`` (PostgreSQL; em outro banco cai
+  no ``'cache'``) e ``'cache'`` usa ``cache.add`` como lock. Quem calcula grava
+  o resultado no cache padrão por ``SINGLEFLIGHT_RESULT_TTL`` segundos; quem
+  encontra o lock ocupado espera (até ``SINGLEFLIGHT_WAIT_TIMEOUT``) e usa esse
+  resultado, desde que ele tenha terminado depois da sua chegada. Sem um cache
+  compartilhado entre processos (Redis, Memcached) o lock só serializa o cálculo.
+  ``'local'`` (padrão) desliga a coordenação entre workers.
+
+Só entram requisições que chegam durante um cálculo: nada é servido de um
+resultado que já estava pronto antes da requisição.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .metrics import COALESCED_REQUESTS
+
+POLL_INTERVAL = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AdvisoryLock:
+    """Lock de sessão do PostgreSQL na conexão da thread atual."""
+
+    def __init__(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        self.lock_id = int.from_bytes(digest, 'big', signed=True)
+
+    def acquire(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [self.lock_id])
+            return cursor.fetchone()[0]
+
+    def release(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [self.lock_id])
+
+
+class CacheLock:
+    """Lock por ``cache.add``; expira sozinho se o dono morrer no meio do cálculo."""
+
+    def __init__(self, key, timeout):
+        self.key = f'singleflight:lock:{key}'
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        return cache.add(self.key, self.token, self.timeout)
+
+    def release(self):
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+class SingleFlight:
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @property
+    def backend(self):
+        return self._backend or getattr(settings, 'SINGLEFLIGHT_BACKEND', 'local')
+
+    def do(self, key, fn, endpoint='unnamed'):
+        """
+        Executa ``fn()`` uma vez para todas as chamadas simultâneas com a mesma
+        ``key`` e devolve o resultado (ou relança a exceção) para todas.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            COALESCED_REQUESTS.labels(endpoint=endpoint, result='shared').inc()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result, shared = self._across_workers(key, fn)
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        COALESCED_REQUESTS.labels(endpoint=endpoint, result='shared' if shared else 'leader').inc()
+        return call.result
+
+    def _cross_worker_lock(self, key):
+        if self.backend == 'advisory' and connection.vendor == 'postgresql':
+            return AdvisoryLock(key)
+        return CacheLock(key, timeout=settings.SINGLEFLIGHT_WAIT_TIMEOUT)
+
+    def _across_workers(self, key, fn):
+        """Retorna ``(resultado, veio de outro worker)``."""
+        if self.backend == 'local':
+            return fn(), False
+
+        arrived_at = time.time()
+        result_key = f'singleflight:result:{key}'
+        lock = self._cross_worker_lock(key)
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_TIMEOUT
+        while not lock.acquire():
+            shared = cache.get(result_key)
+            if shared is not None and shared[0] >= arrived_at:
+                return shared[1], True
+            if time.monotonic() >= deadline:
+                # Dono do lock lento demais: calcula sem coordenação.
+                return fn(), False
+            time.sleep(POLL_INTERVAL)
+
+        try:
+            # O lock pode ter sido liberado entre a última leitura e o acquire.
+            shared = cache.get(result_key)
+            if shared is not None and shared[0] >= arrived_at:
+                return shared[1], True
+            result = fn()
+            cache.set(result_key, (time.time(), result), settings.SINGLEFLIGHT_RESULT_TTL)
+            return result, False
+        finally:
+            lock.release()
+
+
+def request_key(request, endpoint):
+    """Chave por endpoint, usuário e query string (parâmetros ordenados)."""
+    params = sorted((param, value) for param, values in request.query_params.lists() for value in values)
+    query = '&'.join(f'{param}={value}' for param, value in params)
+    return f'{endpoint}:{request.user.pk}:{hashlib.md5(query.encode()).hexdigest()}'
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,273 @@
+"""
+Extrato mensal de uma ``LoyaltyAccount`` em CSV ou PDF: saldo e custo médio
+de abertura, cada transação do mês com o saldo após ela (gravado pelo
+``api.ledger``) e o fechamento.
+
+As linhas vêm de ``.iterator()`` em lotes e os renderizadores são geradores,
+então a memória fica limitada mesmo para contas com muitas transações. Meses
+fechados são guardados no cache ``STATEMENT_CACHE`` (limitado em entradas e
+bytes, fora da memória dos workers) com uma chave que inclui a versão dos dados
+(quantidade e maior ``change_seq`` das transações do mês, saldo de abertura),
+de modo que um lançamento retroativo invalida o extrato automaticamente.
+"""
+import csv
+import hashlib
+import heapq
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+
+from .ledger import account_delta, balance_at
+from .models import ArchivedMonth, PointsTransaction
+from .partitioning import add_months, month_start
+
+CSV_HEADER = ['data', 'tipo', 'descricao', 'contraparte', 'movimento', 'saldo_apos', 'custo_medio_apos']
+
+
+class Statement:
+    """Extrato do mês (UTC, como as partições) que contém a data ``month``."""
+
+    def __init__(self, account, month):
+        self.account = account
+        self.start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+        self.end = add_months(self.start, 1)
+        self.opening_balance, self.opening_average_cost, _ = balance_at(account, self.start - timedelta(microseconds=1))
+        self.closing_balance = self.opening_balance
+        self.closing_average_cost = self.opening_average_cost
+
+    @property
+    def available(self):
+        return self.opening_balance is not None
+
+    @property
+    def is_closed(self):
+        return self.end <= month_start(timezone.now())
+
+    def _hot_transactions(self):
+        return (
+            PointsTransaction.objects
+            .filter(Q(origin_account=self.account) | Q(destination_account=self.account),
+                    transaction_date__gte=self.start, transaction_date__lt=self.end)
+            .select_related('origin_account', 'destination_account')
+            .order_by('transaction_date', 'id')
+            .iterator(chunk_size=settings.STATEMENT_CHUNK_SIZE)
+        )
+
+    def _archived_transactions(self):
+        from .archive import archived_transactions
+
+        if not ArchivedMonth.objects.filter(user_id=self.account.wallet.user_id, month=self.start.date()).exists():
+            return []
+        rows = archived_transactions(self.account.wallet.user, {
+            'account': self.account.pk,
+            'date_after': self.start,
+            'date_before': self.end - timedelta(microseconds=1),
+        })
+        return sorted(rows, key=lambda tx: (tx.transaction_date, tx.id))
+
+    def lines(self):
+        """Gera as linhas do mês em ordem cronológica, atualizando o fechamento."""
+        balance, average_cost = self.opening_balance, self.opening_average_cost
+        transactions = heapq.merge(
+            self._hot_transactions(), self._archived_transactions(),
+            key=lambda tx: (tx.transaction_date, tx.id),
+        )
+        for tx in transactions:
+            is_origin = tx.origin_account_id == self.account.pk
+            side = 'origin' if is_origin else 'destination'
+            delta = account_delta(tx, self.account.pk)
+            stored_balance = getattr(tx, f'{side}_balance_after')
+            balance = stored_balance if stored_balance is not None else balance + delta
+            stored_cost = getattr(tx, f'{side}_average_cost_after')
+            average_cost = stored_cost if stored_cost is not None else average_cost
+            counterparty = tx.destination_account if is_origin else tx.origin_account
+            self.closing_balance, self.closing_average_cost = balance, average_cost
+            yield {
+                'date': tx.transaction_date,
+                'type': tx.get_transaction_type_display(),
+                'description': tx.description,
+                'counterparty': counterparty.name if counterparty is not None else '',
+                'delta': delta,
+                'balance': balance,
+                'average_cost': average_cost,
+            }
+
+    def filename(self, output):
+        return f"extrato-{self.account.pk}-{self.start:%Y-%m}.{output}"
+
+    def cache_key(self, output):
+        """Chave do extrato de um mês fechado, ou ``None`` se o mês ainda está aberto."""
+        if not self.is_closed:
+            return None
+        version = (
+            PointsTransaction.objects
+            .filter(Q(origin_account=self.account) | Q(destination_account=self.account),
+                    transaction_date__gte=self.start, transaction_date__lt=self.end)
+            .aggregate(count=Count('id'), max_seq=Max('change_seq'))
+        )
+        archived = ArchivedMonth.objects.filter(
+            user_id=self.account.wallet.user_id, month=self.start.date()
+        ).values_list('path', flat=True).first()
+        parts = [
+            self.account.pk, self.account.name, self.account.account_number, self.account.program.name,
+            self.start.date(), output, version['count'], version['max_seq'], archived,
+            self.opening_balance, self.opening_average_cost,
+        ]
+        digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+        return f"statement:{self.account.pk}:{self.start:%Y-%m}:{output}:{digest}"
+
+
+def _format_decimal(value):
+    return '' if value is None else f"{value:.2f}"
+
+
+class _Echo:
+    """Buffer de uma linha para o ``csv.writer`` (padrão de CSV em streaming do Django)."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(statement):
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow(CSV_HEADER)
+    yield writer.writerow([
+        statement.start.date().isoformat(), 'Saldo inicial', '', '', '',
+        _format_decimal(statement.opening_balance), _format_decimal(statement.opening_average_cost),
+    ])
+    for line in statement.lines():
+        yield writer.writerow([
+            timezone.localtime(line['date']).isoformat(), line['type'], line['description'], line['counterparty'],
+            _format_decimal(line['delta']), _format_decimal(line['balance']), _format_decimal(line['average_cost']),
+        ])
+    yield writer.writerow([
+        (statement.end - timedelta(days=1)).date().isoformat(), 'Saldo final', '', '', '',
+        _format_decimal(statement.closing_balance), _format_decimal(statement.closing_average_cost),
+    ])
+
+
+class StreamingPDFWriter:
+    """
+    Gerador mínimo de PDF (texto em Courier, A4) que emite cada página assim
+    que ela é preenchida. Só os offsets dos objetos ficam em memória para a
+    tabela xref final.
+    """
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+    MARGIN, FONT_SIZE, LEADING = 40, 8, 11
+    CATALOG, PAGES, FONT = 1, 2, 3
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 4
+        self.lines_per_page = (self.PAGE_HEIGHT - 2 * self.MARGIN) // self.LEADING
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+    def _object(self, object_id, body):
+        self.offsets[object_id] = self.offset
+        return self._emit(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+
+    @staticmethod
+    def _escape(text):
+        encoded = text.encode('cp1252', errors='replace')
+        return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+    def start(self):
+        yield self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        yield self._object(self.CATALOG, b"<< /Type /Catalog /Pages 2 0 R >>")
+        yield self._object(
+            self.FONT, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"
+        )
+
+    def page(self, lines):
+        content = b"BT /F3 %d Tf %d TL %d %d Td\n" % (
+            self.FONT_SIZE, self.LEADING, self.MARGIN, self.PAGE_HEIGHT - self.MARGIN
+        )
+        content += b"".join(b"(" + self._escape(line) + b") Tj T*\n" for line in lines) + b"ET"
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self.page_ids.append(page_id)
+        yield self._object(content_id, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        yield self._object(page_id, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F3 3 0 R >> >> /Contents %d 0 R >>"
+        ) % (self.PAGE_WIDTH, self.PAGE_HEIGHT, content_id))
+
+    def finish(self):
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.page_ids)
+        yield self._object(self.PAGES, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)))
+        xref_offset = self.offset
+        xref = b"xref\n0 %d\n0000000000 65535 f \n" % self.next_id
+        xref += b"".join(
+            b"%010d 00000 n \n" % self.offsets[object_id] if object_id in self.offsets else b"0000000000 65535 f \n"
+            for object_id in range(1, self.next_id)
+        )
+        yield self._emit(xref)
+        yield self._emit(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_offset))
+
+
+def render_pdf(statement):
+    account = statement.account
+    writer = StreamingPDFWriter()
+    yield from writer.start()
+
+    row_format = "{:<16} {:<20} {:<24} {:>13} {:>14} {:>10}"
+    page = [
+        f"Extrato {statement.start:%m/%Y} - {account.name} ({account.program.name})",
+        f"Conta: {account.account_number or '-'}",
+        "",
+        f"Saldo inicial: {_format_decimal(statement.opening_balance)}"
+        f"   Custo médio inicial: {_format_decimal(statement.opening_average_cost)}",
+        "",
+        row_format.format('Data', 'Tipo', 'Descrição / contraparte', 'Movimento', 'Saldo', 'C. médio'),
+    ]
+    for line in statement.lines():
+        detail = line['description'] or line['counterparty']
+        page.append(row_format.format(
+            timezone.localtime(line['date']).strftime('%d/%m/%Y %H:%M'), line['type'][:20], detail[:24],
+            _format_decimal(line['delta']), _format_decimal(line['balance']), _format_decimal(line['average_cost']),
+        ))
+        if len(page) == writer.lines_per_page:
+            yield from writer.page(page)
+            page = []
+
+    page += [
+        "",
+        f"Saldo final: {_format_decimal(statement.closing_balance)}"
+        f"   Custo médio final: {_format_decimal(statement.closing_average_cost)}",
+    ]
+    yield from writer.page(page)
+    yield from writer.finish()
+
+
+RENDERERS = {
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
+
+
+def statement_cache():
+    return caches[settings.STATEMENT_CACHE]
+
+
+def cached_stream(chunks, key):
+    """Repassa os pedaços e, ao final, guarda o extrato no cache se couber no limite."""
+    buffer, size = [], 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+        if buffer is not None:
+            size += len(data)
+            if size > settings.STATEMENT_CACHE_MAX_BYTES:
+                buffer = None
+            else:
+                buffer.append(data)
+        yield data
+    if buffer is not None:
+        statement_cache().set(key, b"".join(buffer), settings.STATEMENT_CACHE_TIMEOUT)
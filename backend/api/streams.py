@@ -0,0 +1,105 @@
+import asyncio
+import json
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import views
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .events import broker
+
+TICKET_SALT = 'api.streams.ticket'
+
+
+def issue_ticket(user):
+    """Ticket assinado que só abre o stream do usuário, válido por ``EVENTS_TICKET_MAX_AGE`` segundos."""
+    return signing.dumps({'user': user.pk, 'nonce': uuid.uuid4().hex}, salt=TICKET_SALT)
+
+
+def _redeem_ticket(ticket):
+    try:
+        payload = signing.loads(ticket, salt=TICKET_SALT, max_age=settings.EVENTS_TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    # Uso único: a reconexão do EventSource precisa pedir outro ticket.
+    if not cache.add(f'events:ticket:{payload["nonce"]}', True, settings.EVENTS_TICKET_MAX_AGE):
+        return None
+    return get_user_model().objects.filter(pk=payload['user'], is_active=True).first()
+
+
+def _authenticate(request):
+    """
+    Autentica pelo header ``Authorization: Bearer`` ou, como o EventSource do
+    navegador não envia headers, por um ticket de ``/api/events/ticket/`` no
+    parâmetro ``?ticket=``. O JWT nunca vai na URL (que acaba em logs de acesso).
+    """
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        ticket = request.GET.get('ticket')
+        return _redeem_ticket(ticket) if ticket else None
+    try:
+        validated_token = auth.get_validated_token(raw_token)
+        return auth.get_user(validated_token)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+class EventStreamTicketAPIView(views.APIView):
+    """Emite o ticket de curta duração usado pelo EventSource para abrir o stream."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({
+            'ticket': issue_ticket(request.user),
+            'expires_in': settings.EVENTS_TICKET_MAX_AGE,
+        })
+
+
+def _format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def _event_stream(subscription):
+    keepalive = getattr(settings, 'EVENTS_KEEPALIVE_SECONDS', 15)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield _format_event(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def event_stream(request):
+    """Stream SSE com os eventos do usuário autenticado. Requer servidor ASGI (core.asgi, no entrypoint.sh)."""
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "As credenciais de autenticação não foram fornecidas."}, status=401
+        )
+    if not isinstance(request, ASGIRequest):
+        # Sob WSGI (runserver, core.wsgi) o gerador infinito prenderia um worker síncrono por cliente.
+        return JsonResponse(
+            {"detail": "Stream de eventos indisponível neste servidor. Use o sync incremental."}, status=501
+        )
+
+    subscription = broker.subscribe(user.id)
+    response = StreamingHttpResponse(_event_stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
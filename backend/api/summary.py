@@ -0,0 +1,102 @@
+"""
+Cálculo do resumo patrimonial do usuário a partir das contas já carregadas em
+memória. Usado pelo ``SummaryAPIView`` e pelo ``DashboardAPIView`` para que os
+dois endpoints produzam exatamente os mesmos números.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.db.models import Q, Sum
+
+from .archive import archived_totals
+from .filters import period_q
+from .models import LoyaltyProgram, PointsTransaction
+
+
+def transaction_totals(user, period=None):
+    """
+    Custos de aquisição e vendas do usuário numa única agregação da tabela
+    quente, somados aos totais do arquivo frio. ``period`` (``date_after``/
+    ``date_before`` validados por ``PeriodFilterSerializer``) restringe o
+    cálculo e, no PostgreSQL particionado, as partições lidas.
+    """
+    acquisition_filter = (
+        Q(destination_account__wallet__user=user) & Q(transaction_type__in=[1, 2]) &
+        Q(cost__isnull=False) & Q(cost__gt=0)
+    )
+    sales_filter = Q(origin_account__wallet__user=user) & Q(transaction_type=4) & Q(cost__isnull=False)
+    totals = PointsTransaction.objects.filter(period_q(period or {})).filter(acquisition_filter | sales_filter).aggregate(
+        total_cost_sum=Sum('cost', filter=acquisition_filter),
+        total_points_sold=Sum('amount', filter=sales_filter),
+        total_revenue_from_sales=Sum('cost', filter=sales_filter),
+    )
+    for key, archived in archived_totals(user, period).items():
+        if archived is not None:
+            totals[key] = (totals[key] or Decimal('0.00')) + archived
+    return totals
+
+
+def account_value(account):
+    rate = account.program.custom_rate
+    if rate is not None and rate > 0:
+        return (account.current_balance / Decimal('1000.0')) * rate
+    return Decimal('0.00')
+
+
+def build_summary(user, active_accounts, total_wallets, totals):
+    """
+    ``active_accounts`` deve conter as contas ativas do usuário com ``program``
+    carregado (select_related); ``totals`` vem de ``transaction_totals``.
+    """
+    total_estimated_value = Decimal('0.00')
+    programs = OrderedDict()
+    currencies = {}
+
+    for account in active_accounts:
+        program = account.program
+        value = account_value(account)
+        total_estimated_value += value
+
+        # Agrupa por programa para somar saldos e valores de contas diferentes do mesmo programa (ex: 2 contas Smiles)
+        key = (program.name, program.currency_type, program.custom_rate)
+        item = programs.setdefault(key, {
+            "name": program.name,
+            "currency_type": program.currency_type,
+            "total_balance": Decimal('0.00'),
+            "total_value": Decimal('0.00'),
+        })
+        item["total_balance"] += account.current_balance
+        item["total_value"] += value
+
+        # Resumo por Tipo (Milhas vs Pontos)
+        currency = currencies.setdefault(program.currency_type, {"total_balance": Decimal('0.00'), "programs": set()})
+        currency["total_balance"] += account.current_balance
+        currency["programs"].add(program.pk)
+
+    programs_data = sorted(programs.values(), key=lambda item: item["total_value"], reverse=True)
+    for item in programs_data:
+        item["total_value"] = item["total_value"].quantize(Decimal('0.01'))
+
+    currency_map = dict(LoyaltyProgram.CURRENCY_TYPE_CHOICES)
+    processed_balances = [
+        {
+            "currency_name": currency_map.get(currency_type_id, f"ID {currency_type_id}"),
+            "total_balance": currencies[currency_type_id]["total_balance"],
+            "distinct_programs_count": len(currencies[currency_type_id]["programs"]),
+        }
+        for currency_type_id in sorted(currencies)
+    ]
+
+    total_acquisition_cost = totals['total_cost_sum'] or Decimal('0.00')
+    return {
+        "user_id": user.id,
+        "username": user.username,
+        "total_wallets": total_wallets,
+        "total_active_loyalty_accounts": len(active_accounts),
+        "overall_estimated_value": total_estimated_value.quantize(Decimal('0.01')),
+        "programs_summary": programs_data,
+        "balances_by_currency_type": processed_balances,
+        "total_acquisition_cost_tracked": total_acquisition_cost.quantize(Decimal('0.01')),
+        "total_points_milhas_sold": totals['total_points_sold'] or Decimal('0.00'),
+        "total_revenue_from_sales": totals['total_revenue_from_sales'] or Decimal('0.00'),
+    }
@@ -1,9 +1,15 @@
+import csv
+import io
+
 import pytest
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
 from django.utils import timezone
+from datetime import timedelta
 from decimal import Decimal, ROUND_HALF_UP
 
 from .models import LoyaltyProgram, UserWallet, LoyaltyAccount, PointsTransaction
@@ -14,6 +20,16 @@ from .serializers import (
 
 pytestmark = pytest.mark.django_db
 
+
+@pytest.fixture(autouse=True)
+def clear_process_caches():
+    # Entre testes os ids e change_seq se repetem (rollback); estes caches são por processo.
+    from django.core.cache import caches
+    from .memo import simulation_cache
+    simulation_cache.clear()
+    caches['throttle'].clear()
+    caches['statements'].clear()
+
 User = get_user_model()
 
 
@@ -251,6 +267,32 @@ def test_cannot_toggle_active_default_program(authenticated_api_client, default_
     response = authenticated_api_client.patch(url, {}, format='json')
     assert response.status_code == status.HTTP_403_FORBIDDEN 
 
+def test_program_autocomplete_ignores_case_and_accents(authenticated_api_client, default_program, custom_program):
+    LoyaltyProgram.objects.create(name="Pão de Açúcar Mais", currency_type=1)
+    LoyaltyProgram.objects.create(name="Pagol", currency_type=1)
+    url = reverse('loyaltyprogram-autocomplete')
+
+    response = authenticated_api_client.get(url, {'q': 'PAO D'})
+    assert response.status_code == status.HTTP_200_OK
+    assert [p['name'] for p in response.data] == ["Pão de Açúcar Mais"]
+
+    response = authenticated_api_client.get(url, {'q': 'pa', 'limit': 1})
+    assert [p['name'] for p in response.data] == ["Pagol"]
+    assert 'private' in response['Cache-Control'] and 'max-age=' in response['Cache-Control']
+    assert 'Authorization' in response['Vary']
+
+def test_program_autocomplete_follows_program_visibility(authenticated_api_client, authenticated_api_client_other, default_program, custom_program):
+    url = reverse('loyaltyprogram-autocomplete')
+    assert [p['id'] for p in authenticated_api_client.get(url, {'q': 'meu'}).data] == [custom_program.pk]
+    assert authenticated_api_client_other.get(url, {'q': 'meu'}).data == []
+    assert authenticated_api_client.get(url).status_code == status.HTTP_400_BAD_REQUEST
+
+def test_program_search_name_follows_renames(custom_program):
+    custom_program.name = "Ótimo Clube"
+    custom_program.save(update_fields=['name'])
+    custom_program.refresh_from_db()
+    assert custom_program.search_name == "otimo clube"
+
 
 def test_list_wallets(authenticated_api_client, user_wallet):
     UserWallet.objects.create(user=authenticated_api_client.user, wallet_name="Outra Carteira")
@@ -485,6 +527,43 @@ def test_simulate_sale(authenticated_api_client, loyalty_account):
     assert response.data['total_estimated_cost_value'] == Decimal('184.00')
     assert response.data['estimated_profit'] == Decimal('20.00')
 
+def test_simulation_results_are_memoized_until_account_changes(authenticated_api_client, loyalty_account, loyalty_account_points, django_capture_on_commit_callbacks):
+    from django.test.utils import CaptureQueriesContext
+    from .memo import SimulationCache, simulation_cache
+
+    url = reverse('simulation-sale')
+    data = {"loyalty_account_id": loyalty_account.pk, "amount_to_sell": "1000", "sale_price_per_1000_miles": "25.5"}
+    with CaptureQueriesContext(connection) as miss:
+        first = authenticated_api_client.post(url, data, format='json')
+    with CaptureQueriesContext(connection) as hit:
+        # Mesmas entradas com outra escala decimal caem na mesma chave.
+        second = authenticated_api_client.post(url, dict(data, amount_to_sell="1000.00"), format='json')
+    assert second.data == first.data
+    assert len(hit) < len(miss)
+    assert len(simulation_cache) == 1
+
+    with django_capture_on_commit_callbacks(execute=True):
+        create_transaction_via_api(authenticated_api_client, {
+            "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "1000.00",
+            "cost": "50.00", "transaction_date": timezone.now(),
+        })
+    assert len(simulation_cache) == 0
+    third = authenticated_api_client.post(url, data, format='json')
+    assert third.data['current_balance'] == Decimal('11000.00')
+
+    # Versão diferente (alteração vista por outro worker) também descarta a entrada.
+    transfer = {"from_account_id": loyalty_account.pk, "to_account_id": loyalty_account_points.pk, "amount": "100", "bonus_percentage": "0"}
+    authenticated_api_client.post(reverse('simulation-transfer'), transfer, format='json')
+    LoyaltyAccount.objects.filter(pk=loyalty_account_points.pk).update(name="Renomeada", change_seq=10 ** 6)
+    response = authenticated_api_client.post(reverse('simulation-transfer'), transfer, format='json')
+    assert response.data['to_account_name'] == "Renomeada"
+
+    lru = SimulationCache(max_entries=2, ttl=60)
+    for index in range(3):
+        lru.set(('u', index), ((index, 1),), index)
+    assert lru.get(('u', 0), ((0, 1),)) is None
+    assert lru.get(('u', 2), ((2, 1),)) == 2
+
 def test_simulate_sale_insufficient_balance(authenticated_api_client, loyalty_account):
     url = reverse('simulation-sale')
     data = {
@@ -517,4 +596,1411 @@ def test_summary_api(authenticated_api_client, loyalty_account, loyalty_account_
     assert milhas_summary is not None
     assert pontos_summary is not None
     assert milhas_summary['total_balance'] == loyalty_account.current_balance
-    assert pontos_summary['total_balance'] == loyalty_account_points.current_balance
\ No newline at end of file
+    assert pontos_summary['total_balance'] == loyalty_account_points.current_balance
+
+@pytest.fixture
+def captured_events():
+    from .events import broker
+    received = []
+    listener = lambda user_id, event: received.append((user_id, event))
+    broker.add_listener(listener)
+    yield received
+    broker.remove_listener(listener)
+
+def test_transaction_create_publishes_events(authenticated_api_client, loyalty_account, captured_events, django_capture_on_commit_callbacks):
+    data = {
+        "transaction_type": 1,
+        "destination_account": loyalty_account.pk,
+        "amount": "1000.00",
+        "cost": "0.00",
+        "transaction_date": timezone.now()
+    }
+    with django_capture_on_commit_callbacks(execute=True):
+        response = create_transaction_via_api(authenticated_api_client, data)
+    assert response.status_code == status.HTTP_201_CREATED
+    user_id = authenticated_api_client.user.id
+    events_by_type = {event['type']: event for uid, event in captured_events if uid == user_id}
+    assert events_by_type['transaction.created']['data']['id'] == response.data['id']
+    assert events_by_type['account.balance']['data']['current_balance'] == '11000.00'
+    assert events_by_type['summary.delta']['data']['programs'][0]['balance_delta'] == '1000.00'
+
+def test_transaction_delete_publishes_events(authenticated_api_client, loyalty_account, captured_events, django_capture_on_commit_callbacks):
+    transaction = PointsTransaction.objects.create(
+        transaction_type=4, amount=Decimal('1000.00'), origin_account=loyalty_account, transaction_date=timezone.now()
+    )
+    url = reverse('pointstransaction-list-detail', kwargs={'pk': transaction.pk})
+    with django_capture_on_commit_callbacks(execute=True):
+        response = authenticated_api_client.delete(url)
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    event_types = [event['type'] for _, event in captured_events]
+    assert 'transaction.deleted' in event_types
+    assert 'account.balance' in event_types
+
+def test_transaction_create_writes_balance_audit_in_one_batch(authenticated_api_client, loyalty_account, loyalty_account_points, django_capture_on_commit_callbacks):
+    from django.test.utils import CaptureQueriesContext
+    from .models import BalanceAuditLog
+
+    data = {
+        "transaction_type": 2,
+        "origin_account": loyalty_account.pk,
+        "destination_account": loyalty_account_points.pk,
+        "amount": "1000.00",
+        "cost": "0.00",
+        "bonus_percentage": "0.00",
+        "transaction_date": timezone.now()
+    }
+    with CaptureQueriesContext(connection) as ctx, django_capture_on_commit_callbacks(execute=True):
+        response = authenticated_api_client.post(
+            reverse('pointstransaction-list-list'), data, format='json', HTTP_X_REQUEST_ID='req-123'
+        )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response['X-Request-ID'] == 'req-123'
+    assert sum('INSERT INTO "api_balanceauditlog"' in q['sql'] for q in ctx.captured_queries) == 1
+
+    logs = BalanceAuditLog.objects.filter(transaction_id=response.data['id'])
+    origin, dest = (logs.get(account_id=pk) for pk in (loyalty_account.pk, loyalty_account_points.pk))
+    assert (origin.operation, origin.transaction_id, origin.request_id) == ('apply_transfer', response.data['id'], 'req-123')
+    assert (origin.balance_before, origin.balance_after) == (Decimal('10000.00'), Decimal('9000.00'))
+    assert (dest.balance_before, dest.balance_after) == (Decimal('5000.00'), Decimal('6000.00'))
+    assert origin.user_id == dest.user_id == authenticated_api_client.user.id
+
+def test_account_audit_endpoint_lists_reversal_and_apply(authenticated_api_client, loyalty_account, create_user, django_capture_on_commit_callbacks):
+    transaction = PointsTransaction.objects.create(
+        transaction_type=3, amount=Decimal('1000.00'), origin_account=loyalty_account, transaction_date=timezone.now()
+    )
+    url = reverse('pointstransaction-list-detail', kwargs={'pk': transaction.pk})
+    with django_capture_on_commit_callbacks(execute=True):
+        response = authenticated_api_client.patch(
+            url, {'amount': '400.00', 'origin_account': loyalty_account.pk}, format='json'
+        )
+    assert response.status_code == status.HTTP_200_OK
+
+    audit_url = reverse('loyaltyaccount-list-audit', kwargs={'pk': loyalty_account.pk})
+    logs = authenticated_api_client.get(audit_url).data
+    assert [(log['operation'], log['balance_before'], log['balance_after']) for log in logs] == [
+        ('apply_debit_transaction', '11000.00', '10600.00'),
+        ('reverse_transaction_effects', '10000.00', '11000.00'),
+    ]
+    assert {log['transaction_id'] for log in logs} == {transaction.pk}
+    assert authenticated_api_client.get(audit_url, {'since': timezone.now().isoformat()}).data == []
+
+    other_client = APIClient()
+    other_client.force_authenticate(user=create_user(username='audit_other', email='audit_other@example.com'))
+    assert other_client.get(audit_url).status_code == status.HTTP_404_NOT_FOUND
+
+STATEMENT_CSV = (
+    "data;pontos;descricao;custo\n"
+    "01/02/2025 10:00;1.000,00;Compra no cartão;30,00\n"
+    "02/02/2025;-500,00;Resgate;\n"
+    "03/02/2025;100,00;Bônus;\n"
+    "03/02/2025;100,00;Bônus;\n"
+    "04/02/2025;abc;Linha quebrada;\n"
+)
+
+def _statement_file(content, name='extrato.csv'):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    return SimpleUploadedFile(name, content.encode('utf-8'), content_type='text/csv')
+
+def test_import_statement_creates_transactions_and_updates_balance(authenticated_api_client, loyalty_account, django_capture_on_commit_callbacks):
+    url = reverse('loyaltyaccount-list-import', kwargs={'pk': loyalty_account.pk})
+    with django_capture_on_commit_callbacks(execute=True):
+        response = authenticated_api_client.post(url, {'file': _statement_file(STATEMENT_CSV)}, format='multipart')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert (response.data['created'], response.data['skipped'], response.data['invalid']) == (4, 0, 1)
+    assert response.data['errors'][0]['line'] == 6
+
+    loyalty_account.refresh_from_db()
+    assert loyalty_account.current_balance == Decimal('10700.00')
+    assert loyalty_account.average_cost == Decimal('23.20')
+
+    imported = PointsTransaction.objects.filter(import_hash__isnull=False).order_by('transaction_date', 'id')
+    assert [(t.transaction_type, t.amount) for t in imported] == [
+        (1, Decimal('1000.00')), (3, Decimal('500.00')), (1, Decimal('100.00')), (1, Decimal('100.00'))
+    ]
+    assert imported.last().destination_balance_after == Decimal('10700.00')
+    assert imported[1].origin_balance_after == Decimal('10500.00')
+    assert len({t.import_hash for t in imported}) == 4
+
+def test_import_statement_skips_rows_already_imported(authenticated_api_client, loyalty_account):
+    url = reverse('loyaltyaccount-list-import', kwargs={'pk': loyalty_account.pk})
+    authenticated_api_client.post(url, {'file': _statement_file(STATEMENT_CSV)}, format='multipart')
+
+    overlapping = STATEMENT_CSV + "05/02/2025;200,00;Bônus;\n"
+    response = authenticated_api_client.post(url, {'file': _statement_file(overlapping)}, format='multipart')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert (response.data['created'], response.data['skipped']) == (1, 4)
+    loyalty_account.refresh_from_db()
+    assert loyalty_account.current_balance == Decimal('10900.00')
+
+    response = authenticated_api_client.post(url, {'file': _statement_file(overlapping)}, format='multipart')
+    assert response.status_code == status.HTTP_200_OK
+    assert (response.data['created'], response.data['skipped']) == (0, 5)
+
+    response = authenticated_api_client.post(
+        url, {'file': _statement_file(STATEMENT_CSV), 'mapping': 'inexistente'}, format='multipart'
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_event_broker_delivers_to_subscription():
+    import asyncio
+    from .events import EventBroker
+
+    async def scenario():
+        test_broker = EventBroker()
+        subscription = test_broker.subscribe(user_id=42)
+        other = test_broker.subscribe(user_id=7)
+        test_broker.dispatch(42, {'type': 'account.balance', 'data': {'id': 1}})
+        event = await asyncio.wait_for(subscription.get(), timeout=1)
+        test_broker.unsubscribe(subscription)
+        test_broker.unsubscribe(other)
+        return event, other.queue.empty()
+
+    event, other_empty = asyncio.run(scenario())
+    assert event['type'] == 'account.balance'
+    assert event['id'] == 1
+    assert other_empty
+
+def test_event_stream_requires_authentication(api_client):
+    response = api_client.get(reverse('events-stream'))
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+def test_event_stream_refused_under_wsgi(authenticated_api_client):
+    ticket = authenticated_api_client.post(reverse('events-ticket')).data['ticket']
+    authenticated_api_client.credentials()
+    response = authenticated_api_client.get(reverse('events-stream'), {'ticket': ticket})
+    assert response.status_code == status.HTTP_501_NOT_IMPLEMENTED
+    assert not response.streaming
+
+def test_event_stream_ticket_is_single_use_and_replaces_jwt_in_url(api_client, create_user):
+    create_user(username='streamer', password='password123')
+    access = api_client.post(
+        reverse('token_obtain_pair'), {'username': 'streamer', 'password': 'password123'}, format='json'
+    ).data['access']
+    assert api_client.post(reverse('events-ticket')).status_code == status.HTTP_401_UNAUTHORIZED
+    # O JWT na query string (que vai parar nos logs de acesso) não autentica mais.
+    assert api_client.get(reverse('events-stream'), {'token': access}).status_code == status.HTTP_401_UNAUTHORIZED
+    assert api_client.get(reverse('events-stream'), {'ticket': access}).status_code == status.HTTP_401_UNAUTHORIZED
+
+    api_client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+    ticket = api_client.post(reverse('events-ticket')).data['ticket']
+    api_client.credentials()
+    assert api_client.get(reverse('events-stream'), {'ticket': ticket}).status_code == status.HTTP_501_NOT_IMPLEMENTED
+    assert api_client.get(reverse('events-stream'), {'ticket': ticket}).status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_accounts_sparse_fields_skip_joins(authenticated_api_client, loyalty_account):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    url = reverse('loyaltyaccount-list-list')
+    with CaptureQueriesContext(connection) as ctx:
+        response = authenticated_api_client.get(url, {'fields': 'id,current_balance'})
+    assert response.status_code == status.HTTP_200_OK
+    assert set(response.data[0].keys()) == {'id', 'current_balance'}
+    account_query = next(q['sql'] for q in ctx.captured_queries if 'FROM "api_loyaltyaccount"' in q['sql'])
+    assert 'api_loyaltyprogram' not in account_query
+    assert '"api_loyaltyaccount"."average_cost"' not in account_query
+
+def test_sparse_fields_only_shape_list_and_retrieve(authenticated_api_client, loyalty_account):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    def account_queries(url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = authenticated_api_client.get(url, params or {})
+        assert response.status_code == status.HTTP_200_OK
+        return [q['sql'] for q in ctx.captured_queries if 'FROM "api_loyaltyaccount"' in q['sql']]
+
+    # Sem ?fields=/?omit= a queryset da view fica como está (com o join do programa).
+    plain = account_queries(reverse('loyaltyaccount-list-list'))
+    assert 'api_loyaltyprogram' in plain[0]
+    # Ações customizadas ignoram ?fields=: nada de colunas adiadas lidas uma a uma.
+    url = reverse('loyaltyaccount-list-balance-at', kwargs={'pk': loyalty_account.pk})
+    at = {'at': timezone.now().isoformat()}
+    assert len(account_queries(url, {**at, 'fields': 'id'})) == len(account_queries(url, at))
+
+def test_transactions_omit_fields(authenticated_api_client, loyalty_account):
+    PointsTransaction.objects.create(
+        transaction_type=1, amount=Decimal('500.00'), destination_account=loyalty_account, transaction_date=timezone.now()
+    )
+    url = reverse('pointstransaction-list-list')
+    response = authenticated_api_client.get(url, {'omit': 'origin_account_name,destination_account_name,description'})
+    assert response.status_code == status.HTTP_200_OK
+    row = response.data[0]
+    assert 'destination_account_name' not in row
+    assert 'description' not in row
+    assert row['destination_account'] == loyalty_account.pk
+    assert row['transaction_type_display'] == 'Inclusão Manual'
+
+def test_sparse_fields_keep_related_values(authenticated_api_client, loyalty_account):
+    url = reverse('loyaltyaccount-list-detail', kwargs={'pk': loyalty_account.pk})
+    response = authenticated_api_client.get(url, {'fields': 'id,program_name,program_currency_type'})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data == {
+        'id': loyalty_account.pk,
+        'program_name': loyalty_account.program.name,
+        'program_currency_type': 'Milhas',
+    }
+
+
+def test_orjson_renderer_matches_default_renderer():
+    from rest_framework.renderers import JSONRenderer
+    from .renderers import ORJSONRenderer
+
+    data = {
+        "overall_estimated_value": Decimal('285.00'),
+        "current_balance": "10000.00",
+        "transaction_date": timezone.datetime(2025, 1, 31, 12, 30, tzinfo=timezone.get_fixed_timezone(0)),
+        "programs_summary": [{"name": "Programa Padrão", "total_balance": Decimal('1500.50')}],
+    }
+    assert ORJSONRenderer().render(data) == JSONRenderer().render(data)
+
+def test_orjson_parser_roundtrip():
+    import io
+    from rest_framework.exceptions import ParseError
+    from .renderers import ORJSONParser
+
+    assert ORJSONParser().parse(io.BytesIO(b'{"amount": "1000.00", "cost": null}')) == {"amount": "1000.00", "cost": None}
+    with pytest.raises(ParseError):
+        ORJSONParser().parse(io.BytesIO(b'{"amount":'))
+
+@pytest.mark.parametrize('accept_encoding, expected', [('gzip, deflate, br', 'br'), ('gzip', 'gzip'), ('', None)])
+def test_list_response_compression(authenticated_api_client, loyalty_account, accept_encoding, expected):
+    PointsTransaction.objects.bulk_create([
+        PointsTransaction(transaction_type=1, amount=Decimal('100.00'), destination_account=loyalty_account,
+                          description=f"Compra {i}", transaction_date=timezone.now())
+        for i in range(50)
+    ])
+    url = reverse('pointstransaction-list-list')
+    response = authenticated_api_client.get(url, HTTP_ACCEPT_ENCODING=accept_encoding)
+    assert response.status_code == status.HTTP_200_OK
+    assert response.get('Content-Encoding') == expected
+
+
+def test_dashboard_matches_individual_endpoints(authenticated_api_client, loyalty_account, loyalty_account_points):
+    program = loyalty_account.program
+    program.custom_rate = Decimal('28.50')
+    program.save()
+    PointsTransaction.objects.create(
+        transaction_type=4, amount=Decimal('1000.00'), cost=Decimal('30.00'),
+        origin_account=loyalty_account, transaction_date=timezone.now()
+    )
+
+    response = authenticated_api_client.get(reverse('dashboard'))
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['wallets'] == authenticated_api_client.get(reverse('userwallet-list')).data
+    assert response.data['loyalty_accounts'] == authenticated_api_client.get(reverse('loyaltyaccount-list-list')).data
+    assert response.data['loyalty_programs'] == authenticated_api_client.get(reverse('loyaltyprogram-list')).data
+    summary = authenticated_api_client.get(reverse('summary-overall')).data
+    assert response.data['summary'] == summary
+    assert summary['overall_estimated_value'] == Decimal('285.00')
+    assert summary['total_points_milhas_sold'] == Decimal('1000.00')
+    assert summary['total_revenue_from_sales'] == Decimal('30.00')
+
+def test_dashboard_uses_fixed_number_of_queries(authenticated_api_client, user_wallet, default_program, django_assert_num_queries):
+    for i in range(5):
+        LoyaltyAccount.objects.create(
+            wallet=user_wallet, program=default_program, name=f"Conta {i}",
+            current_balance=Decimal('1000.00'), last_updated=timezone.now()
+        )
+    # usuário do JWT + carteiras + contas + programas + totais de transações + totais arquivados
+    with django_assert_num_queries(6):
+        response = authenticated_api_client.get(reverse('dashboard'))
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data['loyalty_accounts']) == 5
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    import threading
+    import time
+    from .singleflight import SingleFlight
+
+    flight = SingleFlight(backend='local')
+    release, calls, results = threading.Event(), [], []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {"total": len(calls)}
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do('summary:1', compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    # As outras quatro chegam enquanto o primeiro cálculo está em andamento.
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert calls == [1]
+    assert results == [{"total": 1}] * 5
+    # Terminado o cálculo, a próxima chamada calcula de novo.
+    assert flight.do('summary:1', compute) == {"total": 2}
+
+    def fail():
+        raise ValueError("falhou")
+    with pytest.raises(ValueError):
+        flight.do('summary:1', fail)
+    assert not flight._calls
+
+
+def test_single_flight_shares_result_across_workers(settings):
+    import threading
+    from django.core.cache import cache
+    from .singleflight import SingleFlight
+
+    settings.SINGLEFLIGHT_WAIT_TIMEOUT = 5
+    cache.clear()
+    # Duas instâncias simulam dois workers coordenados pelo lock no cache.
+    leader, follower = SingleFlight(backend='cache'), SingleFlight(backend='cache')
+    started, release, calls, results = threading.Event(), threading.Event(), [], {}
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return len(calls)
+
+    first = threading.Thread(target=lambda: results.setdefault('leader', leader.do('dashboard:1', compute)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.setdefault('follower', follower.do('dashboard:1', compute)))
+    second.start()
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert calls == [1]
+    assert results == {'leader': 1, 'follower': 1}
+
+
+def test_throttle_charges_endpoint_cost_and_sends_headers(authenticated_api_client, settings):
+    settings.THROTTLE_BURST = 25
+    settings.THROTTLE_REFILL_PER_SECOND = 0.001
+    response = authenticated_api_client.get(reverse('userwallet-list'))
+    assert response['RateLimit-Limit'] == '25'
+    assert response['RateLimit-Remaining'] == '24'
+    assert response['RateLimit-Policy'] == '25;w=25000'
+
+    # Resumo custa 10: 24 -> 14 -> 4 e o terceiro é recusado sem tocar no banco.
+    assert authenticated_api_client.get(reverse('summary-overall'))['RateLimit-Remaining'] == '14'
+    assert authenticated_api_client.get(reverse('summary-overall'))['RateLimit-Remaining'] == '4'
+    response = authenticated_api_client.get(reverse('summary-overall'))
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response['Retry-After']) > 0
+    # Rotas baratas continuam passando com o que sobrou.
+    assert authenticated_api_client.get(reverse('userwallet-list')).status_code == status.HTTP_200_OK
+
+def test_throttle_charges_nested_routes_like_top_level(authenticated_api_client, loyalty_account, settings):
+    settings.THROTTLE_BURST = 100
+    settings.THROTTLE_REFILL_PER_SECOND = 0.001
+    month = _closed_month().strftime('%Y-%m')
+    top = reverse('loyaltyaccount-list-statement', kwargs={'pk': loyalty_account.pk})
+    nested = reverse('wallet-loyaltyaccount-statement', kwargs={'wallet_pk': loyalty_account.wallet_id, 'pk': loyalty_account.pk})
+    response = authenticated_api_client.get(top, {'month': month})
+    assert response['RateLimit-Remaining'] == '80'
+    response = authenticated_api_client.get(nested, {'month': month})
+    assert response.status_code == status.HTTP_200_OK
+    assert response['RateLimit-Remaining'] == '60'
+
+
+def test_sync_full_then_incremental(authenticated_api_client, user_wallet, loyalty_account, loyalty_account_points):
+    url = reverse('sync')
+    full = authenticated_api_client.get(url)
+    assert full.status_code == status.HTTP_200_OK
+    assert [w['id'] for w in full.data['wallets']] == [user_wallet.pk]
+    assert len(full.data['loyalty_accounts']) == 2
+
+    data = {
+        "transaction_type": 1,
+        "destination_account": loyalty_account.pk,
+        "amount": "1000.00",
+        "transaction_date": timezone.now()
+    }
+    created = create_transaction_via_api(authenticated_api_client, data)
+    incremental = authenticated_api_client.get(url, {'since': full.data['token']})
+    assert incremental.status_code == status.HTTP_200_OK
+    assert incremental.data['wallets'] == []
+    assert [t['id'] for t in incremental.data['transactions']] == [created.data['id']]
+    assert [a['id'] for a in incremental.data['loyalty_accounts']] == [loyalty_account.pk]
+    assert incremental.data['loyalty_accounts'][0]['current_balance'] == '11000.00'
+
+    unchanged = authenticated_api_client.get(url, {'since': incremental.data['token']})
+    assert unchanged.data['transactions'] == []
+    assert unchanged.data['loyalty_accounts'] == []
+
+def test_sync_reports_deleted_transaction(authenticated_api_client, loyalty_account):
+    transaction = PointsTransaction.objects.create(
+        transaction_type=4, amount=Decimal('100.00'), origin_account=loyalty_account, transaction_date=timezone.now()
+    )
+    token = authenticated_api_client.get(reverse('sync')).data['token']
+    authenticated_api_client.delete(reverse('pointstransaction-list-detail', kwargs={'pk': transaction.pk}))
+    response = authenticated_api_client.get(reverse('sync'), {'since': token})
+    assert response.data['deleted']['transactions'] == [transaction.pk]
+    assert [a['id'] for a in response.data['loyalty_accounts']] == [loyalty_account.pk]
+
+def test_sync_reports_wallet_cascade(authenticated_api_client, user_wallet, loyalty_account, loyalty_account_points):
+    transfer = PointsTransaction.objects.create(
+        transaction_type=2, amount=Decimal('100.00'), origin_account=loyalty_account,
+        destination_account=loyalty_account_points, transaction_date=timezone.now()
+    )
+    token = authenticated_api_client.get(reverse('sync')).data['token']
+    response = authenticated_api_client.delete(reverse('userwallet-detail', kwargs={'pk': user_wallet.pk}))
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = authenticated_api_client.get(reverse('sync'), {'since': token})
+    assert response.data['deleted']['wallets'] == [user_wallet.pk]
+    assert sorted(response.data['deleted']['loyalty_accounts']) == sorted([loyalty_account.pk, loyalty_account_points.pk])
+    assert response.data['deleted']['transactions'] == [transfer.pk]
+
+def test_sync_counters_are_per_user_above_legacy_floor(authenticated_api_client, authenticated_api_client_other, loyalty_account):
+    from django.test.utils import CaptureQueriesContext
+    from .models import SyncCounter
+
+    # Contador global de antes da migração: tokens antigos continuam valendo.
+    SyncCounter.objects.update_or_create(user=None, defaults={'value': 500})
+    assert not SyncCounter.objects.filter(user=authenticated_api_client_other.user).exists()
+    user, other = authenticated_api_client.user, authenticated_api_client_other.user
+    token = int(authenticated_api_client.get(reverse('sync')).data['token'])
+
+    with CaptureQueriesContext(connection) as ctx:
+        loyalty_account.name = "Renomeada"
+        loyalty_account.save()
+    # Dono resolvido dentro do próprio UPDATE do contador.
+    assert sum('api_synccounter' in q['sql'] for q in ctx.captured_queries) == 2
+    assert loyalty_account.change_seq == token + 1
+    # Primeiro contador do outro usuário parte do piso.
+    UserWallet.objects.create(user=other, wallet_name="Outra")
+
+    assert SyncCounter.current_value(user.pk) == loyalty_account.change_seq
+    assert SyncCounter.current_value(other.pk) == 501
+    response = authenticated_api_client.get(reverse('sync'), {'since': token})
+    assert [a['id'] for a in response.data['loyalty_accounts']] == [loyalty_account.pk]
+
+def test_sync_queries_start_from_the_owner_indexes(authenticated_api_client, authenticated_api_client_other, loyalty_account, default_program):
+    from django.test.utils import CaptureQueriesContext
+
+    other_wallet = UserWallet.objects.create(user=authenticated_api_client_other.user, wallet_name="Outra")
+    other_account = LoyaltyAccount.objects.create(
+        wallet=other_wallet, program=default_program, name="Outra", last_updated=timezone.now()
+    )
+    # Mesmas sequências nos dois usuários: só as do dono podem voltar.
+    for account in (loyalty_account, other_account):
+        PointsTransaction.objects.create(
+            transaction_type=1, amount=Decimal('10.00'), destination_account=account, transaction_date=timezone.now()
+        )
+    with CaptureQueriesContext(connection) as ctx:
+        response = authenticated_api_client.get(reverse('sync'), {'since': 0})
+    assert [t['destination_account'] for t in response.data['transactions']] == [loyalty_account.pk]
+    assert [a['id'] for a in response.data['loyalty_accounts']] == [loyalty_account.pk]
+
+    sql = next(q['sql'] for q in ctx.captured_queries if 'UNION' in q['sql'])
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+    assert 'api_tx_origin_seq_idx' in plan and 'api_tx_dest_seq_idx' in plan
+
+def test_sync_rejects_invalid_token(authenticated_api_client):
+    response = authenticated_api_client.get(reverse('sync'), {'since': 'abc'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.fixture
+def filter_transactions(loyalty_account, loyalty_account_points):
+    def _tx(ttype, amount, date, cost=None, origin=None, dest=None, description=''):
+        return PointsTransaction.objects.create(
+            transaction_type=ttype, amount=Decimal(amount), cost=cost, origin_account=origin,
+            destination_account=dest, transaction_date=date, description=description
+        )
+    tz = timezone.get_current_timezone()
+    return {
+        'sale_2024': _tx(4, '20000.00', timezone.datetime(2024, 6, 1, tzinfo=tz), cost=Decimal('400.00'), origin=loyalty_account),
+        'sale_2025': _tx(4, '10000.00', timezone.datetime(2025, 3, 1, tzinfo=tz), cost=Decimal('250.00'), origin=loyalty_account),
+        'big_transfer': _tx(2, '60000.00', timezone.datetime(2025, 5, 1, tzinfo=tz), origin=loyalty_account, dest=loyalty_account_points),
+        'inclusion': _tx(1, '1000.00', timezone.datetime(2025, 7, 1, tzinfo=tz), dest=loyalty_account_points),
+    }
+
+@pytest.mark.parametrize('params, expected', [
+    ({'transaction_type': '4', 'date_after': '2025-01-01T00:00:00', 'date_before': '2025-12-31T23:59:59'}, ['sale_2025']),
+    ({'transaction_type': '2', 'amount_min': '50000'}, ['big_transfer']),
+    ({'transaction_type': '1,2'}, ['inclusion', 'big_transfer']),
+    ({'cost_min': '300'}, ['sale_2024']),
+])
+def test_transaction_list_filters(authenticated_api_client, filter_transactions, params, expected):
+    response = authenticated_api_client.get(reverse('pointstransaction-list-list'), params)
+    assert response.status_code == status.HTTP_200_OK
+    assert [t['id'] for t in response.data] == [filter_transactions[name].pk for name in expected]
+
+def test_transaction_list_filter_by_account_and_program(authenticated_api_client, filter_transactions, loyalty_account, loyalty_account_points):
+    url = reverse('pointstransaction-list-list')
+    by_account = authenticated_api_client.get(url, {'account': loyalty_account_points.pk})
+    assert {t['id'] for t in by_account.data} == {filter_transactions['big_transfer'].pk, filter_transactions['inclusion'].pk}
+    by_destination = authenticated_api_client.get(url, {'destination_account': loyalty_account_points.pk, 'transaction_type': '1'})
+    assert [t['id'] for t in by_destination.data] == [filter_transactions['inclusion'].pk]
+    by_program = authenticated_api_client.get(url, {'program': loyalty_account_points.program_id})
+    assert {t['id'] for t in by_program.data} == {filter_transactions['big_transfer'].pk, filter_transactions['inclusion'].pk}
+    both = authenticated_api_client.get(url, {'account': loyalty_account.pk, 'program': loyalty_account_points.program_id})
+    assert [t['id'] for t in both.data] == [filter_transactions['big_transfer'].pk]
+
+def test_transaction_list_filter_validation(authenticated_api_client):
+    response = authenticated_api_client.get(reverse('pointstransaction-list-list'), {'transaction_type': '9'})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert 'transaction_type' in response.data
+
+@pytest.mark.parametrize('params', [
+    {'transaction_type': '4', 'date_after': '2025-01-01T00:00:00'},
+    {'account': '1', 'transaction_type': '2', 'date_after': '2025-01-01T00:00:00', 'date_before': '2025-12-31T00:00:00'},
+    {'origin_account': '1', 'transaction_type': '4'},
+    {'transaction_type': '2', 'amount_min': '50000'},
+])
+def test_transaction_filters_use_index(authenticated_api_client, params):
+    from django.db import connection
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from .views import PointsTransactionViewSet
+
+    view = PointsTransactionViewSet()
+    django_request = APIRequestFactory().get('/api/transactions/', params)
+    force_authenticate(django_request, user=authenticated_api_client.user)
+    view.request = Request(django_request)
+    view.request.user = authenticated_api_client.user
+    view.kwargs, view.format_kwarg, view.action = {}, None, 'list'
+    queryset = view.filter_queryset(view.get_queryset())
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+        plan = queryset.explain()
+        assert 'Seq Scan on api_pointstransaction' not in plan
+        assert 'api_tx_' in plan
+    else:
+        plan = queryset.explain()
+        assert 'SCAN api_pointstransaction' not in plan
+        assert 'SEARCH api_pointstransaction USING INDEX api_tx_' in plan
+
+
+def test_search_transactions_ranked_and_accent_insensitive(authenticated_api_client, loyalty_account, loyalty_account_points):
+    def _inclusion(description, account=loyalty_account):
+        return PointsTransaction.objects.create(
+            transaction_type=1, amount=Decimal('100.00'), destination_account=account,
+            description=description, transaction_date=timezone.now()
+        )
+    black_friday = _inclusion("Compra Black Friday no cartão")
+    cartao = _inclusion("Bônus do cartão de crédito", loyalty_account_points)
+    _inclusion("Transferência mensal")
+
+    response = authenticated_api_client.get(reverse('search'), {'q': 'black fri', 'scope': 'transactions'})
+    assert response.status_code == status.HTTP_200_OK
+    assert [t['id'] for t in response.data['transactions']['results']] == [black_friday.pk]
+    assert 'accounts' not in response.data
+
+    response = authenticated_api_client.get(reverse('search'), {'q': 'cartao', 'scope': 'transactions'})
+    assert {t['id'] for t in response.data['transactions']['results']} == {black_friday.pk, cartao.pk}
+
+def test_search_is_scoped_to_user_and_paginated(authenticated_api_client, authenticated_api_client_other, loyalty_account):
+    for i in range(3):
+        PointsTransaction.objects.create(
+            transaction_type=1, amount=Decimal('100.00'), destination_account=loyalty_account,
+            description=f"Promoção Black Friday {i}", transaction_date=timezone.now()
+        )
+    first_page = authenticated_api_client.get(reverse('search'), {'q': 'black', 'scope': 'transactions', 'page_size': 2})
+    assert len(first_page.data['transactions']['results']) == 2
+    assert first_page.data['transactions']['has_more'] is True
+    second_page = authenticated_api_client.get(reverse('search'), {'q': 'black', 'scope': 'transactions', 'page_size': 2, 'page': 2})
+    assert len(second_page.data['transactions']['results']) == 1
+    assert second_page.data['transactions']['has_more'] is False
+
+    other = authenticated_api_client_other.get(reverse('search'), {'q': 'black'})
+    assert other.data['transactions']['results'] == []
+
+def test_search_accounts_by_name_and_number(authenticated_api_client, loyalty_account, loyalty_account_points):
+    response = authenticated_api_client.get(reverse('search'), {'q': '67890', 'scope': 'accounts'})
+    assert [a['id'] for a in response.data['accounts']['results']] == [loyalty_account_points.pk]
+    response = authenticated_api_client.get(reverse('search'), {'q': 'milhas padrao', 'scope': 'accounts'})
+    assert [a['id'] for a in response.data['accounts']['results']] == [loyalty_account.pk]
+
+def test_search_requires_query(authenticated_api_client):
+    response = authenticated_api_client.get(reverse('search'), {'q': ' '})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_search_filter_on_postgresql_keeps_column_indexable(settings):
+    # Os índices trigram são sobre api_unaccent(col): nada de UPPER(col::text).
+    from django.db.backends.postgresql.base import DatabaseWrapper
+    from .search import _contains, ensure_search_indexes
+
+    postgres = DatabaseWrapper({**settings.DATABASES['default'], 'ENGINE': 'django.db.backends.postgresql'}, alias='pg')
+    queryset = PointsTransaction.objects.filter(**{_contains(postgres, 'description'): '50%_off'})
+    sql, params = queryset.query.get_compiler(connection=postgres).as_sql()
+    assert 'api_unaccent("api_pointstransaction"."description") ILIKE api_unaccent(%s)' in sql
+    assert 'UPPER' not in sql
+    assert params == ('%50\\%\\_off%',)
+
+    # A expressão do filtro é a mesma dos índices, e criá-los não exige CREATE EXTENSION.
+    class RecordingCursor:
+        statements = []
+        def __enter__(self): return self
+        def __exit__(self, *exc): pass
+        def execute(self, sql, params=None): self.statements.append(sql)
+    postgres.cursor = RecordingCursor
+    ensure_search_indexes(postgres)
+    assert any('USING gin (api_unaccent(description) gin_trgm_ops)' in sql for sql in RecordingCursor.statements)
+    assert not any('EXTENSION' in sql for sql in RecordingCursor.statements)
+
+def test_query_sampler_records_tagged_timings_and_explain(authenticated_api_client, loyalty_account, tmp_path, settings):
+    import io
+    import json
+    from django.core.management import call_command
+
+    log_file = tmp_path / 'queries.log'
+    settings.QUERY_SAMPLER_ENABLED = True
+    settings.QUERY_SAMPLER_THRESHOLD_MS = 0
+    settings.QUERY_SAMPLER_LOG_FILE = str(log_file)
+
+    response = authenticated_api_client.get(reverse('summary-overall'))
+    assert response.status_code == status.HTTP_200_OK
+    response = authenticated_api_client.get(reverse('pointstransaction-list-list'))
+    assert response.status_code == status.HTTP_200_OK
+
+    records = [json.loads(line) for line in log_file.read_text().splitlines()]
+    views = {record['view'] for record in records}
+    assert {'SummaryAPIView.get', 'PointsTransactionViewSet.list'} <= views
+    samples = [record for record in records if record['kind'] == 'sample' and record['sql'].startswith('SELECT')]
+    assert samples and all(sample['explain'] for sample in samples)
+
+    out = io.StringIO()
+    call_command('query_report', log_file=str(log_file), view='SummaryAPIView.get', stdout=out)
+    report = out.getvalue()
+    assert report.startswith('  1. ')
+    assert 'SummaryAPIView.get' in report
+
+def test_query_fingerprint_normalizes_in_lists():
+    from .instrumentation import fingerprint
+
+    first, _ = fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s) AND x = 10')
+    second, normalized = fingerprint('SELECT * FROM t WHERE id IN (%s)  AND x = 20')
+    assert first == second
+    assert normalized == 'SELECT * FROM t WHERE id IN (...) AND x = ?'
+
+def test_summary_totals_respect_period(authenticated_api_client, loyalty_account):
+    old_sale = timezone.now() - timedelta(days=400)
+    PointsTransaction.objects.create(
+        transaction_type=4, amount=Decimal('1000.00'), cost=Decimal('30.00'),
+        origin_account=loyalty_account, transaction_date=old_sale,
+    )
+    PointsTransaction.objects.create(
+        transaction_type=4, amount=Decimal('2000.00'), cost=Decimal('50.00'),
+        origin_account=loyalty_account, transaction_date=timezone.now(),
+    )
+    url = reverse('summary-overall')
+
+    response = authenticated_api_client.get(url)
+    assert response.data['total_points_milhas_sold'] == Decimal('3000.00')
+
+    since = (timezone.now() - timedelta(days=30)).isoformat()
+    response = authenticated_api_client.get(url, {'date_after': since})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['total_points_milhas_sold'] == Decimal('2000.00')
+    assert response.data['total_revenue_from_sales'] == Decimal('50.00')
+
+    response = authenticated_api_client.get(url, {'date_after': since, 'date_before': old_sale.isoformat()})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_partition_month_helpers():
+    from datetime import datetime, timezone as dt_timezone
+    from .partitioning import add_months, month_range, partition_name
+
+    start = datetime(2025, 11, 20, 15, 0, tzinfo=dt_timezone.utc)
+    months = list(month_range(start, add_months(start, 3)))
+    assert [partition_name(month) for month in months] == [
+        'api_pointstransaction_y2025m11', 'api_pointstransaction_y2025m12',
+        'api_pointstransaction_y2026m01', 'api_pointstransaction_y2026m02',
+    ]
+    assert months[2] == datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+def test_create_partitions_is_noop_without_partitioning():
+    from .partitioning import create_partitions, is_partitioned
+
+    if connection.vendor == 'postgresql':
+        pytest.skip("no PostgreSQL a tabela é particionada pela migration")
+    assert not is_partitioned(connection)
+    assert create_partitions(connection) == []
+
+@pytest.mark.skipif(connection.vendor != 'postgresql', reason="particionamento só existe no PostgreSQL")
+def test_postgres_partitions_prune_and_absorb_default_rows(loyalty_account):
+    from datetime import datetime, timezone as dt_timezone
+    from .partitioning import add_months, create_partitions, is_partitioned, list_partitions, month_start, partition_name
+
+    assert is_partitioned(connection)
+    # Uma data além das partições existentes cai na partição default...
+    future = add_months(month_start(timezone.now()), 12) + timedelta(days=3)
+    transaction = PointsTransaction.objects.create(
+        transaction_type=1, amount=Decimal('10.00'), destination_account=loyalty_account, transaction_date=future,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM api_pointstransaction_default")
+        assert cursor.fetchone()[0] == 1
+
+    # ...e é movida quando a partição do mês é criada.
+    created = create_partitions(connection, months_ahead=12)
+    assert partition_name(month_start(future)) in created
+    assert partition_name(month_start(future)) in list_partitions(connection)
+    assert PointsTransaction.objects.get(pk=transaction.pk).amount == Decimal('10.00')
+
+    window = PointsTransaction.objects.filter(
+        transaction_date__gte=month_start(future), transaction_date__lt=add_months(month_start(future), 1)
+    )
+    plan = window.explain()
+    assert partition_name(month_start(future)) in plan
+    assert partition_name(datetime(*timezone.now().timetuple()[:2], 1, tzinfo=dt_timezone.utc)) not in plan
+
+
+def test_archive_moves_old_transactions_with_transparent_read_through(authenticated_api_client, loyalty_account, settings, tmp_path, django_capture_on_commit_callbacks):
+    from django.core.management import call_command
+    from .models import ArchiveCheckpoint, ArchivedMonth, SyncTombstone
+
+    settings.ARCHIVE_ROOT = str(tmp_path)
+    now = timezone.now()
+    for data in (
+        {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "1000.00", "cost": "20.00",
+         "transaction_date": now - timedelta(days=700)},
+        {"transaction_type": 4, "origin_account": loyalty_account.pk, "amount": "500.00", "cost": "15.00",
+         "transaction_date": now - timedelta(days=650)},
+        {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "200.00", "cost": "0.00",
+         "transaction_date": now - timedelta(days=5)},
+    ):
+        assert create_transaction_via_api(authenticated_api_client, data).status_code == status.HTTP_201_CREATED
+
+    list_url = reverse('pointstransaction-list-list')
+    nested_url = reverse('account-transaction-list', kwargs={'account_pk': loyalty_account.pk})
+    old_period = {'date_before': (now - timedelta(days=600)).isoformat()}
+    before = {
+        'list': authenticated_api_client.get(list_url).data,
+        'nested': authenticated_api_client.get(nested_url).data,
+        'sales': authenticated_api_client.get(list_url, {'transaction_type': '4'}).data,
+        'summary': authenticated_api_client.get(reverse('summary-overall')).data,
+        'old_summary': authenticated_api_client.get(reverse('summary-overall'), old_period).data,
+    }
+
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command('archive_transactions', older_than_days=365, stdout=io.StringIO())
+
+    assert PointsTransaction.objects.count() == 1
+    assert not SyncTombstone.objects.exists()
+    months = ArchivedMonth.objects.filter(user=authenticated_api_client.user)
+    assert sum(month.row_count for month in months) == 2
+    assert all((tmp_path / month.path).exists() for month in months)
+
+    loyalty_account.refresh_from_db()
+    checkpoint = ArchiveCheckpoint.objects.get(account=loyalty_account)
+    assert checkpoint.opening_balance == loyalty_account.current_balance - Decimal('200.00')
+    assert checkpoint.archived_count == 2
+    assert checkpoint.points_sold == Decimal('500.00')
+
+    assert authenticated_api_client.get(list_url).data == before['list']
+    assert authenticated_api_client.get(nested_url).data == before['nested']
+    assert authenticated_api_client.get(list_url, {'transaction_type': '4'}).data == before['sales']
+    assert authenticated_api_client.get(reverse('summary-overall')).data == before['summary']
+    assert authenticated_api_client.get(reverse('summary-overall'), old_period).data == before['old_summary']
+    recent = authenticated_api_client.get(list_url, {'date_after': (now - timedelta(days=30)).isoformat()}).data
+    assert [tx['amount'] for tx in recent] == ['200.00']
+
+    # Rodar de novo não encontra nada para arquivar e não duplica linhas.
+    call_command('archive_transactions', older_than_days=365, stdout=io.StringIO())
+    assert len(authenticated_api_client.get(list_url).data) == 3
+
+
+def test_archive_merge_pages_hot_rows_in_sql(authenticated_api_client, loyalty_account, settings, tmp_path, django_capture_on_commit_callbacks):
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from .archive import MergedTransactions, archived_transactions
+
+    settings.ARCHIVE_ROOT = str(tmp_path)
+    now = timezone.now()
+    PointsTransaction.objects.create(
+        transaction_type=1, amount=Decimal('1.00'), destination_account=loyalty_account, transaction_date=now - timedelta(days=700)
+    )
+    for day in range(30):
+        PointsTransaction.objects.create(
+            transaction_type=1, amount=Decimal('10.00'), destination_account=loyalty_account, transaction_date=now - timedelta(days=day)
+        )
+    with django_capture_on_commit_callbacks(execute=True):
+        call_command('archive_transactions', older_than_days=365, stdout=io.StringIO())
+
+    url = reverse('pointstransaction-list-list')
+    with CaptureQueriesContext(connection) as plain:
+        full = authenticated_api_client.get(url).data
+    with CaptureQueriesContext(connection) as sparse:
+        response = authenticated_api_client.get(url, {'fields': 'id,amount'})
+    assert [row['id'] for row in response.data] == [row['id'] for row in full]
+    assert response.data[-1]['amount'] == '1.00'
+    # As colunas de ordenação continuam no only(): nada de uma query por linha.
+    assert len(sparse.captured_queries) <= len(plain.captured_queries)
+
+    queryset = PointsTransaction.objects.filter(destination_account=loyalty_account).order_by('-transaction_date', '-created_at')
+    merged = MergedTransactions(queryset, archived_transactions(authenticated_api_client.user, {}))
+    assert merged.count() == 31
+    with CaptureQueriesContext(connection) as page:
+        first_page = merged[0:10]
+    assert [tx.pk for tx in first_page] == [row['id'] for row in full[:10]]
+    assert 'LIMIT 10' in page.captured_queries[0]['sql']
+    assert [tx.amount for tx in merged[29:31]] == [Decimal('10.00'), Decimal('1.00')]
+
+def _balances(account):
+    rows = PointsTransaction.objects.filter(
+        Q(origin_account=account) | Q(destination_account=account)
+    ).order_by('transaction_date', 'id')
+    return [
+        tx.origin_balance_after if tx.origin_account_id == account.pk else tx.destination_balance_after
+        for tx in rows
+    ]
+
+def test_running_balances_are_rederived_incrementally(authenticated_api_client, loyalty_account):
+    now = timezone.now()
+    created = []
+    for days_ago, data in (
+        (30, {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "1000.00", "cost": "20.00"}),
+        (20, {"transaction_type": 4, "origin_account": loyalty_account.pk, "amount": "3000.00", "cost": "75.00"}),
+        (10, {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "500.00", "cost": "0.00"}),
+    ):
+        response = create_transaction_via_api(authenticated_api_client, {**data, "transaction_date": now - timedelta(days=days_ago)})
+        assert response.status_code == status.HTTP_201_CREATED
+        created.append(response.data)
+
+    assert created[0]['destination_balance_after'] == '11000.00'
+    assert created[0]['destination_average_cost_after'] == '22.73'
+    assert _balances(loyalty_account) == [Decimal('11000.00'), Decimal('8000.00'), Decimal('8500.00')]
+
+    # Transação retroativa entre a 1ª e a 2ª: só as posteriores são regravadas.
+    first_seq = PointsTransaction.objects.get(pk=created[0]['id']).change_seq
+    response = create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 3, "origin_account": loyalty_account.pk, "amount": "200.00",
+        "transaction_date": now - timedelta(days=25),
+    })
+    assert response.status_code == status.HTTP_201_CREATED
+    backdated_id = response.data['id']
+    assert response.data['origin_balance_after'] == '10800.00'
+    assert PointsTransaction.objects.get(pk=created[0]['id']).change_seq == first_seq
+    assert _balances(loyalty_account) == [Decimal('11000.00'), Decimal('10800.00'), Decimal('7800.00'), Decimal('8300.00')]
+
+    # Edição da primeira e remoção da retroativa.
+    url = reverse('pointstransaction-list-detail', kwargs={'pk': created[0]['id']})
+    response = authenticated_api_client.put(url, {
+        "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "2000.00", "cost": "20.00",
+        "transaction_date": (now - timedelta(days=30)).isoformat(),
+    }, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data['destination_balance_after'] == '12000.00'
+    response = authenticated_api_client.delete(reverse('pointstransaction-list-detail', kwargs={'pk': backdated_id}))
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    assert _balances(loyalty_account) == [Decimal('12000.00'), Decimal('9000.00'), Decimal('9500.00')]
+
+    loyalty_account.refresh_from_db()
+    assert _balances(loyalty_account)[-1] == loyalty_account.current_balance
+
+def test_backdated_credit_rewrites_account_average_cost(authenticated_api_client, loyalty_account, django_capture_on_commit_callbacks):
+    from .models import BalanceAuditLog
+
+    now = timezone.now()
+    for days_ago, amount, cost in ((1, "1000.00", "50.00"), (10, "2000.00", "10.00")):
+        with django_capture_on_commit_callbacks(execute=True):
+            response = create_transaction_via_api(authenticated_api_client, {
+                "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": amount, "cost": cost,
+                "transaction_date": now - timedelta(days=days_ago),
+            })
+        assert response.status_code == status.HTTP_201_CREATED
+
+    latest = PointsTransaction.objects.filter(destination_account=loyalty_account).order_by('-transaction_date').first()
+    loyalty_account.refresh_from_db()
+    # Na ordem de chegada daria 22.30; na ordem das datas, a da última transação.
+    assert latest.destination_average_cost_after == Decimal('22.31')
+    assert (loyalty_account.current_balance, loyalty_account.average_cost) == (Decimal('13000.00'), Decimal('22.31'))
+    assert BalanceAuditLog.objects.filter(account_id=loyalty_account.pk, operation='rederive_balances').exists()
+
+def test_running_balances_follow_transfer_cost(authenticated_api_client, loyalty_account, loyalty_account_points):
+    now = timezone.now()
+    response = create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 2, "origin_account": loyalty_account_points.pk, "destination_account": loyalty_account.pk,
+        "amount": "1000.00", "bonus_percentage": "100.00", "transaction_date": now - timedelta(days=5),
+    })
+    assert response.status_code == status.HTTP_201_CREATED
+    loyalty_account.refresh_from_db()
+    assert response.data['origin_balance_after'] == '4000.00'
+    assert Decimal(response.data['destination_balance_after']) == loyalty_account.current_balance
+    assert Decimal(response.data['destination_average_cost_after']) == loyalty_account.average_cost
+
+    # Um crédito retroativo na origem muda o custo médio dela e, por consequência, o custo do destino.
+    create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 1, "destination_account": loyalty_account_points.pk, "amount": "5000.00", "cost": "100.00",
+        "transaction_date": now - timedelta(days=6),
+    })
+    transfer = PointsTransaction.objects.get(pk=response.data['id'])
+    assert transfer.origin_average_cost_after == Decimal('15.00')
+    assert transfer.destination_average_cost_after == Decimal('20.42')
+
+def test_balance_at_endpoint(authenticated_api_client, loyalty_account):
+    now = timezone.now()
+    for days_ago, amount in ((20, "1000.00"), (10, "500.00")):
+        create_transaction_via_api(authenticated_api_client, {
+            "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": amount, "cost": "0.00",
+            "transaction_date": now - timedelta(days=days_ago),
+        })
+    url = reverse('loyaltyaccount-list-balance-at', kwargs={'pk': loyalty_account.pk})
+
+    def balance(days_ago):
+        response = authenticated_api_client.get(url, {'at': (now - timedelta(days=days_ago)).isoformat()})
+        assert response.status_code == status.HTTP_200_OK
+        return response.data['balance'], response.data['average_cost']
+
+    assert balance(30) == (Decimal('10000.00'), Decimal('23.00'))
+    assert balance(15) == (Decimal('11000.00'), Decimal('20.91'))
+    assert balance(0) == (Decimal('11500.00'), Decimal('20.00'))
+    assert authenticated_api_client.get(url).status_code == status.HTTP_400_BAD_REQUEST
+
+def _closed_month(months_ago=2):
+    today = timezone.now().date().replace(day=1)
+    for _ in range(months_ago):
+        today = (today - timedelta(days=1)).replace(day=1)
+    return today
+
+def test_statement_csv_has_opening_lines_and_closing(authenticated_api_client, loyalty_account):
+    month = _closed_month()
+    start = timezone.datetime(month.year, month.month, 1, tzinfo=timezone.get_fixed_timezone(0))
+    create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "1000.00", "cost": "20.00",
+        "transaction_date": start - timedelta(days=3), "description": "Antes do mês",
+    })
+    for day, data in (
+        (5, {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "500.00", "cost": "0.00", "description": "Bônus"}),
+        (12, {"transaction_type": 4, "origin_account": loyalty_account.pk, "amount": "2000.00", "cost": "40.00", "description": "Venda"}),
+    ):
+        create_transaction_via_api(authenticated_api_client, {**data, "transaction_date": start + timedelta(days=day)})
+
+    url = reverse('loyaltyaccount-list-statement', kwargs={'pk': loyalty_account.pk})
+    response = authenticated_api_client.get(url, {'month': month.strftime('%Y-%m')})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.streaming
+    assert response['Content-Disposition'] == f'attachment; filename="extrato-{loyalty_account.pk}-{month:%Y-%m}.csv"'
+    rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+    assert rows[0][0] == 'data'
+    assert rows[1][1:] == ['Saldo inicial', '', '', '', '11000.00', '22.73']
+    assert [row[2] for row in rows[2:-1]] == ['Bônus', 'Venda']
+    assert [row[4:6] for row in rows[2:-1]] == [['500.00', '11500.00'], ['-2000.00', '9500.00']]
+    assert rows[-1][1:] == ['Saldo final', '', '', '', '9500.00', '21.74']
+
+    assert authenticated_api_client.get(url).status_code == status.HTTP_400_BAD_REQUEST
+    assert authenticated_api_client.get(url, {'month': '2025-13'}).status_code == status.HTTP_400_BAD_REQUEST
+
+def test_statement_keeps_stored_zero_average_cost(authenticated_api_client, user_wallet, default_program):
+    from .statements import Statement
+
+    account = LoyaltyAccount.objects.create(
+        wallet=user_wallet, program=default_program, name="Conta Zerada", current_balance=Decimal('0.00'),
+        average_cost=Decimal('0.00'), last_updated=timezone.now()
+    )
+    month = _closed_month()
+    start = timezone.datetime(month.year, month.month, 1, tzinfo=timezone.get_fixed_timezone(0))
+    for day, data in (
+        (2, {"transaction_type": 1, "destination_account": account.pk, "amount": "1000.00", "cost": "30.00"}),
+        (3, {"transaction_type": 3, "origin_account": account.pk, "amount": "1000.00"}),
+        (4, {"transaction_type": 1, "destination_account": account.pk, "amount": "500.00", "cost": "0.00"}),
+    ):
+        create_transaction_via_api(authenticated_api_client, {**data, "transaction_date": start + timedelta(days=day)})
+
+    lines = list(Statement(account, month).lines())
+    # Saldo zerado e crédito sem custo: custo médio real de 0,00, não o da linha anterior.
+    assert [line['average_cost'] for line in lines] == [Decimal('30.00'), Decimal('30.00'), Decimal('0.00')]
+
+def test_statement_pdf_is_cached_for_closed_months(authenticated_api_client, loyalty_account):
+    month = _closed_month()
+    start = timezone.datetime(month.year, month.month, 1, tzinfo=timezone.get_fixed_timezone(0))
+    create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "1000.00", "cost": "20.00",
+        "transaction_date": start + timedelta(days=2), "description": "Compra (promo)",
+    })
+    url = reverse('loyaltyaccount-list-statement', kwargs={'pk': loyalty_account.pk})
+    params = {'month': month.strftime('%Y-%m'), 'output': 'pdf'}
+
+    response = authenticated_api_client.get(url, params)
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Type'] == 'application/pdf'
+    pdf = b''.join(response.streaming_content)
+    assert pdf.startswith(b'%PDF-1.4') and pdf.rstrip().endswith(b'%%EOF')
+    assert b'Compra \\(promo\\)' in pdf
+
+    cached = authenticated_api_client.get(url, params)
+    assert not cached.streaming
+    assert cached.content == pdf
+    # Cache próprio e limitado, fora do cache padrão em memória.
+    from django.core.cache import cache, caches
+    from .statements import Statement
+    key = Statement(loyalty_account, month).cache_key('pdf')
+    assert caches['statements'].get(key) == pdf and cache.get(key) is None
+
+    # Um lançamento retroativo no mês muda a versão e invalida o cache.
+    create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 3, "origin_account": loyalty_account.pk, "amount": "100.00",
+        "transaction_date": start + timedelta(days=9),
+    })
+    assert authenticated_api_client.get(url, params).streaming
+
+def test_simulate_risk_is_reproducible_and_consistent(authenticated_api_client, loyalty_account, loyalty_account_points):
+    LoyaltyProgram.objects.filter(pk=loyalty_account.program_id).update(custom_rate=Decimal('20.00'))
+    LoyaltyProgram.objects.filter(pk=loyalty_account_points.program_id).update(custom_rate=Decimal('15.00'))
+    url = reverse('simulation-risk')
+    data = {"paths": 100000, "seed": 42, "overrides": [{"program_id": loyalty_account_points.program_id, "volatility": 0.5}]}
+
+    response = authenticated_api_client.post(url, data, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    assert authenticated_api_client.post(url, data, format='json').data == response.data
+    assert response.data['seed'] == 42
+
+    portfolio = response.data['portfolio']
+    assert portfolio['current_value'] == Decimal('275.00')
+    assert portfolio['cost_basis'] == Decimal('280.00')
+    percentiles = list(portfolio['percentiles'].values())
+    assert percentiles == sorted(percentiles)
+    assert Decimal('0') < portfolio['value_at_risk'] <= portfolio['expected_shortfall']
+    programs = {item['program_id']: item for item in response.data['programs']}
+    assert programs[loyalty_account.program_id]['current_value'] == Decimal('200.00')
+    assert programs[loyalty_account_points.program_id]['value_at_risk'] > programs[loyalty_account.program_id]['value_at_risk'] / 2
+
+    # Sem volatilidade, desvalorização ou expiração o valor não muda.
+    response = authenticated_api_client.post(url, {
+        "paths": 1000, "volatility": 0, "devaluation_probability": 0, "expiration_rate": 0,
+    }, format='json')
+    assert response.data['portfolio']['expected_value'] == Decimal('275.00')
+    assert response.data['portfolio']['value_at_risk'] == Decimal('0.00')
+
+def test_simulate_risk_validation(authenticated_api_client, settings):
+    settings.RISK_SIMULATION_MAX_PATHS = 1000
+    url = reverse('simulation-risk')
+    assert authenticated_api_client.post(url, {"paths": 5000}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+    assert authenticated_api_client.post(url, {"confidence": 1.5}, format='json').status_code == status.HTTP_400_BAD_REQUEST
+
+def test_simulate_allocate_fills_best_tiers_with_cheapest_miles(authenticated_api_client, loyalty_account, loyalty_account_points):
+    # loyalty_account_points: 5000 a 10,00; loyalty_account: 10000 a 23,00.
+    url = reverse('simulation-allocate')
+    response = authenticated_api_client.post(url, {
+        "target_amount": "12000.00",
+        "price_tiers": [
+            {"sale_price_per_1000_miles": "22.00"},
+            {"sale_price_per_1000_miles": "30.00", "max_amount": "6000.00"},
+        ],
+    }, format='json')
+    assert response.status_code == status.HTTP_200_OK
+    allocations = {item['loyalty_account_id']: item for item in response.data['allocations']}
+    # Milhas a 23,00 só entram na faixa de 30,00; vender a 22,00 daria prejuízo.
+    assert allocations[loyalty_account_points.pk]['amount'] == Decimal('5000.00')
+    assert allocations[loyalty_account.pk]['amount'] == Decimal('1000.00')
+    assert response.data['allocated_amount'] == Decimal('6000.00')
+    assert response.data['unallocated_amount'] == Decimal('6000.00')
+    assert response.data['estimated_profit'] == Decimal('107.00')
+    assert [tier['allocated_amount'] for tier in response.data['tiers']] == [Decimal('6000.00'), Decimal('0.00')]
+
+    response = authenticated_api_client.post(url, {
+        "target_amount": "12000.00",
+        "price_tiers": [{"sale_price_per_1000_miles": "30.00"}],
+        "program_limits": [{"program_id": loyalty_account_points.program_id, "max_amount": "2000.00"}],
+    }, format='json')
+    allocations = {item['loyalty_account_id']: item['amount'] for item in response.data['allocations']}
+    assert allocations == {loyalty_account_points.pk: Decimal('2000.00'), loyalty_account.pk: Decimal('10000.00')}
+
+    response = authenticated_api_client.post(url, {"target_amount": "100.00", "price_tiers": []}, format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+def test_expiration_forecast_and_batch_processing(authenticated_api_client, loyalty_account, loyalty_account_points):
+    from django.core.management import call_command
+    from .expiration import shift_months
+
+    now = timezone.now()
+    LoyaltyProgram.objects.filter(pk=loyalty_account.program_id).update(validity_months=12)
+    LoyaltyAccount.objects.filter(pk=loyalty_account.pk).update(created_at=shift_months(now, -18))
+    for months_ago, data in (
+        (14, {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "1000.00", "cost": "20.00"}),
+        (3, {"transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "2000.00", "cost": "40.00"}),
+        (2, {"transaction_type": 4, "origin_account": loyalty_account.pk, "amount": "500.00", "cost": "10.00"}),
+    ):
+        response = create_transaction_via_api(authenticated_api_client, {**data, "transaction_date": shift_months(now, -months_ago)})
+        assert response.status_code == status.HTTP_201_CREATED
+
+    url = reverse('loyaltyaccount-list-expirations')
+    response = authenticated_api_client.get(url, {'months': 12})
+    assert response.status_code == status.HTTP_200_OK
+    # Só a conta de programa com validade; saldo inicial e o crédito de 14 meses já venceram.
+    [forecast] = response.data['accounts']
+    assert forecast['loyalty_account_id'] == loyalty_account.pk
+    assert forecast['overdue_amount'] == Decimal('10500.00')
+    assert forecast['expiring'] == [{'month': f"{shift_months(now, 9):%Y-%m}", 'amount': Decimal('2000.00')}]
+    assert authenticated_api_client.get(url, {'months': 6}).data['totals'] == []
+
+    call_command('process_expirations', chunk_size=1, stdout=io.StringIO())
+    loyalty_account.refresh_from_db()
+    assert loyalty_account.current_balance == Decimal('2000.00')
+    expiration = PointsTransaction.objects.get(transaction_type=5, origin_account=loyalty_account)
+    assert expiration.amount == Decimal('10500.00')
+    assert expiration.origin_balance_after == Decimal('2000.00')
+    assert expiration.change_seq == loyalty_account.change_seq > 0
+
+    # Rodar de novo não expira nada: a expiração lançada já entra no saldo.
+    call_command('process_expirations', stdout=io.StringIO())
+    assert PointsTransaction.objects.filter(transaction_type=5).count() == 1
+    assert authenticated_api_client.get(url).data['accounts'][0]['overdue_amount'] == Decimal('0.00')
+
+def test_metrics_endpoint_reports_routes_and_business_counters(authenticated_api_client, loyalty_account, settings):
+    prometheus_client = pytest.importorskip('prometheus_client')
+    registry = prometheus_client.REGISTRY
+
+    def sample(name, **labels):
+        return registry.get_sample_value(name, labels) or 0
+
+    requests_before = sample('easymiles_http_requests_total', route='summary-overall', method='GET', status='200')
+    queries_before = sample('easymiles_db_queries_per_request_count', route='summary-overall')
+    applied_before = sample('easymiles_transactions_applied_total', transaction_type='1')
+    sales_before = sample('easymiles_simulations_total', kind='sale')
+
+    assert authenticated_api_client.get(reverse('summary-overall')).status_code == status.HTTP_200_OK
+    create_transaction_via_api(authenticated_api_client, {
+        "transaction_type": 1, "destination_account": loyalty_account.pk, "amount": "100.00",
+        "transaction_date": timezone.now(),
+    })
+    authenticated_api_client.post(reverse('simulation-sale'), {
+        "loyalty_account_id": loyalty_account.pk, "amount_to_sell": "1000.00", "sale_price_per_1000_miles": "25.00",
+    }, format='json')
+
+    assert sample('easymiles_http_requests_total', route='summary-overall', method='GET', status='200') == requests_before + 1
+    assert sample('easymiles_db_queries_per_request_count', route='summary-overall') == queries_before + 1
+    assert sample('easymiles_db_queries_per_request_sum', route='summary-overall') > 0
+    assert sample('easymiles_transactions_applied_total', transaction_type='1') == applied_before + 1
+    assert sample('easymiles_simulations_total', kind='sale') == sales_before + 1
+
+    # Sem token, fechado fora do DEBUG.
+    assert not settings.DEBUG
+    assert APIClient().get(reverse('metrics')).status_code == 403
+    settings.DEBUG = True
+    response = APIClient().get(reverse('metrics'))
+    assert response.status_code == status.HTTP_200_OK
+    assert response['Content-Type'].startswith('text/plain')
+    assert b'easymiles_http_request_duration_seconds_bucket{le="0.005",method="GET",route="summary-overall"}' in response.content
+
+    settings.METRICS_TOKEN = 'segredo'
+    assert APIClient().get(reverse('metrics')).status_code == 401
+    assert APIClient().get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer segredo').status_code == 200
+
+def test_purge_wallet_detaches_history_in_chunks(authenticated_api_client, user_wallet, loyalty_account, default_program, settings, django_capture_on_commit_callbacks):
+    settings.DELETION_JOBS_ASYNC = False
+    settings.DELETION_CHUNK_SIZE = 2
+    other_wallet = UserWallet.objects.create(user=authenticated_api_client.user, wallet_name="Outra")
+    kept_account = LoyaltyAccount.objects.create(
+        wallet=other_wallet, program=default_program, name="Fica", current_balance=Decimal('0.00'), last_updated=timezone.now()
+    )
+    own = [
+        PointsTransaction.objects.create(
+            transaction_type=1, amount=Decimal('100.00'), destination_account=loyalty_account, transaction_date=timezone.now()
+        )
+        for _ in range(4)
+    ]
+    transfer = PointsTransaction.objects.create(
+        transaction_type=2, amount=Decimal('100.00'), origin_account=loyalty_account,
+        destination_account=kept_account, transaction_date=timezone.now()
+    )
+    token = authenticated_api_client.get(reverse('sync')).data['token']
+
+    with django_capture_on_commit_callbacks(execute=True):
+        response = authenticated_api_client.post(reverse('userwallet-purge', kwargs={'pk': user_wallet.pk}))
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    job = authenticated_api_client.get(response['Location']).data
+    assert (job['status'], job['total'], job['processed'], job['progress']) == ('done', 5, 5, 1.0)
+
+    assert not UserWallet.objects.filter(pk=user_wallet.pk).exists()
+    assert not LoyaltyAccount.objects.filter(pk=loyalty_account.pk).exists()
+    transfer.refresh_from_db()
+    assert transfer.origin_account_id is None and transfer.destination_account_id == kept_account.pk
+
+    response = authenticated_api_client.get(reverse('sync'), {'since': token})
+    assert response.data['deleted']['wallets'] == [user_wallet.pk]
+    assert response.data['deleted']['loyalty_accounts'] == [loyalty_account.pk]
+    assert sorted(response.data['deleted']['transactions']) == sorted(tx.pk for tx in own)
+    assert [tx['id'] for tx in response.data['transactions']] == [transfer.pk]
+
+def test_purge_hides_target_until_done(authenticated_api_client, user_wallet, loyalty_account, settings):
+    settings.DELETION_JOBS_ASYNC = False
+    # Sem executar os callbacks de commit, o job fica pendente.
+    response = authenticated_api_client.post(reverse('userwallet-purge', kwargs={'pk': user_wallet.pk}))
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response.data['status'] == 'pending'
+    again = authenticated_api_client.post(reverse('userwallet-purge', kwargs={'pk': user_wallet.pk}))
+    assert again.status_code == status.HTTP_404_NOT_FOUND
+    assert len(authenticated_api_client.get(reverse('userwallet-list')).data) == 0
+    assert authenticated_api_client.get(reverse('loyaltyaccount-list-detail', kwargs={'pk': loyalty_account.pk})).status_code == status.HTTP_404_NOT_FOUND
+    assert authenticated_api_client.get(reverse('summary-overall')).data['total_wallets'] == 0
+    dashboard = authenticated_api_client.get(reverse('dashboard')).data
+    assert (dashboard['wallets'], dashboard['summary']['total_wallets']) == ([], 0)
+
+def test_failed_purge_keeps_target_hidden_until_retried(authenticated_api_client, user_wallet, loyalty_account, settings, monkeypatch, django_capture_on_commit_callbacks):
+    from . import deletion
+
+    settings.DELETION_JOBS_ASYNC = False
+    def broken_chunk(*args, **kwargs):
+        raise RuntimeError('disco cheio')
+    monkeypatch.setattr(deletion, '_detach_chunk', broken_chunk)
+    with django_capture_on_commit_callbacks(execute=True):
+        job_id = authenticated_api_client.post(reverse('userwallet-purge', kwargs={'pk': user_wallet.pk})).data['id']
+    job_url = reverse('deletionjob-detail', kwargs={'pk': job_id})
+    assert authenticated_api_client.get(job_url).data['status'] == 'failed'
+
+    # Parte do histórico pode já ter sido desligada: carteira e contas seguem fora da API.
+    assert authenticated_api_client.get(reverse('userwallet-list')).data == []
+    assert authenticated_api_client.get(reverse('summary-overall')).data['total_wallets'] == 0
+    assert authenticated_api_client.get(reverse('dashboard')).data['loyalty_accounts'] == []
+
+    monkeypatch.undo()
+    with django_capture_on_commit_callbacks(execute=True):
+        response = authenticated_api_client.post(reverse('deletionjob-retry', kwargs={'pk': job_id}))
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert authenticated_api_client.get(job_url).data['status'] == 'done'
+    assert not UserWallet.objects.filter(pk=user_wallet.pk).exists()
+    assert authenticated_api_client.post(reverse('deletionjob-retry', kwargs={'pk': job_id})).status_code == status.HTTP_400_BAD_REQUEST
+
+def test_run_deletion_jobs_resumes_only_stale_running_jobs(authenticated_api_client, loyalty_account, settings):
+    from django.core.management import call_command
+    from .models import DeletionJob
+
+    settings.DELETION_JOB_STALE_SECONDS = 60
+    PointsTransaction.objects.create(
+        transaction_type=1, amount=Decimal('100.00'), destination_account=loyalty_account, transaction_date=timezone.now()
+    )
+    job = DeletionJob.objects.create(
+        user=authenticated_api_client.user, target_type=DeletionJob.TARGET_ACCOUNT, target_id=loyalty_account.pk,
+        status=DeletionJob.STATUS_RUNNING, owner='outro-executor', heartbeat_at=timezone.now(),
+    )
+    out = io.StringIO()
+    call_command('run_deletion_jobs', stdout=out)
+    assert 'ignorado' in out.getvalue()
+    job.refresh_from_db()
+    assert (job.status, job.owner, job.processed) == ('running', 'outro-executor', 0)
+
+    DeletionJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+    call_command('run_deletion_jobs', stdout=io.StringIO())
+    job.refresh_from_db()
+    assert (job.status, job.processed, job.total) == ('done', 1, 1)
+    assert job.owner != 'outro-executor'
+    assert not LoyaltyAccount.objects.filter(pk=loyalty_account.pk).exists()
+
+def test_admin_changelists_use_constant_queries(admin_client, loyalty_account, loyalty_account_points):
+    from django.test.utils import CaptureQueriesContext
+
+    def changelist_queries(url, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            response = admin_client.get(url, params)
+        assert response.status_code == 200
+        return len(ctx.captured_queries)
+
+    url = reverse('admin:api_pointstransaction_changelist')
+    for i in range(3):
+        PointsTransaction.objects.create(
+            transaction_type=2, amount=Decimal('10.00'), origin_account=loyalty_account,
+            destination_account=loyalty_account_points, transaction_date=timezone.now() - timedelta(days=40 * i),
+        )
+    few = changelist_queries(url)
+    PointsTransaction.objects.bulk_create([
+        PointsTransaction(
+            transaction_type=2, amount=Decimal('10.00'), origin_account=loyalty_account,
+            destination_account=loyalty_account_points, transaction_date=timezone.now() - timedelta(days=40 * i),
+        )
+        for i in range(30)
+    ])
+    assert changelist_queries(url) == few
+    assert changelist_queries(url, transaction_type__exact=2) == few
+
+    for name in ('loyaltyprogram', 'userwallet', 'loyaltyaccount'):
+        assert admin_client.get(reverse(f'admin:api_{name}_changelist')).status_code == 200
+
+    # Sem filtro lateral por programa: a página não cresce com a tabela de programas.
+    url = reverse('admin:api_loyaltyaccount_changelist')
+    few = changelist_queries(url)
+    LoyaltyProgram.objects.bulk_create([LoyaltyProgram(name=f'Programa {i}', currency_type=1) for i in range(50)])
+    response = admin_client.get(url, {'q': loyalty_account.program.name})
+    assert 'Programa 49' not in response.content.decode()
+    assert loyalty_account.name in response.content.decode()
+    assert changelist_queries(url) == few
+
+def test_admin_date_hierarchy_probes_match_distinct_dates(loyalty_account):
+    from .admin import DateProbeQuerySet
+
+    tz = timezone.get_current_timezone()
+    for year, month, day in ((2024, 12, 31), (2025, 1, 1), (2025, 1, 15), (2025, 3, 2)):
+        PointsTransaction.objects.create(
+            transaction_type=1, amount=Decimal('1.00'), destination_account=loyalty_account,
+            transaction_date=timezone.datetime(year, month, day, 12, tzinfo=tz),
+        )
+    queryset = PointsTransaction.objects.all()
+    probe = DateProbeQuerySet(queryset)
+    assert probe.datetimes('transaction_date', 'year') == list(queryset.datetimes('transaction_date', 'year'))
+    january = queryset.filter(transaction_date__year=2025)
+    assert DateProbeQuerySet(january).datetimes('transaction_date', 'month') == list(january.datetimes('transaction_date', 'month'))
+    assert DateProbeQuerySet(january).datetimes('transaction_date', 'day') == list(january.datetimes('transaction_date', 'day'))
+
+
+def test_shard_router_routes_user_data_to_current_shard(settings):
+    from .sharding import ShardRouter, assign_shard, atomic, shard_for_user, use_shard
+
+    settings.SHARD_ALIASES = ['default', 'shard1']
+    router = ShardRouter()
+    assert router.db_for_read(UserWallet) == 'default'
+    with use_shard('shard1'):
+        assert router.db_for_read(UserWallet) == 'shard1'
+        assert router.db_for_write(PointsTransaction) == 'shard1'
+        # Catálogo: lido no shard, escrito no default (e replicado).
+        assert router.db_for_read(LoyaltyProgram) == 'shard1'
+        assert router.db_for_write(LoyaltyProgram) == 'default'
+        # Um usuário vindo do default não puxa a carteira para lá.
+        assert router.db_for_write(UserWallet, instance=User(pk=1)) == 'shard1'
+        assert router.db_for_read(User) is None
+        assert atomic().using == 'shard1'
+    wallet = UserWallet(pk=1)
+    wallet._state.db = 'shard1'
+    assert router.db_for_read(LoyaltyAccount, instance=wallet) == 'shard1'
+    assert [assign_shard(user_id) for user_id in (1, 2, 3)] == ['shard1', 'default', 'shard1']
+    # Usuários sem UserShard são anteriores ao sharding: os dados estão no default.
+    assert shard_for_user(1) == ('default', False)
+
+
+@pytest.mark.skipif(not __import__('django.conf').conf.settings.DB_SHARDS, reason="Requer DB_SHARDS (ex: DB_SHARDS=shard1)")
+@pytest.mark.django_db(databases='__all__')
+def test_sharded_user_data_lives_in_owner_shard_and_can_move(create_user, django_capture_on_commit_callbacks):
+    from django.core.management import call_command
+    from .models import BalanceAuditLog, UserShard
+    from .sharding import shard_aliases
+
+    program = LoyaltyProgram.objects.create(name="Catálogo Compartilhado", currency_type=2)
+    users = [create_user(username=f'shard{i}', password='password123') for i in range(len(shard_aliases()))]
+    user = next(user for user in users if UserShard.objects.get(user=user).alias != 'default')
+    alias = UserShard.objects.get(user=user).alias
+    assert LoyaltyProgram.objects.using(alias).filter(pk=program.pk).exists()
+
+    client = APIClient()
+    response = client.post(reverse('token_obtain_pair'), {'username': user.username, 'password': 'password123'}, format='json')
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+    wallet_id = client.post(reverse('userwallet-list'), {'wallet_name': "Carteira"}, format='json').data['id']
+    account_id = client.post(reverse('wallet-loyaltyaccount-list', kwargs={'wallet_pk': wallet_id}), {
+        'program': program.pk, 'name': "Conta", 'current_balance': "0.00",
+    }, format='json').data['id']
+    with django_capture_on_commit_callbacks(execute=True), django_capture_on_commit_callbacks(using=alias, execute=True):
+        response = create_transaction_via_api(client, {
+            "transaction_type": 1, "destination_account": account_id, "amount": "500.00",
+            "cost": "10.00", "transaction_date": timezone.now(),
+        })
+    assert response.status_code == status.HTTP_201_CREATED
+    assert not UserWallet.objects.using('default').filter(pk=wallet_id).exists()
+    assert PointsTransaction.objects.using(alias).filter(destination_account_id=account_id).count() == 1
+    assert BalanceAuditLog.objects.using(alias).filter(account_id=account_id, transaction_id=response.data['id']).exists()
+    assert wallet_id >= 10 ** 12  # ids do shard não colidem com os do default
+
+    call_command('move_user_shard', str(user.pk), 'default', stdout=io.StringIO())
+    assert UserShard.objects.get(user=user).alias == 'default'
+    assert not UserWallet.objects.using(alias).filter(pk=wallet_id).exists()
+    response = client.get(reverse('summary-overall'))
+    assert response.status_code == status.HTTP_200_OK
+    assert [account['id'] for account in client.get(reverse('loyaltyaccount-list-list')).data] == [account_id]
+    assert LoyaltyAccount.objects.using('default').get(pk=account_id).current_balance == Decimal('500.00')
+    assert BalanceAuditLog.objects.using('default').filter(account_id=account_id, transaction_id__isnull=False).exists()
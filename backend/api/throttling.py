@@ -0,0 +1,115 @@
+"""
+Throttling por usuário com custo por endpoint (token bucket).
+
+Cada usuário (ou IP, sem autenticação) tem um balde de ``THROTTLE_BURST``
+fichas que se recompõe a ``THROTTLE_REFILL_PER_SECOND`` fichas por segundo.
+Cada requisição consome o custo do endpoint (``ENDPOINT_COSTS``, sobrescrito
+por ``THROTTLE_COSTS``), proporcional ao tempo de banco medido por rota em
+``easymiles_db_time_per_request_seconds``: um cliente em loop no resumo ou nas
+simulações de risco esgota o balde muito antes de quem navega normalmente.
+
+O estado fica no cache ``THROTTLE_CACHE`` (LocMem, por worker; nenhum serviço
+externo). Com N workers o limite efetivo é até N vezes o configurado, o que
+basta para proteger o banco sem uma ida à rede por requisição.
+
+As respostas levam ``RateLimit-Limit``, ``RateLimit-Remaining``,
+``RateLimit-Reset`` e ``RateLimit-Policy`` (draft IETF); o 429 leva
+``Retry-After``.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+# Custos relativos (1 = leitura simples por chave primária), por view e ação
+# (``endpoint_key``): a mesma ação custa o mesmo em qualquer rota que a exponha,
+# inclusive nas aninhadas (/wallets/{id}/loyalty-accounts/...).
+ENDPOINT_COSTS = {
+    'SummaryAPIView': 10,
+    'DashboardAPIView': 15,
+    'SyncAPIView': 10,
+    'SearchAPIView': 5,
+    'PointsTransactionViewSet.list': 5,
+    'LoyaltyAccountViewSet.statement': 20,
+    'LoyaltyAccountViewSet.expirations': 10,
+    'LoyaltyAccountViewSet.balance_at': 3,
+    'LoyaltyAccountViewSet.import_statement': 50,
+    'LoyaltyAccountViewSet.audit': 5,
+    'SimulationViewSet.transfer': 2,
+    'SimulationViewSet.sale': 2,
+    'SimulationViewSet.allocate': 5,
+    'SimulationViewSet.risk': 50,
+}
+DEFAULT_COST = 1
+
+_lock = threading.Lock()
+
+
+def endpoint_key(view):
+    """``'ViewSet.ação'`` para viewsets, o nome da classe para as demais views."""
+    action = getattr(view, 'action', None)
+    return f'{type(view).__name__}.{action}' if action else type(view).__name__
+
+
+def endpoint_cost(key):
+    costs = {**ENDPOINT_COSTS, **getattr(settings, 'THROTTLE_COSTS', {})}
+    return costs.get(key, DEFAULT_COST)
+
+
+class CostWeightedThrottle(BaseThrottle):
+    def __init__(self):
+        self.capacity = settings.THROTTLE_BURST
+        self.rate = settings.THROTTLE_REFILL_PER_SECOND
+        self.cache = caches[settings.THROTTLE_CACHE]
+        self.tokens = self.capacity
+        self.cost = DEFAULT_COST
+
+    def get_cache_key(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'throttle:user:{request.user.pk}'
+        return f'throttle:anon:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        if not self.capacity:
+            return True
+        self.cost = min(endpoint_cost(endpoint_key(view)), self.capacity)
+        key = self.get_cache_key(request)
+        window = math.ceil(self.capacity / self.rate)
+
+        # LocMem é por processo: o lock local basta para a leitura+escrita ser atômica.
+        with _lock:
+            now = time.monotonic()
+            tokens, updated_at = self.cache.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= self.cost
+            if allowed:
+                tokens -= self.cost
+            self.cache.set(key, (tokens, now), window)
+        self.tokens = tokens
+
+        request._request.ratelimit = {
+            'RateLimit-Limit': str(self.capacity),
+            'RateLimit-Remaining': str(math.floor(tokens)),
+            'RateLimit-Reset': str(math.ceil((self.capacity - tokens) / self.rate)),
+            'RateLimit-Policy': f'{self.capacity};w={window}',
+        }
+        return allowed
+
+    def wait(self):
+        return math.ceil((self.cost - self.tokens) / self.rate)
+
+
+class RateLimitHeadersMiddleware:
+    """Copia para a resposta os cabeçalhos ``RateLimit-*`` calculados pelo throttle."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        for header, value in getattr(request, 'ratelimit', {}).items():
+            response.setdefault(header, value)
+        return response
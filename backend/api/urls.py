@@ -14,8 +14,13 @@ from .views import (
     UserRegistrationAPIView,
     UserProfileAPIView,
     SimulationViewSet,
-    SummaryAPIView
+    SummaryAPIView,
+    DashboardAPIView,
+    SyncAPIView,
+    SearchAPIView,
+    DeletionJobViewSet,
 )
+from .streams import EventStreamTicketAPIView, event_stream
 
 router = routers.DefaultRouter()
 router.register(r'loyalty-programs', LoyaltyProgramViewSet, basename='loyaltyprogram')
@@ -23,6 +28,7 @@ router.register(r'wallets', UserWalletViewSet, basename='userwallet')
 router.register(r'loyalty-accounts', LoyaltyAccountViewSet, basename='loyaltyaccount-list')
 router.register(r'transactions', PointsTransactionViewSet, basename='pointstransaction-list')
 router.register(r'simulations', SimulationViewSet, basename='simulation')
+router.register(r'deletion-jobs', DeletionJobViewSet, basename='deletionjob')
 
 wallets_router = routers.NestedSimpleRouter(router, r'wallets', lookup='wallet')
 wallets_router.register(r'loyalty-accounts', LoyaltyAccountViewSet, basename='wallet-loyaltyaccount')
@@ -43,4 +49,10 @@ urlpatterns = [
     path('users/me/', UserProfileAPIView.as_view(), name='user-me'),
 
     path('summary/overall/', SummaryAPIView.as_view(), name='summary-overall'),
+    path('dashboard/', DashboardAPIView.as_view(), name='dashboard'),
+    path('sync/', SyncAPIView.as_view(), name='sync'),
+    path('search/', SearchAPIView.as_view(), name='search'),
+
+    path('events/ticket/', EventStreamTicketAPIView.as_view(), name='events-ticket'),
+    path('events/stream/', event_stream, name='events-stream'),
 ]
\ No newline at end of file
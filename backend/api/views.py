@@ -1,16 +1,38 @@
 from rest_framework import viewsets, status, generics, views, serializers
-from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.reverse import reverse
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from django.db import transaction as db_transaction
-from django.db.models import Sum, Avg, F, Q, Case, When, Value, DecimalField, Count
+from django.http import HttpResponse, StreamingHttpResponse
+from django.db.models import Q
 from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from decimal import Decimal, ROUND_HALF_UP
-
-
-from .models import LoyaltyProgram, UserWallet, LoyaltyAccount, PointsTransaction
+import time
+
+
+from .models import normalize_search_text, LoyaltyProgram, UserWallet, LoyaltyAccount, PointsTransaction, SyncCounter, SyncTombstone, DeletionJob, BalanceAuditLog
+from .allocation import allocate_sale
+from .archive import MergedTransactions, archived_transactions
+from .audit import audited
+from .deletion import schedule_deletion
+from .events import BalanceTracker
+from .expiration import forecast_expirations
+from .fieldsets import SparseFieldsetMixin
+from .importer import StatementImportError, import_statement, mapping_for
+from .filters import PeriodFilterSerializer, TransactionFilterBackend, transaction_filters
+from .ledger import BALANCE_FIELDS, balance_at, rederive_balances, weighted_average_cost
+from .memo import account_versions, normalize_inputs, simulation_cache
+from .metrics import SIMULATION_LATENCY, SIMULATIONS, TRANSACTIONS_APPLIED, record_cache
+from .summary import build_summary, transaction_totals
+from .risk import RISK_PARAMETERS, simulate_risk
+from .search import search_accounts, search_transactions
+from .sharding import atomic
+from .singleflight import request_key, single_flight
+from .statements import RENDERERS, Statement, cached_stream, statement_cache
 from .serializers import (
     LoyaltyProgramSerializer,
     UserWalletSerializer,
@@ -19,7 +41,18 @@ from .serializers import (
     UserRegistrationSerializer,
     CurrentUserSerializer,
     SimulateTransferSerializer,
-    SimulateSaleSerializer
+    SimulateSaleSerializer,
+    SimulateRiskSerializer,
+    SimulateAllocationSerializer,
+    SearchQuerySerializer,
+    AutocompleteQuerySerializer,
+    BalanceAtQuerySerializer,
+    StatementQuerySerializer,
+    ExpirationForecastQuerySerializer,
+    DeletionJobSerializer,
+    BalanceAuditLogSerializer,
+    AuditQuerySerializer,
+    StatementImportSerializer,
 )
 
 User = get_user_model()
@@ -36,18 +69,42 @@ class UserProfileAPIView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user
 
-class LoyaltyProgramViewSet(viewsets.ModelViewSet):
+class LoyaltyProgramViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = LoyaltyProgram.objects.all()
     serializer_class = LoyaltyProgramSerializer
     permission_classes = [IsAuthenticated]
 
-    def get_queryset(self):
+    def visibility_filter(self):
         user = self.request.user
         if user.is_authenticated:
-            return LoyaltyProgram.objects.filter(
-                Q(is_user_created=False) | Q(created_by=user)
-            ).distinct().order_by('name')
-        return LoyaltyProgram.objects.filter(is_user_created=False).order_by('name')
+            return Q(is_user_created=False) | Q(created_by=user)
+        return Q(is_user_created=False)
+
+    def get_queryset(self):
+        return LoyaltyProgram.objects.filter(self.visibility_filter()).distinct().order_by('name')
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """
+        Programas cujo nome começa com ``?q=`` (sem diferenciar maiúsculas e
+        acentos), até ``?limit=10``. Cada tecla é uma busca por intervalo no
+        índice de ``search_name``, sem ``DISTINCT`` nem contagem.
+        """
+        query = AutocompleteQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        prefix = normalize_search_text(query.validated_data['q'])
+        programs = (
+            LoyaltyProgram.objects
+            .filter(self.visibility_filter(), search_name__startswith=prefix)
+            .order_by('search_name', 'pk')
+            .values('id', 'name', 'currency_type', 'is_active', 'is_user_created')
+            [:query.validated_data['limit']]
+        )
+        response = Response(list(programs))
+        # Resposta por usuário (programas próprios): só o cache do navegador.
+        patch_cache_control(response, private=True, max_age=settings.PROGRAM_AUTOCOMPLETE_MAX_AGE)
+        patch_vary_headers(response, ['Authorization'])
+        return response
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user, is_user_created=True)
@@ -58,7 +115,9 @@ class LoyaltyProgramViewSet(viewsets.ModelViewSet):
         if program.is_user_created and program.created_by == request.user:
             program.is_active = not program.is_active
             program.save()
-            LoyaltyAccount.objects.filter(program=program).update(is_active=program.is_active)
+            LoyaltyAccount.objects.filter(program=program).update(
+                is_active=program.is_active, change_seq=SyncCounter.next_value(request.user.pk)
+            )
             serializer = self.get_serializer(program)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(
@@ -83,17 +142,61 @@ class LoyaltyProgramViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class UserWalletViewSet(viewsets.ModelViewSet):
+def visible_wallets(user):
+    """Carteiras do usuário, sem as que têm exclusão em andamento (ou falha)."""
+    return UserWallet.objects.filter(user=user).exclude(pk__in=DeletionJob.hidden_targets(DeletionJob.TARGET_WALLET))
+
+
+def _deletion_response(request, target_type, target_id):
+    job, created = schedule_deletion(request.user, target_type, target_id)
+    response = Response(DeletionJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+    response['Location'] = reverse('deletionjob-detail', kwargs={'pk': job.pk}, request=request)
+    return response
+
+
+class DeletionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Progresso das exclusões em lotes do usuário."""
+    serializer_class = DeletionJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return DeletionJob.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """Executa de novo um job que falhou (o alvo continua escondido enquanto isso)."""
+        job = self.get_object()
+        if job.status != DeletionJob.STATUS_FAILED:
+            return Response({"detail": "Só jobs que falharam podem ser executados de novo."}, status=status.HTTP_400_BAD_REQUEST)
+        return _deletion_response(request, job.target_type, job.target_id)
+
+
+class UserWalletViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = UserWalletSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return UserWallet.objects.filter(user=self.request.user).order_by('-created_at')
+        return visible_wallets(self.request.user).order_by('-created_at')
 
+    @atomic
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class LoyaltyAccountViewSet(viewsets.ModelViewSet):
+    @atomic
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
+    @action(detail=True, methods=['post'])
+    def purge(self, request, pk=None):
+        """Exclui a carteira em segundo plano, em lotes (para históricos grandes). Acompanhe em ``deletion-jobs``."""
+        wallet = self.get_object()
+        return _deletion_response(request, DeletionJob.TARGET_WALLET, wallet.pk)
+
+class LoyaltyAccountViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = LoyaltyAccountSerializer
     permission_classes = [IsAuthenticated]
 
@@ -101,35 +204,149 @@ class LoyaltyAccountViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if 'wallet_pk' in self.kwargs:
             wallet_pk = self.kwargs['wallet_pk']
-            get_object_or_404(UserWallet, pk=wallet_pk, user=user)
+            get_object_or_404(visible_wallets(user), pk=wallet_pk)
             return LoyaltyAccount.objects.filter(wallet_id=wallet_pk, wallet__user=user,is_active=True).select_related('program', 'wallet').order_by('name')
         return LoyaltyAccount.objects.filter(wallet__user=user,is_active=True).select_related('program', 'wallet').order_by('wallet__wallet_name', 'name')
 
+    @atomic
     def perform_create(self, serializer):
         user = self.request.user
+        tracker = BalanceTracker(user.id, [])
         if 'wallet_pk' in self.kwargs:
             wallet_pk = self.kwargs['wallet_pk']
-            wallet = get_object_or_404(UserWallet, pk=wallet_pk, user=user)
-            serializer.save(wallet=wallet, last_updated=serializer.validated_data.get('last_updated', timezone.now()))
+            wallet = get_object_or_404(visible_wallets(user), pk=wallet_pk)
+            account = serializer.save(wallet=wallet, last_updated=serializer.validated_data.get('last_updated', timezone.now()))
         else:
-            serializer.save(last_updated=serializer.validated_data.get('last_updated', timezone.now()))
+            account = serializer.save(last_updated=serializer.validated_data.get('last_updated', timezone.now()))
+        tracker.track(account.id)
+        tracker.publish_on_commit('account.created', {'id': account.id})
 
+    @atomic
     def perform_update(self, serializer):
         account_instance = serializer.instance
         if account_instance.wallet.user != self.request.user:
             self.permission_denied(self.request, message="Você não tem permissão para editar esta conta.")
+        tracker = BalanceTracker(self.request.user.id, [account_instance.id])
         serializer.save(last_updated=serializer.validated_data.get('last_updated', timezone.now()))
+        tracker.publish_on_commit('account.updated', {'id': account_instance.id})
+
+    @atomic
+    def perform_destroy(self, instance):
+        tracker = BalanceTracker(self.request.user.id, [instance.id])
+        account_id = instance.id
+        instance.delete()
+        tracker.publish_on_commit('account.deleted', {'id': account_id})
+
+    @action(detail=True, methods=['post'])
+    def purge(self, request, pk=None, **kwargs):
+        """Exclui a conta em segundo plano, em lotes (para históricos grandes). Acompanhe em ``deletion-jobs``."""
+        account = self.get_object()
+        return _deletion_response(request, DeletionJob.TARGET_ACCOUNT, account.pk)
+
+    @action(detail=False, methods=['get'])
+    def expirations(self, request, **kwargs):
+        """Pontos a expirar por mês em cada conta (``?months=12``), pela validade do programa."""
+        query = ExpirationForecastQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        accounts = self.get_queryset().filter(program__validity_months__gt=0, current_balance__gt=0)
+        return Response(forecast_expirations(accounts, months=query.validated_data['months']))
+
+    @action(detail=True, methods=['get'], url_path='balance-at')
+    def balance_at(self, request, pk=None, **kwargs):
+        """Saldo e custo médio da conta numa data (``?at=2025-01-31T23:59:59Z``)."""
+        account = self.get_object()
+        query = BalanceAtQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        at = query.validated_data['at']
+        balance, average_cost, transaction = balance_at(account, at)
+        if balance is None:
+            return Response(
+                {"detail": "Saldo indisponível para esta data (histórico arquivado sem saldo gravado)."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response({
+            "account": account.pk,
+            "at": at,
+            "balance": balance,
+            "average_cost": average_cost,
+            "transaction": transaction.pk if transaction is not None else None,
+        })
+
+    @action(detail=True, methods=['get'])
+    def audit(self, request, pk=None, **kwargs):
+        """Mudanças de saldo/custo médio da conta, mais recentes primeiro (``?since=...&until=...&limit=100``)."""
+        account = self.get_object()
+        query = AuditQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        logs = BalanceAuditLog.objects.filter(account_id=account.pk)
+        if query.validated_data.get('since') is not None:
+            logs = logs.filter(created_at__gte=query.validated_data['since'])
+        if query.validated_data.get('until') is not None:
+            logs = logs.filter(created_at__lt=query.validated_data['until'])
+        logs = logs.order_by('-created_at', '-pk')[:query.validated_data['limit']]
+        return Response(BalanceAuditLogSerializer(logs, many=True).data)
+
+    @action(detail=True, methods=['post'], url_path='import', url_name='import')
+    def import_statement(self, request, pk=None, **kwargs):
+        """
+        Importa um extrato CSV do programa (multipart ``file`` e, opcionalmente,
+        ``mapping``). Linhas já importadas são puladas.
+        """
+        account = self.get_object()
+        upload = StatementImportSerializer(data=request.data)
+        upload.is_valid(raise_exception=True)
+        tracker = BalanceTracker(request.user.id, [account.pk])
+        try:
+            mapping = mapping_for(account.program, upload.validated_data.get('mapping'))
+            result = import_statement(account, upload.validated_data['file'].file, mapping)
+        except StatementImportError as exc:
+            return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        if result['created']:
+            tracker.publish_on_commit('statement.imported', {'account': account.pk, 'created': result['created']})
+        return Response(result, status=status.HTTP_201_CREATED if result['created'] else status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'], url_path='statement')
+    def statement(self, request, pk=None, **kwargs):
+        """Extrato mensal em CSV ou PDF (``?month=2025-01&output=pdf``), gerado em streaming."""
+        account = self.get_object()
+        query = StatementQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        output = query.validated_data['output']
+        statement = Statement(account, query.validated_data['month'])
+        if not statement.available:
+            return Response(
+                {"detail": "Extrato indisponível para este mês (histórico arquivado sem saldo gravado)."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        render, content_type = RENDERERS[output]
+        key = statement.cache_key(output)
+        cached = statement_cache().get(key) if key is not None else None
+        if key is not None:
+            record_cache('statement', cached is not None)
+        if cached is not None:
+            response = HttpResponse(cached, content_type=content_type)
+        else:
+            chunks = render(statement)
+            response = StreamingHttpResponse(
+                cached_stream(chunks, key) if key is not None else chunks, content_type=content_type
+            )
+        response['Content-Disposition'] = f'attachment; filename="{statement.filename(output)}"'
+        return response
 
 
-class PointsTransactionViewSet(viewsets.ModelViewSet):
+class PointsTransactionViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = PointsTransactionSerializer
     permission_classes = [IsAuthenticated]
+    filter_backends = [TransactionFilterBackend]
 
     def get_queryset(self):
         user = self.request.user
+        # Subconsulta por ids de conta: cada ramo do OR usa o índice (conta, tipo, data) em vez de joins.
+        user_accounts = LoyaltyAccount.objects.filter(wallet__user=user).values('pk')
         base_queryset = PointsTransaction.objects.filter(
-            Q(origin_account__wallet__user=user) | Q(destination_account__wallet__user=user)
-        ).distinct().select_related(
+            Q(origin_account__in=user_accounts) | Q(destination_account__in=user_accounts)
+        ).select_related(
             'origin_account__program', 'origin_account__wallet',
             'destination_account__program', 'destination_account__wallet'
         ).order_by('-transaction_date', '-created_at')
@@ -142,25 +359,82 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
             )
         return base_queryset
 
-    @db_transaction.atomic
+    def list(self, request, *args, **kwargs):
+        transactions = self.filter_queryset(self.get_queryset())
+
+        # Read-through do arquivo frio quando o período pedido alcança meses arquivados.
+        filters = dict(transaction_filters(request))
+        if 'account_pk' in self.kwargs:
+            filters['account'] = int(self.kwargs['account_pk'])
+        archived = archived_transactions(request.user, filters)
+        if archived:
+            transactions = MergedTransactions(transactions, archived)
+
+        page = self.paginate_queryset(transactions)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(transactions, many=True)
+        return Response(serializer.data)
+
+    @atomic
     def perform_create(self, serializer):
         transaction = serializer.save()
+        tracker = BalanceTracker(self.request.user.id, self._transaction_account_ids(transaction))
         self._apply_transaction_effects(transaction)
+        self._rederive_balances(self._transaction_account_ids(transaction), transaction.transaction_date, transaction)
+        tracker.publish_on_commit('transaction.created', self._transaction_event_data(transaction))
 
-    @db_transaction.atomic
+    @atomic
     def perform_update(self, serializer):
         original_instance = self.get_object()
         self._ensure_transaction_ownership(original_instance, self.request.user)
         old_transaction_state = PointsTransaction.objects.get(pk=original_instance.pk)
+        data = serializer.validated_data
+        tracker = BalanceTracker(self.request.user.id, self._transaction_account_ids(old_transaction_state) + [
+            acc.pk for acc in (data.get('origin_account'), data.get('destination_account')) if acc is not None
+        ])
         self._reverse_transaction_effects(old_transaction_state)
         updated_transaction = serializer.save()
+        # As contas validadas pelo serializer foram carregadas antes da reversão: recarrega o saldo revertido.
+        for account in (updated_transaction.origin_account, updated_transaction.destination_account):
+            if account is not None:
+                account.refresh_from_db()
         self._apply_transaction_effects(updated_transaction)
+        self._rederive_balances(
+            self._transaction_account_ids(old_transaction_state) + self._transaction_account_ids(updated_transaction),
+            min(old_transaction_state.transaction_date, updated_transaction.transaction_date),
+            updated_transaction,
+        )
+        tracker.publish_on_commit('transaction.updated', self._transaction_event_data(updated_transaction))
 
-    @db_transaction.atomic
+    @atomic
     def perform_destroy(self, instance):
         self._ensure_transaction_ownership(instance, self.request.user)
+        tracker = BalanceTracker(self.request.user.id, self._transaction_account_ids(instance))
+        event_data = self._transaction_event_data(instance)
         self._reverse_transaction_effects(instance)
+        account_ids, transaction_date = self._transaction_account_ids(instance), instance.transaction_date
         instance.delete()
+        self._rederive_balances(account_ids, transaction_date)
+        tracker.publish_on_commit('transaction.deleted', event_data)
+
+    def _rederive_balances(self, account_ids, since, transaction=None):
+        """Atualiza o saldo gravado das transações a partir de ``since`` e o reflete na instância da resposta."""
+        rederive_balances(account_ids, since)
+        if transaction is not None:
+            transaction.refresh_from_db(fields=BALANCE_FIELDS + ['change_seq'])
+
+    def _transaction_account_ids(self, transaction):
+        return [pk for pk in (transaction.origin_account_id, transaction.destination_account_id) if pk is not None]
+
+    def _transaction_event_data(self, transaction):
+        return {
+            'id': transaction.pk,
+            'transaction_type': transaction.transaction_type,
+            'origin_account': transaction.origin_account_id,
+            'destination_account': transaction.destination_account_id,
+        }
 
     def _ensure_transaction_ownership(self, transaction_instance, user):
         is_owner = False
@@ -171,8 +445,10 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
         if not is_owner:
             self.permission_denied(self.request, message="Você não tem permissão para modificar esta transação.")
 
+    @audited
     def _apply_transaction_effects(self, transaction: PointsTransaction):
         ttype = transaction.transaction_type
+        TRANSACTIONS_APPLIED.labels(transaction_type=str(ttype)).inc()
         amount = abs(transaction.amount)
         cost = transaction.cost if transaction.cost is not None else Decimal('0.00')
 
@@ -187,18 +463,9 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
 
     def _calculate_new_average_cost(self, current_balance, current_avg_cost, added_amount, added_cost):
         """Calcula o novo custo médio ponderado após uma adição de pontos."""
-        if added_amount <= 0:
-            return current_avg_cost
-            
-        old_total_cost = (current_balance / Decimal('1000.0')) * current_avg_cost
-        new_total_cost = old_total_cost + added_cost
-        new_total_balance = current_balance + added_amount
-
-        if new_total_balance > 0:
-            new_avg = (new_total_cost / new_total_balance) * Decimal('1000.0')
-            return new_avg.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        return Decimal('0.00')
+        return weighted_average_cost(current_balance, current_avg_cost, added_amount, added_cost)
 
+    @audited
     def _apply_manual_inclusion(self, transaction, amount, cost):
         if not transaction.destination_account:
             return
@@ -211,6 +478,7 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
         acc.last_updated = timezone.now()
         acc.save()
 
+    @audited
     def _apply_transfer(self, transaction, amount, cost):
         if not transaction.origin_account or not transaction.destination_account:
             return
@@ -239,6 +507,7 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
         dest.last_updated = timezone.now()
         dest.save()
 
+    @audited
     def _apply_debit_transaction(self, transaction, amount):
         """Aplica Resgate, Venda ou Expiração (apenas debita saldo)."""
         if transaction.origin_account:
@@ -247,6 +516,7 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
             acc.last_updated = timezone.now()
             acc.save()
 
+    @audited
     def _apply_balance_adjustment(self, transaction, amount, cost):
         if transaction.destination_account: # Ajuste de Crédito
             acc = transaction.destination_account
@@ -265,6 +535,7 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
             acc.last_updated = timezone.now()
             acc.save()
 
+    @audited
     def _reverse_transaction_effects(self, transaction: PointsTransaction):
         """Reverte os efeitos financeiros de uma transação (ex: ao deletar ou editar)."""
         ttype = transaction.transaction_type
@@ -297,6 +568,7 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
         except LoyaltyAccount.DoesNotExist:
             pass
 
+    @audited
     def _reverse_transfer(self, transaction, amount):
         # Devolve os pontos para a origem
         self._safe_update_balance(transaction.origin_account, amount)
@@ -308,6 +580,7 @@ class PointsTransactionViewSet(viewsets.ModelViewSet):
         
         self._safe_update_balance(transaction.destination_account, -amount_to_remove)
 
+    @audited
     def _reverse_balance_adjustment(self, transaction, amount):
         if transaction.destination_account:
             self._safe_update_balance(transaction.destination_account, -amount)
@@ -319,17 +592,54 @@ class SimulationViewSet(viewsets.ViewSet):
     serializer_action_classes = {
         'transfer': SimulateTransferSerializer,
         'sale': SimulateSaleSerializer,
+        'risk': SimulateRiskSerializer,
+        'allocate': SimulateAllocationSerializer,
     }
 
     def get_serializer_class(self):
         return self.serializer_action_classes.get(self.action, serializers.Serializer)
 
+    def initial(self, request, *args, **kwargs):
+        self.started_at = time.perf_counter()
+        self.cache_result = 'bypass'
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if response.status_code == status.HTTP_200_OK and self.action in self.serializer_action_classes:
+            SIMULATIONS.labels(kind=self.action).inc()
+            SIMULATION_LATENCY.labels(kind=self.action, cache=self.cache_result).observe(
+                time.perf_counter() - self.started_at
+            )
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def cached_result(self, data, account_ids):
+        """
+        Consulta o cache de simulações (``api/memo.py``) pela versão atual das contas.
+        Retorna ``(resultado ou None, chave, versões)``; versões ``None`` quando
+        alguma conta não é do usuário (o caminho normal responde o 404).
+        """
+        versions = account_versions(self.request.user, account_ids)
+        key = (self.request.user.pk, self.action, normalize_inputs(data))
+        if versions is None:
+            return None, key, None
+        result = simulation_cache.get(key, versions)
+        self.cache_result = 'miss' if result is None else 'hit'
+        return result, key, versions
+
+    def memoize(self, key, versions, result):
+        if versions is not None:
+            simulation_cache.set(key, versions, result)
+        return Response(result)
+
     @action(detail=False, methods=['post'])
     def transfer(self, request):
         serializer = SimulateTransferSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
             user = request.user
+            cached, key, versions = self.cached_result(data, [data['from_account_id'], data['to_account_id']])
+            if cached is not None:
+                return Response(cached)
             try:
                 from_account = LoyaltyAccount.objects.get(pk=data['from_account_id'], wallet__user=user)
                 to_account = LoyaltyAccount.objects.get(pk=data['to_account_id'], wallet__user=user)
@@ -360,7 +670,7 @@ class SimulationViewSet(viewsets.ViewSet):
                 "amount_to_receive_at_destination": amount_to_receive_at_destination,
                 "estimated_cost_per_thousand_at_destination": estimated_cost_per_thousand_at_destination_val
             }
-            return Response(response_data)
+            return self.memoize(key, versions, response_data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=['post'])
@@ -368,6 +678,9 @@ class SimulationViewSet(viewsets.ViewSet):
         serializer = SimulateSaleSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
+            cached, key, versions = self.cached_result(data, [data['loyalty_account_id']])
+            if cached is not None:
+                return Response(cached)
             try:
                 account = LoyaltyAccount.objects.get(pk=data['loyalty_account_id'], wallet__user=request.user)
             except LoyaltyAccount.DoesNotExist:
@@ -400,94 +713,208 @@ class SimulationViewSet(viewsets.ViewSet):
                 "total_estimated_cost_value": total_cost_value.quantize(Decimal('0.01')),
                 "estimated_profit": estimated_profit.quantize(Decimal('0.01'))
             }
-            return Response(response_data)
+            return self.memoize(key, versions, response_data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def allocate(self, request):
+        """
+        Divide a venda de ``target_amount`` milhas entre as contas do usuário para
+        maximizar o lucro sobre o custo médio, dadas as faixas de preço do comprador.
+        """
+        serializer = SimulateAllocationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        accounts = LoyaltyAccount.objects.filter(
+            wallet__user=request.user, is_active=True, current_balance__gt=0
+        ).select_related('program')
+        if 'program_ids' in data:
+            accounts = accounts.filter(program_id__in=data['program_ids'])
+        result = allocate_sale(
+            list(accounts),
+            data['target_amount'],
+            data['price_tiers'],
+            program_limits={limit['program_id']: limit['max_amount'] for limit in data.get('program_limits', [])},
+            allow_loss=data['allow_loss'],
+        )
+        return Response(result)
+
+    @action(detail=False, methods=['post'])
+    def risk(self, request):
+        """
+        Monte Carlo do valor da carteira no horizonte (desvalorização, volatilidade
+        do milheiro e expiração): VaR, valor esperado e percentis por programa.
+        """
+        serializer = SimulateRiskSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        accounts = list(
+            LoyaltyAccount.objects.filter(wallet__user=request.user, is_active=True, current_balance__gt=0)
+            .select_related('program').only('current_balance', 'average_cost', 'program', 'program__name', 'program__custom_rate')
+        )
+        overrides = {
+            item.pop('program_id'): item for item in (dict(override) for override in data.get('overrides', []))
+        }
+        result = simulate_risk(
+            accounts,
+            paths=data['paths'],
+            horizon_months=data['horizon_months'],
+            confidence=data['confidence'],
+            params={name: data[name] for name in RISK_PARAMETERS},
+            overrides=overrides,
+            seed=data.get('seed'),
+        )
+        return Response(result)
+
+
 
 class SummaryAPIView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, format=None):
         user = request.user
-        
-        active_accounts_qs = LoyaltyAccount.objects.filter(wallet__user=user, is_active=True).select_related('program')
-        
-        # cálculo do programa patrimônio total
-        total_estimated_value = Decimal('0.00')
-        programs_data = []
-
-        if active_accounts_qs.exists():
-            annotated_accounts = active_accounts_qs.annotate(
-                account_value=Case(
-                    When(program__custom_rate__isnull=False, program__custom_rate__gt=0, 
-                         then=(F('current_balance') / Decimal('1000.0')) * F('program__custom_rate')),
-                    default=Value(Decimal('0.00')),
-                    output_field=DecimalField(max_digits=12, decimal_places=2)
-                )
+        # Período opcional (?date_after=&date_before=) para os totais de aquisição e vendas.
+        period = PeriodFilterSerializer(data=request.query_params)
+        period.is_valid(raise_exception=True)
+
+        def compute():
+            active_accounts = list(
+                LoyaltyAccount.objects.filter(wallet__user=user, is_active=True).select_related('program')
             )
-            
-            # Soma total
-            aggregation = annotated_accounts.aggregate(total_value_sum=Sum('account_value'))
-            total_estimated_value = aggregation['total_value_sum'] or Decimal('0.00')
-
-            # Agrupa por programa para somar saldos e valores de contas diferentes do mesmo programa (ex: 2 contas Smiles)
-            programs_summary_qs = annotated_accounts.values(
-                'program__name', 'program__currency_type', 'program__custom_rate'
-            ).annotate(
-                total_balance=Sum('current_balance'),
-                total_value=Sum('account_value')
-            ).order_by('-total_value') 
-
-            for item in programs_summary_qs:
-                programs_data.append({
-                    "name": item['program__name'],
-                    "currency_type": item['program__currency_type'], 
-                    "total_balance": item['total_balance'],
-                    "total_value": item['total_value']
-                })
-
-        # Resumo por Tipo (Milhas vs Pontos) 
-        currency_map = dict(LoyaltyProgram.CURRENCY_TYPE_CHOICES)
-        balances_by_currency_type = active_accounts_qs.values(
-            'program__currency_type' 
-        ).annotate(
-            total_balance=Sum('current_balance'),
-            program_count=Count('program', distinct=True) 
-        ).order_by('program__currency_type')
-
-        processed_balances = []
-        for item in balances_by_currency_type:
-            currency_type_id = item['program__currency_type']
-            processed_balances.append({
-                "currency_name": currency_map.get(currency_type_id, f"ID {currency_type_id}"),
-                "total_balance": item['total_balance'] or Decimal('0.00'),
-                "distinct_programs_count": item['program_count']
-            })
-        
-        #  Custos e Vendas
-        total_acquisition_cost = PointsTransaction.objects.filter(
-            (Q(destination_account__wallet__user=user) & Q(transaction_type=1) & Q(cost__isnull=False) & Q(cost__gt=0)) |
-            (Q(destination_account__wallet__user=user) & Q(transaction_type=2) & Q(cost__isnull=False) & Q(cost__gt=0)) 
-        ).aggregate(total_cost_sum=Sum('cost'))['total_cost_sum'] or Decimal('0.00')
-        
-        sales_summary = PointsTransaction.objects.filter(
-            origin_account__wallet__user=user, transaction_type=4, cost__isnull=False
-        ).aggregate(
-            total_points_sold=Sum('amount'),
-            total_revenue_from_sales=Sum('cost')
+            return build_summary(
+                user,
+                active_accounts,
+                total_wallets=visible_wallets(user).count(),
+                totals=transaction_totals(user, period.validated_data),
+            )
+
+        # Abas/chamadas duplicadas simultâneas compartilham um único cálculo.
+        summary_data = single_flight.do(request_key(request, 'summary'), compute, endpoint='summary')
+        return Response(summary_data)
+
+
+class SearchAPIView(views.APIView):
+    """
+    Busca ranqueada em descrições de transações e em nome/número de contas:
+    ``GET /api/search/?q=black friday&scope=transactions&page=1``.
+    """
+    permission_classes = [IsAuthenticated]
+    search_functions = {
+        'transactions': (search_transactions, PointsTransactionSerializer),
+        'accounts': (search_accounts, LoyaltyAccountSerializer),
+    }
+
+    def get(self, request, format=None):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        page, page_size = params['page'], params['page_size']
+        offset = (page - 1) * page_size
+
+        response_data = {"q": params['q'], "page": page, "page_size": page_size}
+        for scope, (search, serializer_class) in self.search_functions.items():
+            if params['scope'] not in ('all', scope):
+                continue
+            # Busca um item a mais para saber se há próxima página sem COUNT(*).
+            results = search(request.user, params['q'].strip(), offset, page_size + 1)
+            response_data[scope] = {
+                "results": serializer_class(results[:page_size], many=True).data,
+                "has_more": len(results) > page_size,
+            }
+        return Response(response_data)
+
+
+class SyncAPIView(views.APIView):
+    """
+    Sync incremental: ``GET /api/sync/?since=<token>`` devolve só carteiras,
+    contas e transações alteradas depois do token, mais as exclusões. Sem
+    ``since`` devolve tudo. O ``token`` da resposta deve ser enviado no próximo sync.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        user = request.user
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({"since": "Token de sincronização inválido."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Lido antes das consultas: alterações confirmadas depois ficam para o próximo sync.
+        token = SyncCounter.current_value(user.pk)
+        changed = Q(change_seq__lte=token)
+        if since is not None:
+            changed &= Q(change_seq__gt=since)
+
+        # Os contadores são por usuário (valores se repetem entre usuários): cada
+        # consulta parte do dono, pelos índices (dono, change_seq).
+        wallet_ids = UserWallet.objects.filter(user=user).values('pk')
+        account_ids = LoyaltyAccount.objects.filter(wallet__in=wallet_ids).values('pk')
+        wallets = UserWallet.objects.filter(changed, user=user).select_related('user').order_by('change_seq')
+        accounts = LoyaltyAccount.objects.filter(changed, wallet__in=wallet_ids).select_related(
+            'program', 'wallet'
+        ).order_by('change_seq')
+        # Um ramo por lado da transação, cada um no seu índice (conta, change_seq).
+        changed_ids = PointsTransaction.objects.filter(changed, origin_account__in=account_ids).order_by().values('pk').union(
+            PointsTransaction.objects.filter(changed, destination_account__in=account_ids).order_by().values('pk')
         )
+        transactions = PointsTransaction.objects.filter(pk__in=changed_ids).select_related(
+            'origin_account', 'destination_account'
+        ).order_by('change_seq')
+
+        deleted = {'wallets': [], 'loyalty_accounts': [], 'transactions': []}
+        if since is not None:
+            tombstone_keys = {'wallet': 'wallets', 'account': 'loyalty_accounts', 'transaction': 'transactions'}
+            tombstones = SyncTombstone.objects.filter(
+                user=user, change_seq__gt=since, change_seq__lte=token
+            ).order_by('change_seq').values_list('model_name', 'object_id')
+            for model_name, object_id in tombstones:
+                deleted[tombstone_keys[model_name]].append(object_id)
+
+        return Response({
+            "token": str(token),
+            "wallets": UserWalletSerializer(wallets, many=True).data,
+            "loyalty_accounts": LoyaltyAccountSerializer(accounts, many=True).data,
+            "transactions": PointsTransactionSerializer(transactions, many=True).data,
+            "deleted": deleted,
+        })
+
+
+class DashboardAPIView(views.APIView):
+    """
+    Carteiras, contas, programas e resumo numa única requisição. As contas são
+    carregadas uma vez (com programa) e o resumo é derivado delas em memória.
+    """
+    permission_classes = [IsAuthenticated]
 
-        summary_data = {
-            "user_id": user.id,
-            "username": user.username,
-            "total_wallets": UserWallet.objects.filter(user=user).count(),
-            "total_active_loyalty_accounts": active_accounts_qs.count(),
-            "overall_estimated_value": total_estimated_value.quantize(Decimal('0.01')),
-            "programs_summary": programs_data,
-            "balances_by_currency_type": processed_balances,
-            "total_acquisition_cost_tracked": total_acquisition_cost.quantize(Decimal('0.01')),
-            "total_points_milhas_sold": sales_summary['total_points_sold'] or Decimal('0.00'),
-            "total_revenue_from_sales": sales_summary['total_revenue_from_sales'] or Decimal('0.00'),
+    def get(self, request, format=None):
+        # Abas/chamadas duplicadas simultâneas compartilham um único cálculo.
+        data = single_flight.do(request_key(request, 'dashboard'), lambda: self.build(request.user), endpoint='dashboard')
+        return Response(data)
+
+    def build(self, user):
+        wallets = list(visible_wallets(user).order_by('-created_at'))
+        wallets_by_id = {wallet.pk: wallet for wallet in wallets}
+        for wallet in wallets:
+            wallet.user = user
+
+        accounts = list(
+            LoyaltyAccount.objects.filter(wallet__in=wallets, is_active=True)
+            .select_related('program').order_by('wallet__wallet_name', 'name')
+        )
+        for account in accounts:
+            account.wallet = wallets_by_id[account.wallet_id]
+
+        programs = LoyaltyProgram.objects.filter(
+            Q(is_user_created=False) | Q(created_by=user)
+        ).select_related('created_by').order_by('name')
+
+        return {
+            "wallets": UserWalletSerializer(wallets, many=True).data,
+            "loyalty_accounts": LoyaltyAccountSerializer(accounts, many=True).data,
+            "loyalty_programs": LoyaltyProgramSerializer(programs, many=True).data,
+            "summary": build_summary(user, accounts, total_wallets=len(wallets), totals=transaction_totals(user)),
         }
-        
-        return Response(summary_data)
\ No newline at end of file
@@ -3,6 +3,11 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the application served in production (gunicorn with uvicorn workers,
+see ``entrypoint.sh``). The Server-Sent Events stream (``/api/events/stream/``)
+is an async view, so long-lived connections do not pin a worker each; under
+WSGI (``runserver``, ``core.wsgi``) the view answers 501 instead of streaming.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 from decouple import config, Csv
 from datetime import timedelta 
@@ -63,6 +64,34 @@ MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
 ]
 
+# Compressão gzip/brotli negociada para respostas grandes (listas)
+API_COMPRESSION = config('API_COMPRESSION', cast=bool, default=True)
+API_COMPRESSION_MIN_LENGTH = config('API_COMPRESSION_MIN_LENGTH', cast=int, default=1024)
+API_BROTLI_QUALITY = config('API_BROTLI_QUALITY', cast=int, default=5)
+if API_COMPRESSION:
+    MIDDLEWARE.insert(1, 'api.middleware.CompressionMiddleware')
+
+MIDDLEWARE.append('api.instrumentation.QueryInstrumentationMiddleware')
+MIDDLEWARE.append('api.throttling.RateLimitHeadersMiddleware')
+MIDDLEWARE.append('api.audit.RequestIdMiddleware')
+
+# Métricas Prometheus em /metrics (requer prometheus_client). Com vários workers,
+# PROMETHEUS_MULTIPROC_DIR deve apontar para um diretório vazio no início (ver entrypoint.sh).
+# O scraper se autentica com "Authorization: Bearer <METRICS_TOKEN>"; sem token, /metrics só
+# responde com DEBUG=True.
+METRICS_ENABLED = config('METRICS_ENABLED', cast=bool, default=True)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+if METRICS_ENABLED:
+    MIDDLEWARE.insert(0, 'api.metrics.MetricsMiddleware')
+
+# Amostragem de queries lentas com EXPLAIN (relatório: manage.py query_report)
+QUERY_SAMPLER_ENABLED = config('QUERY_SAMPLER_ENABLED', cast=bool, default=False)
+QUERY_SAMPLER_THRESHOLD_MS = config('QUERY_SAMPLER_THRESHOLD_MS', cast=float, default=100)
+QUERY_SAMPLER_EXPLAIN_ANALYZE = config('QUERY_SAMPLER_EXPLAIN_ANALYZE', cast=bool, default=False)
+QUERY_SAMPLER_LOG_FILE = config('QUERY_SAMPLER_LOG_FILE', default=str(BASE_DIR / 'logs' / 'queries.log'))
+QUERY_SAMPLER_MAX_BYTES = config('QUERY_SAMPLER_MAX_BYTES', cast=int, default=10 * 1024 * 1024)
+QUERY_SAMPLER_BACKUP_COUNT = config('QUERY_SAMPLER_BACKUP_COUNT', cast=int, default=5)
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -97,6 +126,25 @@ DATABASES = {
     }
 }
 
+# Sharding por usuário (api/sharding.py): DB_SHARDS=shard1,shard2 adiciona bancos com a mesma
+# configuração do default, exceto o que vier em DB_<ALIAS>_NAME/_HOST/_PORT/_USER/_PASSWORD.
+# O default também recebe usuários; mova dados com `manage.py move_user_shard`.
+DB_SHARDS = config('DB_SHARDS', cast=Csv(), default='')
+for _alias in DB_SHARDS:
+    _prefix = f'DB_{_alias.upper()}'
+    DATABASES[_alias] = {
+        **DATABASES['default'],
+        'NAME': config(f'{_prefix}_NAME', default=f"{DATABASES['default']['NAME']}_{_alias}"),
+        'HOST': config(f'{_prefix}_HOST', default=DATABASES['default']['HOST']),
+        'PORT': config(f'{_prefix}_PORT', default=DATABASES['default']['PORT']),
+        'USER': config(f'{_prefix}_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config(f'{_prefix}_PASSWORD', default=DATABASES['default']['PASSWORD']),
+    }
+SHARD_ALIASES = ['default', *DB_SHARDS]
+if DB_SHARDS:
+    DATABASE_ROUTERS = ['api.sharding.ShardRouter']
+    MIDDLEWARE.append('api.sharding.ShardMiddleware')
+
 AUTH_USER_MODEL = 'core.User'
 
 # Password validation
@@ -148,8 +196,43 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated', # Bloqueia acesso não autenticado por padrão
     ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'api.throttling.CostWeightedThrottle',
+    ),
 }
 
+# Throttling com custo por endpoint (api/throttling.py): balde de THROTTLE_BURST fichas por usuário,
+# recomposto a THROTTLE_REFILL_PER_SECOND fichas/s. THROTTLE_BURST=0 desliga.
+THROTTLE_BURST = config('THROTTLE_BURST', cast=int, default=600)
+THROTTLE_REFILL_PER_SECOND = config('THROTTLE_REFILL_PER_SECOND', cast=float, default=10)
+THROTTLE_CACHE = 'throttle'
+# THROTTLE_COSTS: 'ViewSet.ação' ou nome da view -> custo (ver ENDPOINT_COSTS).
+THROTTLE_COSTS = {}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'easymiles-throttle',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
+# Renderer/parser JSON com orjson (mesma saída do JSONRenderer padrão, menos CPU)
+API_FAST_JSON = config('API_FAST_JSON', cast=bool, default=False)
+if API_FAST_JSON:
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] = (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    )
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'] = (
+        'api.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    )
+
 # Simple JWT settings
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60), 
@@ -181,4 +264,72 @@ SIMPLE_JWT = {
 }
 
 CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS', cast=Csv(), default="http://localhost:4200")
-CORS_ALLOW_ALL_ORIGINS = config('CORS_ALLOW_ALL_ORIGINS', cast=bool, default=False)
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = config('CORS_ALLOW_ALL_ORIGINS', cast=bool, default=False)
+
+# Eventos em tempo real (SSE em /api/events/stream/)
+# Eventos distribuídos entre workers via LISTEN/NOTIFY do PostgreSQL (sem efeito em outros bancos).
+# Com False, cada worker só entrega os eventos das escritas que ele mesmo atendeu.
+EVENTS_PG_NOTIFY = config('EVENTS_PG_NOTIFY', cast=bool, default=True)
+# Validade (segundos) dos tickets de uso único de /api/events/ticket/ para abrir o stream.
+EVENTS_TICKET_MAX_AGE = config('EVENTS_TICKET_MAX_AGE', cast=int, default=30)
+EVENTS_KEEPALIVE_SECONDS = config('EVENTS_KEEPALIVE_SECONDS', cast=int, default=15)
+# Particionamento mensal de api_pointstransaction (só PostgreSQL).
+# Meses futuros criados pela migration e por `manage.py create_transaction_partitions`.
+TRANSACTION_PARTITIONS_AHEAD = config('TRANSACTION_PARTITIONS_AHEAD', cast=int, default=3)
+
+# Arquivo frio de transações (manage.py archive_transactions; requer pyarrow)
+ARCHIVE_ROOT = config('ARCHIVE_ROOT', default=str(BASE_DIR / 'archive'))
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', cast=int, default=365)
+ARCHIVE_COMPRESSION = config('ARCHIVE_COMPRESSION', default='zstd')
+
+# Extratos mensais (/api/loyalty-accounts/{id}/statement/?month=YYYY-MM&output=csv|pdf)
+# Meses fechados ficam no cache STATEMENT_CACHE, em arquivos no disco local (compartilhado pelos
+# workers do host, fora da memória deles); extratos maiores que STATEMENT_CACHE_MAX_BYTES não são
+# guardados. O espaço fica limitado a STATEMENT_CACHE_MAX_ENTRIES * STATEMENT_CACHE_MAX_BYTES
+# (400 MB no padrão): acima de MAX_ENTRIES o cache descarta 1/3 das entradas.
+STATEMENT_CHUNK_SIZE = config('STATEMENT_CHUNK_SIZE', cast=int, default=500)
+STATEMENT_CACHE_TIMEOUT = config('STATEMENT_CACHE_TIMEOUT', cast=int, default=7 * 24 * 3600)
+STATEMENT_CACHE_MAX_BYTES = config('STATEMENT_CACHE_MAX_BYTES', cast=int, default=2 * 1024 * 1024)
+STATEMENT_CACHE_MAX_ENTRIES = config('STATEMENT_CACHE_MAX_ENTRIES', cast=int, default=200)
+STATEMENT_CACHE = 'statements'
+CACHES[STATEMENT_CACHE] = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': config('STATEMENT_CACHE_DIR', default=str(Path(tempfile.gettempdir()) / 'easymiles-statements')),
+    'TIMEOUT': STATEMENT_CACHE_TIMEOUT,
+    'OPTIONS': {'MAX_ENTRIES': STATEMENT_CACHE_MAX_ENTRIES, 'CULL_FREQUENCY': 3},
+}
+
+# Autocomplete de programas (/api/loyalty-programs/autocomplete/?q=): max-age do cache do navegador.
+PROGRAM_AUTOCOMPLETE_MAX_AGE = config('PROGRAM_AUTOCOMPLETE_MAX_AGE', cast=int, default=300)
+
+# Cache em memória das simulações de transferência/venda (entradas por worker, LRU; 0 desliga).
+SIMULATION_CACHE_SIZE = config('SIMULATION_CACHE_SIZE', cast=int, default=1024)
+SIMULATION_CACHE_TTL = config('SIMULATION_CACHE_TTL', cast=int, default=300)
+
+# Coalescência de leituras simultâneas do resumo/dashboard (api/singleflight.py).
+# 'local' só dentro do worker: depende de workers que atendem requisições em paralelo (o entrypoint.sh
+# sobe workers ASGI, que rodam as views síncronas em threads; um worker WSGI sync não coalesce nada). 'advisory' (PostgreSQL)
+# ou 'cache' também entre workers, mas só compartilham o resultado com um cache padrão entre processos.
+SINGLEFLIGHT_BACKEND = config('SINGLEFLIGHT_BACKEND', default='local')
+SINGLEFLIGHT_WAIT_TIMEOUT = config('SINGLEFLIGHT_WAIT_TIMEOUT', cast=int, default=10)
+SINGLEFLIGHT_RESULT_TTL = config('SINGLEFLIGHT_RESULT_TTL', cast=int, default=5)
+
+# Auditoria de saldos (api/audit.py): lotes gravados com bulk_create após o commit.
+# AUDIT_ASYNC entrega os lotes a uma thread do worker (registros na fila se perdem se o processo morrer).
+AUDIT_ASYNC = config('AUDIT_ASYNC', cast=bool, default=False)
+AUDIT_BATCH_SIZE = config('AUDIT_BATCH_SIZE', cast=int, default=500)
+
+# Importação de extratos CSV (POST /api/accounts/{id}/import/; api/importer.py).
+# STATEMENT_IMPORT_MAPPINGS: nome normalizado do programa -> mapeamento de colunas padrão.
+STATEMENT_IMPORT_BATCH_SIZE = config('STATEMENT_IMPORT_BATCH_SIZE', cast=int, default=2000)
+STATEMENT_IMPORT_MAPPINGS = {}
+
+# Simulação de risco (POST /api/simulations/risk/; requer numpy)
+RISK_SIMULATION_MAX_PATHS = config('RISK_SIMULATION_MAX_PATHS', cast=int, default=2_000_000)
+RISK_SIMULATION_CHUNK_SIZE = config('RISK_SIMULATION_CHUNK_SIZE', cast=int, default=250_000)
+
+# Exclusão em lotes de carteiras/contas (POST .../purge/). Sem thread (False), roda no próprio request após o commit.
+DELETION_CHUNK_SIZE = config('DELETION_CHUNK_SIZE', cast=int, default=5000)
+DELETION_JOBS_ASYNC = config('DELETION_JOBS_ASYNC', cast=bool, default=True)
+# Job em execução sem heartbeat (renovado a cada lote) há mais que isso pode ser retomado por outro executor.
+DELETION_JOB_STALE_SECONDS = config('DELETION_JOB_STALE_SECONDS', cast=int, default=300)
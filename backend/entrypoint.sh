@@ -5,5 +5,15 @@ set -e
 echo "Applying database migrations..."
 python manage.py migrate --noinput
 
+# Métricas dos workers (api/metrics.py): diretório limpo a cada inicialização.
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/easymiles-metrics}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Workers ASGI (uvicorn): o stream SSE (/api/events/stream/) fica no event loop
+# sem prender um worker por cliente, e cada requisição às views síncronas roda
+# numa thread própria, então requisições simultâneas do mesmo worker são
+# coalescidas pelo single-flight (api/singleflight.py). Os eventos chegam a
+# todos os workers via LISTEN/NOTIFY (EVENTS_PG_NOTIFY).
 echo "Starting Gunicorn server..."
-exec gunicorn --bind 0.0.0.0:8000 core.wsgi:application
\ No newline at end of file
+exec gunicorn --bind 0.0.0.0:8000 --worker-class uvicorn_worker.UvicornWorker core.asgi:application
\ No newline at end of file